@@ -0,0 +1,415 @@
+import gc
+import logging
+import typing
+from typing import Optional
+
+import numpy as np
+
+from .sample_row import SampleRow
+from .sesar_transformer import (
+    ContextCategoryMetaMapper,
+    MaterialCategoryMetaMapper,
+    SpecimenCategoryMetaMapper,
+    Transformer,
+    compile_transform_plan,
+    h3_cells_batch,
+    h3_field_resolutions,
+    material_type,
+)
+
+NOT_PROVIDED = Transformer.NOT_PROVIDED
+# the same logger Transformer reports to
+logger = logging.getLogger("isamples_metadata.SESARTransformer")
+METADATA_PUBLISHER = {
+    "role": "metadata publisher",
+    "contact_information": "info@geosamples.org; url: https://www.geosamples.org/contact/"
+}
+
+
+class ColumnarTransformer():
+    """Transforms a whole batch of SESAR samples at once, one field at a time over columns of the batch.
+
+    Where Transformer walks every method once per sample, this computes each iSamples field for the entire batch in
+    one pass over the columns it depends on: values derived from a small domain (material types, categories, sample
+    type keywords) are computed once per distinct input and joined back on, elevations and dates are converted as
+    NumPy arrays, and the H3 cells come from h3_cells_batch.  Records are assembled a column at a time from the plan
+    Transformer.transform() runs, and are identical to its records for the same samples and fields.
+
+    The input is a mapping of SampleRow field names to equal-length columns (lists or NumPy arrays), so it can be
+    built from SampleRows (from_sample_rows) or from anything with an Arrow-style to_pydict() (from_arrow).
+    """
+
+    # If True, the cycle collector is paused while a batch's records are built.  They're all acyclic, so there's
+    # nothing for it to find, but with a batch's worth of allocations it otherwise runs over and over, taking more
+    # than half the time.  Off by default, since it pauses collection for every thread in the process.
+    PAUSE_GC = False
+
+    def __init__(
+        self,
+        columns: typing.Mapping[str, typing.Sequence],
+        h3_resolutions: Optional[typing.Sequence[int]] = None
+    ):
+        self.columns = {field: ColumnarTransformer._as_list(columns[field]) for field in SampleRow._fields}
+        self.num_rows = len(self.columns["igsn"])
+        self.h3_resolutions = h3_resolutions if h3_resolutions is not None else Transformer.H3_RESOLUTIONS
+        self._h3_cells: Optional[typing.Dict[int, np.ndarray]] = None
+        self._materials: Optional[typing.List[str]] = None
+
+    @classmethod
+    def from_sample_rows(
+        cls,
+        sample_rows: typing.Sequence[SampleRow],
+        h3_resolutions: Optional[typing.Sequence[int]] = None
+    ) -> "ColumnarTransformer":
+        if len(sample_rows) == 0:
+            return cls({field: [] for field in SampleRow._fields}, h3_resolutions)
+        return cls(dict(zip(SampleRow._fields, zip(*sample_rows))), h3_resolutions)
+
+    @classmethod
+    def from_arrow(cls, table: typing.Any, h3_resolutions: Optional[typing.Sequence[int]] = None) -> "ColumnarTransformer":
+        """Build one from an Arrow table or record batch whose columns are named after the SampleRow fields"""
+        return cls(table.to_pydict(), h3_resolutions)
+
+    @staticmethod
+    def _as_list(column: typing.Sequence) -> list:
+        if isinstance(column, np.ndarray):
+            if column.dtype.kind == "f":
+                # NumPy has no None for floats, so missing values arrive as NaN
+                return [None if np.isnan(value) else value for value in column.tolist()]
+            return column.tolist()
+        return list(column)
+
+    def transform(self, fields: Optional[typing.Iterable[str]] = None) -> typing.List[typing.Dict]:
+        """The iSamples records for every sample in the batch, in input order.
+
+        The records are laid out by the plan compiled from Transformer.RECORD_SPEC, with each of its methods
+        answered by the column method of the same name here, so fields selects a subset just as it does for
+        Transformer.transform(), and only the columns those fields need are computed.
+        """
+        gc_was_enabled = gc.isenabled()
+        if type(self).PAUSE_GC:
+            gc.disable()
+        try:
+            return self._transform(fields)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _transform(self, fields: Optional[typing.Iterable[str]]) -> typing.List[typing.Dict]:
+        record_plan, h3_plan = compile_transform_plan(
+            Transformer.RECORD_SPEC, tuple(fields) if fields is not None else None
+        )
+        records = self._run_plan(record_plan)
+        h3_indexes = h3_field_resolutions(self.h3_resolutions, h3_plan)
+        if h3_plan is not None and self._h3_cells is None and len(h3_indexes) > 0:
+            # just the resolutions asked for, rather than all of h3_resolutions
+            self._h3_cells = h3_cells_batch(
+                self.columns["latitude"], self.columns["longitude"], h3_indexes, Transformer.H3_DERIVE_FROM_FINEST
+            )
+        for index in h3_indexes:
+            field = f"{Transformer.H3_FIELD_PREFIX}{index}"
+            for record, cell in zip(records, self.h3_column(index)):
+                record[field] = cell
+        return records
+
+    def _run_plan(self, plan: typing.Tuple) -> typing.List[typing.Dict[str, typing.Any]]:
+        """One dict per row for a (sub)plan, filled in a column at a time, in the plan's key order"""
+        records: typing.List[typing.Dict[str, typing.Any]] = [{} for _ in range(self.num_rows)]
+        for key, value in plan:
+            column = self._run_plan(value) if isinstance(value, tuple) else getattr(self, f"_{value}")()
+            for record, column_value in zip(records, column):
+                record[key] = column_value
+        return records
+
+    def h3_column(self, resolution: int = Transformer.DEFAULT_H3_RESOLUTION) -> typing.List[Optional[str]]:
+        """Every sample's H3 cell at the given resolution, computed together with the rest on first use"""
+        if self._h3_cells is None or resolution not in self._h3_cells:
+            resolutions = set(self.h3_resolutions)
+            resolutions.add(Transformer.DEFAULT_H3_RESOLUTION)
+            resolutions.add(resolution)
+            self._h3_cells = h3_cells_batch(
+                self.columns["latitude"], self.columns["longitude"], resolutions, Transformer.H3_DERIVE_FROM_FINEST
+            )
+        return self._h3_cells[resolution].tolist()
+
+    @staticmethod
+    def _join_distinct(keys: typing.Sequence, compute: typing.Callable) -> list:
+        """compute() applied to each key, evaluated only once per distinct key"""
+        results: dict = {}
+        joined = []
+        for key in keys:
+            if key not in results:
+                results[key] = compute(key)
+            joined.append(results[key])
+        return joined
+
+    def _material_types(self) -> typing.List[str]:
+        """Every sample's material type, which the description and two of the categories share, computed once"""
+        if self._materials is None:
+            self._materials = ColumnarTransformer._join_distinct(
+                list(zip(self.columns["classification_name"], self.columns["top_level_classification_name"])),
+                lambda names: material_type(*names)
+            )
+        return self._materials
+
+    def _constant(self, value: typing.Any) -> list:
+        return [value] * self.num_rows
+
+    def _schema_name(self) -> typing.List[str]:
+        return self._constant("iSamplesSchemaCore1.0.json")
+
+    def _id_string(self) -> typing.List[str]:
+        return ["https://data.isamples.org/digitalsample/igsn/" + igsn for igsn in self.columns["igsn"]]
+
+    def _sample_label(self) -> list:
+        return self.columns["name"]
+
+    def _sample_identifier_string(self) -> typing.List[str]:
+        return ["igsn:" + igsn for igsn in self.columns["igsn"]]
+
+    def _has_context_categories(self) -> typing.List[typing.List[str]]:
+        categories = ColumnarTransformer._join_distinct(
+            list(zip(self._material_types(), self.columns["primary_location_type"])),
+            lambda key: ContextCategoryMetaMapper.categories(*key)
+        )
+        # every record gets its own list, the same as from Transformer
+        return [list(row_categories) for row_categories in categories]
+
+    def _has_material_categories(self) -> typing.List[typing.List[str]]:
+        categories = ColumnarTransformer._join_distinct(self._material_types(), MaterialCategoryMetaMapper.categories)
+        return [list(row_categories) for row_categories in categories]
+
+    def _has_specimen_categories(self) -> typing.List[typing.List[str]]:
+        categories = ColumnarTransformer._join_distinct(
+            self.columns["sample_type_name"], SpecimenCategoryMetaMapper.categories
+        )
+        return [list(row_categories) for row_categories in categories]
+
+    def _informal_classification(self) -> typing.List[typing.List[str]]:
+        return [[NOT_PROVIDED] for _ in range(self.num_rows)]
+
+    def _sample_description(self) -> typing.List[str]:
+        descriptions = []
+        for material, collection_method, description in zip(
+            self._material_types(), self.columns["collection_method"], self.columns["description"]
+        ):
+            parts = [part for part in (material, collection_method, description) if part]
+            descriptions.append(". ".join(parts) if parts else NOT_PROVIDED)
+        return descriptions
+
+    def _keywords(self) -> typing.List[typing.List]:
+        def keywords(key: tuple) -> tuple:
+            sample_type, parent_sample_type, field_name = key
+            keyword_arr: list = []
+            if sample_type is not None:
+                sample_type_str = f"{parent_sample_type}>{sample_type}" if parent_sample_type is not None else sample_type
+                keyword_arr.append({"keyword": sample_type_str, "scheme_name": "SESAR: Sample Type"})
+            if field_name:
+                keyword_arr.append({"keyword": field_name, "scheme_name": "taxon: species"})
+            return tuple(keyword_arr) if keyword_arr else (NOT_PROVIDED,)
+
+        distinct_keywords = ColumnarTransformer._join_distinct(
+            list(zip(
+                self.columns["sample_type_name"], self.columns["parent_sample_type_name"], self.columns["field_name"]
+            )),
+            keywords
+        )
+        # every record gets its own copies, the same as from Transformer
+        return [
+            [dict(keyword) if isinstance(keyword, dict) else keyword for keyword in keyword_arr]
+            for keyword_arr in distinct_keywords
+        ]
+
+    def _produced_by_id_string(self) -> typing.List[str]:
+        return [f"igsn:{parent_igsn}" if parent_igsn is not None else "" for parent_igsn in self.columns["parent_igsn"]]
+
+    def _produced_by_feature_of_interest(self) -> typing.List[str]:
+        return [location_type or NOT_PROVIDED for location_type in self.columns["primary_location_type"]]
+
+    def _produced_by_label(self) -> typing.List[str]:
+        labels = []
+        for collection_method, cruise_field_prgrm in zip(
+            self.columns["collection_method"], self.columns["cruise_field_prgrm"]
+        ):
+            if collection_method and cruise_field_prgrm:
+                labels.append(f"{collection_method}, {cruise_field_prgrm}")
+            else:
+                labels.append(collection_method or cruise_field_prgrm or NOT_PROVIDED)
+        return labels
+
+    def _produced_by_description(self) -> typing.List[str]:
+        descriptions = []
+        for (
+            cruise_field_prgrm, launch_platform_name, collection_method, description, launch_type, nav_type
+        ) in zip(
+            self.columns["cruise_field_prgrm"],
+            self.columns["launch_platform_name"],
+            self.columns["collection_method"],
+            self.columns["description"],
+            self.columns["launch_type_name"],
+            self.columns["nav_type_name"],
+        ):
+            components = []
+            if cruise_field_prgrm:
+                components.append(f"cruiseFieldPrgrm:{cruise_field_prgrm}")
+            if launch_platform_name:
+                components.append(f"launchPlatformName:{launch_platform_name}")
+            if collection_method:
+                components.append(f"Collection method:{collection_method}")
+            if description:
+                components.append(description)
+            launch_type_str = ""
+            if launch_type is not None:
+                launch_type_str += f"launch type:{launch_type}, "
+            if nav_type is not None:
+                launch_type_str += f"navigation type:{nav_type}"
+            if len(launch_type_str) > 0:
+                components.append(launch_type_str)
+            descriptions.append(". ".join(components) if components else NOT_PROVIDED)
+        return descriptions
+
+    def _produced_by_responsibilities(self) -> typing.List[typing.List[dict]]:
+        responsibilities = []
+        for collector, cruise_field_prgrm in zip(self.columns["collector"], self.columns["cruise_field_prgrm"]):
+            row_responsibilities = []
+            if collector and collector.lower() != "curator":
+                row_responsibilities.append({"role": "collector", "name": collector})
+            if cruise_field_prgrm:
+                row_responsibilities.append({"role": "sponsor", "name": cruise_field_prgrm})
+            responsibilities.append(row_responsibilities)
+        return responsibilities
+
+    def _produced_by_result_time(self) -> typing.List[str]:
+        dates = [
+            collection_start_date or registration_date
+            for collection_start_date, registration_date in zip(
+                self.columns["collection_start_date"], self.columns["registration_date"]
+            )
+        ]
+        days = np.array(
+            [date.replace(tzinfo=None) if date is not None else None for date in dates], dtype="datetime64[D]"
+        )
+        result_times = np.datetime_as_string(days, unit="D").tolist()
+        for index, date in enumerate(dates):
+            if date is None:
+                result_times[index] = NOT_PROVIDED
+            elif date.year < 1000:
+                # NumPy zero pads the year, which strftime doesn't
+                result_times[index] = date.strftime("%Y-%m-%d")
+        return result_times
+
+    def _sampling_site_description(self) -> typing.List[str]:
+        descriptions = []
+        for locality_description, location_description in zip(
+            self.columns["locality_description"], self.columns["location_description"]
+        ):
+            if locality_description and location_description:
+                descriptions.append(f"{locality_description}; {location_description}")
+            else:
+                descriptions.append(locality_description or location_description or NOT_PROVIDED)
+        return descriptions
+
+    def _sampling_site_label(self) -> typing.List[str]:
+        return [locality or NOT_PROVIDED for locality in self.columns["locality"]]
+
+    def _sampling_site_latitude(self) -> list:
+        return self.columns["latitude"]
+
+    def _sampling_site_longitude(self) -> list:
+        return self.columns["longitude"]
+
+    def _sampling_site_elevation(self) -> typing.List[str]:
+        elevations = self.columns["elevation"]
+        units = [
+            (elevation_unit or "meters").lower().strip() for elevation_unit in self.columns["elevation_unit"]
+        ]
+        in_feet = np.array([bool(elevation) and unit == "feet" for elevation, unit in zip(elevations, units)], dtype=bool)
+        converted = np.zeros(self.num_rows, dtype=np.float64)
+        if in_feet.any():
+            feet = np.array([float(str(elevation)) for elevation in np.array(elevations, dtype=object)[in_feet]])
+            converted[in_feet] = feet / Transformer.FEET_PER_METER
+        converted_list = converted.tolist()
+        elevation_strs = []
+        for index, (elevation, unit) in enumerate(zip(elevations, units)):
+            if not elevation:
+                elevation_strs.append(NOT_PROVIDED)
+            elif unit == "feet":
+                elevation_strs.append(f"{converted_list[index]} m")
+            elif unit == "meters":
+                elevation_strs.append(f"{elevation} m")
+            else:
+                logger.error("Received elevation in unexpected unit: %s", unit)
+                elevation_strs.append(str(elevation))
+        return elevation_strs
+
+    def _sampling_site_place_names(self) -> typing.List[typing.List[str]]:
+        place_names = []
+        for primary_location_name, province, county, city in zip(
+            self.columns["primary_location_name"],
+            self.columns["province"],
+            self.columns["county"],
+            self.columns["city"],
+        ):
+            row_place_names = primary_location_name.split("; ") if primary_location_name else []
+            row_place_names.extend(place_name for place_name in (province, county, city) if place_name)
+            place_names.append(row_place_names)
+        return place_names
+
+    def _sample_registrant(self) -> typing.List[str]:
+        registrants = []
+        for registrant_id, fname, lname in zip(
+            self.columns["cur_registrant_id"],
+            self.columns["cur_registrant_fname"],
+            self.columns["cur_registrant_lname"],
+        ):
+            if registrant_id is None:
+                registrants.append(NOT_PROVIDED)
+            elif fname.lower() == "curator":
+                registrants.append(lname)
+            else:
+                registrants.append(f"{fname} {lname}")
+        return registrants
+
+    def _sample_sampling_purpose(self) -> typing.List[str]:
+        return [purpose or NOT_PROVIDED for purpose in self.columns["purpose"]]
+
+    def _related_resources(self) -> typing.List[list]:
+        return [[] for _ in range(self.num_rows)]
+
+    def _authorized_by(self) -> typing.List[list]:
+        return [[] for _ in range(self.num_rows)]
+
+    def _complies_with(self) -> typing.List[list]:
+        return [[] for _ in range(self.num_rows)]
+
+    def _curation_label(self) -> typing.List[str]:
+        return self._constant(NOT_PROVIDED)
+
+    def _curation_description(self) -> typing.List[str]:
+        return self._constant(NOT_PROVIDED)
+
+    def _curation_access_constraints(self) -> typing.List[str]:
+        return self._constant(NOT_PROVIDED)
+
+    def _curation_location(self) -> typing.List[str]:
+        return [archive or NOT_PROVIDED for archive in self.columns["current_archive"]]
+
+    def _curation_responsibility(self) -> typing.List[typing.List[dict]]:
+        responsibilities = []
+        for owner_id, fname, lname, email in zip(
+            self.columns["cur_owner_id"],
+            self.columns["cur_owner_fname"],
+            self.columns["cur_owner_lname"],
+            self.columns["cur_owner_email"],
+        ):
+            responsibility: list[dict] = []
+            if owner_id is not None:
+                if fname.lower() == "curator":
+                    owner_name = lname
+                    responsibility.append({"role": "curator", "name": owner_name})
+                else:
+                    owner_name = f"{fname} {lname}"
+                responsibility.append({"role": "sample owner", "name": owner_name, "contact_information": email})
+            responsibility.append(dict(METADATA_PUBLISHER))
+            responsibilities.append(responsibility)
+        return responsibilities
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import typing
+
+from sqlmodel import Field, Session, SQLModel, delete, select
+
+from .thing_sink import upsert_statement
+
+# How many thing ids go into one IN (...) or one multi-row INSERT
+CONTENT_HASH_BATCH_SIZE = 1000
+
+
+class ThingContentHash(SQLModel, table=True):
+    """The hash of the record last written for a SESAR thing, kept in the iSB database next to the things.
+
+    The thing table belongs to iSB, so the hash lives in a side table of its own rather than a column on Thing.
+    """
+    __tablename__ = "sesar_thing_content_hash"
+
+    thing_id: str = Field(primary_key=True)
+    content_hash: str
+
+
+def record_content_hash(record: typing.Dict) -> str:
+    """A stable SHA-256 of a transformed record: the same record always hashes the same, whatever its key order"""
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ContentHashStore():
+    """Reads and writes ThingContentHash rows, so the loader can skip things whose record hasn't changed"""
+
+    def __init__(self, session: Session):
+        self.session = session
+        bind = session.get_bind()
+        self._dialect_name = bind.dialect.name
+        ThingContentHash.__table__.create(bind, checkfirst=True)  # type: ignore
+
+    def get(self, thing_ids: typing.Sequence[str]) -> typing.Dict[str, str]:
+        """The stored hashes of whichever of the given things have one, keyed by thing id"""
+        hashes_by_id: typing.Dict[str, str] = {}
+        for index in range(0, len(thing_ids), CONTENT_HASH_BATCH_SIZE):
+            batch_ids = thing_ids[index:index + CONTENT_HASH_BATCH_SIZE]
+            hashes_by_id.update(self.session.exec(
+                select(ThingContentHash.thing_id, ThingContentHash.content_hash)
+                .where(ThingContentHash.thing_id.in_(batch_ids))  # type: ignore
+            ).all())
+        return hashes_by_id
+
+    def save(self, hashes_by_id: typing.Mapping[str, str]):
+        """Record the hashes of things that have just been written, replacing any already there"""
+        rows = [{"thing_id": thing_id, "content_hash": content_hash} for thing_id, content_hash in hashes_by_id.items()]
+        for index in range(0, len(rows), CONTENT_HASH_BATCH_SIZE):
+            self.session.exec(upsert_statement(
+                self._dialect_name,
+                ThingContentHash,
+                rows[index:index + CONTENT_HASH_BATCH_SIZE],
+                [ThingContentHash.thing_id],
+                lambda excluded: {"content_hash": excluded.content_hash}
+            ))
+        self.session.commit()
+
+    def delete(self, thing_ids: typing.Sequence[str]):
+        """Forget the hashes of the given things, so they're written again the next time they come through"""
+        for index in range(0, len(thing_ids), CONTENT_HASH_BATCH_SIZE):
+            batch_ids = thing_ids[index:index + CONTENT_HASH_BATCH_SIZE]
+            self.session.exec(delete(ThingContentHash).where(ThingContentHash.thing_id.in_(batch_ids)))  # type: ignore
+        self.session.commit()
@@ -0,0 +1,61 @@
+import json
+import os
+import typing
+from datetime import datetime
+from typing import Optional
+
+Watermark = typing.Tuple[datetime, int]
+
+
+class LoadState():
+    """Progress that has to survive between SESAR load runs, kept in a small local JSON file.
+
+    Every update rewrites the whole file through a temporary file and an atomic rename, so a crash mid-write leaves
+    the previous state intact rather than a truncated file.
+    """
+
+    WATERMARK_KEY = "watermark"
+    CHECKPOINT_KEY = "checkpoint"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._state: dict[str, typing.Any] = {}
+        if os.path.exists(path):
+            with open(path) as state_file:
+                self._state = json.load(state_file)
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        return self._state.get(key, default)
+
+    def set(self, key: str, value: typing.Any):
+        self._state[key] = value
+        self._save()
+
+    def _save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(self._state, state_file, indent=2)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def watermark(self) -> Optional[Watermark]:
+        """The (last_update_date, sample_id) of the last sample successfully written, or None if there isn't one"""
+        watermark = self.get(LoadState.WATERMARK_KEY)
+        if watermark is None:
+            return None
+        return datetime.fromisoformat(watermark["last_update_date"]), watermark["sample_id"]
+
+    def set_watermark(self, watermark: Watermark):
+        last_update_date, sample_id = watermark
+        self.set(LoadState.WATERMARK_KEY, {
+            "last_update_date": last_update_date.isoformat(),
+            "sample_id": sample_id
+        })
+
+    def checkpoint(self) -> Optional[dict[str, typing.Any]]:
+        """The checkpoint recorded after the last batch a load committed, or None if there isn't one"""
+        return self.get(LoadState.CHECKPOINT_KEY)
+
+    def set_checkpoint(self, checkpoint: dict[str, typing.Any]):
+        self.set(LoadState.CHECKPOINT_KEY, checkpoint)
@@ -0,0 +1,137 @@
+import threading
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from .classification import Classification
+from .country import Country
+from .launch_type import Launch_Type
+from .nav_type import Nav_Type
+from .sample_type import Sample_Type
+
+
+class LookupCache():
+    """Id-keyed, in-memory copies of the small SESAR lookup tables.
+
+    The lookup tables are tiny and almost never change, so rather than resolving them through ORM relationships once
+    per sample, load each one once and answer name lookups out of plain dicts.  The rows are read as bare column
+    tuples, so nothing here is attached to (or kept alive by) a session.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._sample_type_names: dict[int, str] = {}
+        self._sample_type_chains: dict[int, tuple[str, ...]] = {}
+        self._classification_names: dict[int, str] = {}
+        self._classification_chains: dict[int, tuple[str, ...]] = {}
+        self._launch_type_names: dict[int, str] = {}
+        self._nav_type_names: dict[int, str] = {}
+        self._country_names: dict[int, str] = {}
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, session: Session) -> "LookupCache":
+        """Read every lookup table from the SESAR database, replacing anything previously cached"""
+        sample_type_rows = session.exec(
+            select(Sample_Type.sample_type_id, Sample_Type.name, Sample_Type.parent_sample_type_id)
+        ).all()
+        self._sample_type_names = {row[0]: row[1] for row in sample_type_rows}
+        self._sample_type_chains = LookupCache._chains(
+            self._sample_type_names, {row[0]: row[2] for row in sample_type_rows}
+        )
+        classification_rows = session.exec(
+            select(Classification.classification_id, Classification.name, Classification.parent_classification_id)
+        ).all()
+        self._classification_names = {row[0]: row[1] for row in classification_rows}
+        self._classification_chains = LookupCache._chains(
+            self._classification_names, {row[0]: row[2] for row in classification_rows}
+        )
+        self._launch_type_names = dict(session.exec(select(Launch_Type.launch_type_id, Launch_Type.name)).all())
+        self._nav_type_names = dict(session.exec(select(Nav_Type.nav_type_id, Nav_Type.name)).all())
+        self._country_names = dict(session.exec(select(Country.country_id, Country.name)).all())
+        self._loaded = True
+        return self
+
+    def refresh(self, session: Session) -> "LookupCache":
+        """Hook for long-running processes: re-read the lookup tables to pick up any edits"""
+        return self.load(session)
+
+    def invalidate(self):
+        """Drop everything cached; the next load() will re-read the lookup tables"""
+        self._reset()
+
+    @staticmethod
+    def _chains(
+        names_by_id: dict[int, str],
+        parent_ids_by_id: dict[int, Optional[int]]
+    ) -> dict[int, tuple[str, ...]]:
+        """Precompute each row's ancestry as a tuple of names, starting with the row itself"""
+        chains = {}
+        for row_id in names_by_id:
+            chain = []
+            seen = set()
+            current_id: Optional[int] = row_id
+            # guard against cycles in the parent links, we'd rather truncate than spin forever
+            while current_id is not None and current_id in names_by_id and current_id not in seen:
+                seen.add(current_id)
+                chain.append(names_by_id[current_id])
+                current_id = parent_ids_by_id.get(current_id)
+            chains[row_id] = tuple(chain)
+        return chains
+
+    @staticmethod
+    def _parent_of(chains: dict[int, tuple[str, ...]], row_id: Optional[int]) -> Optional[str]:
+        if row_id is None:
+            return None
+        chain = chains.get(row_id, ())
+        return chain[1] if len(chain) > 1 else None
+
+    def sample_type_name(self, sample_type_id: Optional[int]) -> Optional[str]:
+        return self._sample_type_names.get(sample_type_id) if sample_type_id is not None else None
+
+    def parent_sample_type_name(self, sample_type_id: Optional[int]) -> Optional[str]:
+        return LookupCache._parent_of(self._sample_type_chains, sample_type_id)
+
+    def sample_type_chain(self, sample_type_id: Optional[int]) -> tuple[str, ...]:
+        return self._sample_type_chains.get(sample_type_id, ()) if sample_type_id is not None else ()
+
+    def classification_name(self, classification_id: Optional[int]) -> Optional[str]:
+        return self._classification_names.get(classification_id) if classification_id is not None else None
+
+    def parent_classification_name(self, classification_id: Optional[int]) -> Optional[str]:
+        return LookupCache._parent_of(self._classification_chains, classification_id)
+
+    def classification_chain(self, classification_id: Optional[int]) -> tuple[str, ...]:
+        return self._classification_chains.get(classification_id, ()) if classification_id is not None else ()
+
+    def launch_type_name(self, launch_type_id: Optional[int]) -> Optional[str]:
+        return self._launch_type_names.get(launch_type_id) if launch_type_id is not None else None
+
+    def nav_type_name(self, nav_type_id: Optional[int]) -> Optional[str]:
+        return self._nav_type_names.get(nav_type_id) if nav_type_id is not None else None
+
+    def country_name(self, country_id: Optional[int]) -> Optional[str]:
+        return self._country_names.get(country_id) if country_id is not None else None
+
+
+_shared_lookup_cache = LookupCache()
+_shared_lookup_cache_lock = threading.Lock()
+
+
+def shared_lookup_cache(session: Session) -> LookupCache:
+    """The process-wide LookupCache, loaded from the given session the first time it's asked for"""
+    if not _shared_lookup_cache.loaded:
+        with _shared_lookup_cache_lock:
+            # another thread may have loaded it while we waited
+            if not _shared_lookup_cache.loaded:
+                _shared_lookup_cache.load(session)
+    return _shared_lookup_cache
+
+
+def invalidate_shared_lookup_cache():
+    _shared_lookup_cache.invalidate()
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import threading
 import typing
 
 NOT_PROVIDED = "Not Provided"
@@ -16,14 +17,31 @@ class AbstractCategoryMapper(ABC):
         """Whether a particular String input matches this category mapper"""
         pass
 
-    def append_if_matched(
+    def match(
         self,
         potential_match: str,
         auxiliary_match: typing.Optional[str] = None,
-        categories_list: typing.List[str] = list(),
-    ):
+    ) -> typing.Optional[str]:
+        """The destination category for a particular String input, or None if it doesn't match.
+
+        Matching never modifies the mapper, so a single mapper can be shared by any number of threads.
+        """
         if self.matches(potential_match, auxiliary_match):
-            categories_list.append(self._destination)
+            return self._destination
+        return None
+
+    def append_if_matched(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+        categories_list: typing.Optional[typing.List[str]] = None,
+    ) -> typing.List[str]:
+        if categories_list is None:
+            categories_list = []
+        destination = self.match(potential_match, auxiliary_match)
+        if destination is not None:
+            categories_list.append(destination)
+        return categories_list
 
     @property
     def destination(self):
@@ -36,6 +54,15 @@ class AbstractCategoryMapper(ABC):
 
 class AbstractCategoryMetaMapper(ABC):
     _categoriesMappers: list[AbstractCategoryMapper] = []
+    _compiledMatcher: "CompiledCategoryMatcher"
+
+    # Category inputs come from a small domain (classification names, location types, sample types), so each
+    # subclass remembers the categories for every distinct input it has seen, up to this many of them
+    MAX_CACHED_CATEGORIES = 100000
+    _categoriesCache: dict[tuple, tuple[str, ...]]
+    _cacheLock: threading.Lock
+    _cacheHits: int
+    _cacheMisses: int
 
     @classmethod
     def categories(
@@ -43,22 +70,166 @@ class AbstractCategoryMetaMapper(ABC):
         source_category: str,
         auxiliary_source_category: typing.Optional[str] = None,
     ):
+        key = cls._cache_key(source_category, auxiliary_source_category)
+        with cls._cacheLock:
+            cached = cls._categoriesCache.get(key)
+            if cached is not None:
+                cls._cacheHits += 1
+                return list(cached)
+            cls._cacheMisses += 1
         categories: list[str] = []
         if source_category is not None:
-            for mapper in cls._categoriesMappers:
-                mapper.append_if_matched(
-                    source_category, auxiliary_source_category, categories
-                )
+            categories = cls._compiledMatcher.destinations(
+                source_category, auxiliary_source_category
+            )
         if len(categories) == 0:
             categories.append(NOT_PROVIDED)
+        with cls._cacheLock:
+            if len(cls._categoriesCache) < cls.MAX_CACHED_CATEGORIES:
+                cls._categoriesCache[key] = tuple(categories)
         return categories
 
+    @classmethod
+    def _cache_key(
+        cls,
+        source_category: typing.Optional[str],
+        auxiliary_source_category: typing.Optional[str],
+    ) -> tuple:
+        # Mappers the matcher couldn't compile see the raw strings, so only normalize when none are present
+        if not cls._compiledMatcher.normalized_only:
+            return source_category, auxiliary_source_category
+        return (
+            source_category.lower().strip() if source_category is not None else None,
+            auxiliary_source_category.lower().strip() if auxiliary_source_category is not None else None,
+        )
+
+    @classmethod
+    def prewarm(
+        cls,
+        inputs: typing.Iterable[tuple[typing.Optional[str], typing.Optional[str]]],
+    ) -> int:
+        """Compute and cache the categories for each (source, auxiliary source) pair, returning how many there were"""
+        num_inputs = 0
+        for source_category, auxiliary_source_category in inputs:
+            cls.categories(source_category, auxiliary_source_category)  # type: ignore
+            num_inputs += 1
+        return num_inputs
+
+    @classmethod
+    def cache_stats(cls) -> dict[str, int]:
+        with cls._cacheLock:
+            return {
+                "hits": cls._cacheHits,
+                "misses": cls._cacheMisses,
+                "size": len(cls._categoriesCache),
+            }
+
+    @classmethod
+    def clear_cache(cls):
+        """Forget every cached result and reset the counters"""
+        with cls._cacheLock:
+            cls._categoriesCache = {}
+            cls._cacheHits = 0
+            cls._cacheMisses = 0
+
     @classmethod
     def categories_mappers(cls) -> list[AbstractCategoryMapper]:
         return []
 
     def __init_subclass__(cls, **kwargs):
         cls._categoriesMappers = cls.categories_mappers()
+        cls._compiledMatcher = CompiledCategoryMatcher(cls._categoriesMappers)
+        cls._cacheLock = threading.Lock()
+        cls.clear_cache()
+
+
+class _SuffixTrieNode:
+    __slots__ = ("children", "rules")
+
+    def __init__(self):
+        self.children: dict[str, "_SuffixTrieNode"] = {}
+        self.rules: list[tuple[tuple[int, ...], str]] = []
+
+
+class CompiledCategoryMatcher:
+    """An ordered list of category mappers, compiled into lookup tables that answer all of them at once.
+
+    Walking the mappers one by one normalizes the input again in every mapper and scans each equality list in turn.
+    Here the input is normalized once, equality and paired rules are answered by a single dict lookup each, and all
+    the ends-with rules by one walk down a trie of their reversed suffixes.  Each rule is keyed by the position of its
+    mapper in the list -- plus its position inside any StringOrderedCategoryMapper -- so the output is the same as
+    the mappers' own: one destination per matching mapper, in mapper order, with duplicates kept, and the first
+    matching submapper winning inside an ordered mapper.  Mappers of any other type are still asked via matches().
+    """
+
+    def __init__(self, mappers: typing.List[AbstractCategoryMapper]):
+        self._equality_rules: dict[str, list[tuple[tuple[int, ...], str]]] = {}
+        self._paired_rules: dict[tuple[str, str], list[tuple[tuple[int, ...], str]]] = {}
+        self._suffix_trie = _SuffixTrieNode()
+        self._constant_rules: list[tuple[tuple[int, ...], str]] = []
+        self._dynamic_rules: list[tuple[tuple[int, ...], AbstractCategoryMapper]] = []
+        for position, mapper in enumerate(mappers):
+            self._compile(mapper, (position,))
+
+    @property
+    def normalized_only(self) -> bool:
+        """Whether the result depends only on the normalized inputs, i.e. every mapper could be compiled"""
+        return len(self._dynamic_rules) == 0
+
+    def _compile(self, mapper: AbstractCategoryMapper, key: tuple[int, ...]):
+        if isinstance(mapper, StringEqualityCategoryMapper):
+            for category in mapper._categories:
+                self._equality_rules.setdefault(category, []).append((key, mapper.destination))
+        elif isinstance(mapper, StringEndsWithCategoryMapper):
+            node = self._suffix_trie
+            for character in reversed(mapper._endsWith):
+                node = node.children.setdefault(character, _SuffixTrieNode())
+            node.rules.append((key, mapper.destination))
+        elif isinstance(mapper, StringPairedCategoryMapper):
+            self._paired_rules.setdefault((mapper._primaryMatch, mapper._auxiliaryMatch), []).append(
+                (key, mapper.destination)
+            )
+        elif isinstance(mapper, StringConstantCategoryMapper):
+            self._constant_rules.append((key, mapper.destination))
+        elif isinstance(mapper, StringOrderedCategoryMapper):
+            for index, submapper in enumerate(mapper._submappers):
+                self._compile(submapper, key + (index,))
+        else:
+            self._dynamic_rules.append((key, mapper))
+
+    def destinations(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+    ) -> list[str]:
+        """The destination of every compiled mapper that matches, in mapper order"""
+        normalized = potential_match.lower().strip()
+        matched: list[tuple[tuple[int, ...], str]] = list(self._constant_rules)
+        matched.extend(self._equality_rules.get(normalized, ()))
+        node: typing.Optional[_SuffixTrieNode] = self._suffix_trie
+        matched.extend(node.rules)  # type: ignore
+        for character in reversed(normalized):
+            node = node.children.get(character)  # type: ignore
+            if node is None:
+                break
+            matched.extend(node.rules)
+        if auxiliary_match is not None and len(self._paired_rules) > 0:
+            matched.extend(self._paired_rules.get((normalized, auxiliary_match.lower().strip()), ()))
+        for key, mapper in self._dynamic_rules:
+            destination = mapper.match(potential_match, auxiliary_match)
+            if destination is not None:
+                matched.append((key, destination))
+        if len(matched) == 0:
+            return []
+        matched.sort(key=lambda rule: rule[0])
+        destinations = []
+        last_position = None
+        for key, destination in matched:
+            # inside an ordered mapper only the first matching submapper counts
+            if key[0] != last_position:
+                destinations.append(destination)
+                last_position = key[0]
+        return destinations
 
 
 class StringConstantCategoryMapper(AbstractCategoryMapper):
@@ -125,12 +296,19 @@ class StringOrderedCategoryMapper(AbstractCategoryMapper):
         potential_match: str,
         auxiliary_match: typing.Optional[str] = None,
     ) -> bool:
+        return self.match(potential_match, auxiliary_match) is not None
+
+    def match(
+        self,
+        potential_match: str,
+        auxiliary_match: typing.Optional[str] = None,
+    ) -> typing.Optional[str]:
+        # The destination depends on which submapper matched, so it's returned rather than stored on the mapper
         for mapper in self._submappers:
-            if mapper.matches(potential_match, auxiliary_match):
-                # Note that this isn't thread-safe -- we expect one of these objects per thread
-                self.destination = mapper.destination
-                return True
-        return False
+            destination = mapper.match(potential_match, auxiliary_match)
+            if destination is not None:
+                return destination
+        return None
 
 
 class StringPairedCategoryMapper(AbstractCategoryMapper):
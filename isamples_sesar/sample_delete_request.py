@@ -0,0 +1,58 @@
+from typing import Optional
+from sqlmodel import Field
+from datetime import datetime
+from .sesar_sqlmodel import SesarBase
+
+
+class Sample_Delete_Request(SesarBase, table=True):
+    id: int = Field(
+        primary_key=True,
+        nullable=False,
+        description=""
+    )
+    sample_id: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description="the sample that was requested to be deleted",
+        foreign_key="sample.sample_id"
+    )
+    requestor_user_id: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    delete_reason: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    duplicate_igsns: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    other_reason: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    deleted_by: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    deleted_date: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="date the request was carried out by deleting the sample"
+    )
+    deactivated_by: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description=""
+    )
+    deactivated_date: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="date the request was carried out by deactivating the sample"
+    )
@@ -0,0 +1,57 @@
+from typing import NamedTuple, Optional
+from datetime import datetime
+
+
+class SampleRow(NamedTuple):
+    """The subset of a SESAR sample the Transformer reads, with its lookup names and related records flattened in.
+
+    Instances are plain tuples built straight from a projected query (see get_sample_rows_projected), so they skip
+    SQLModel/pydantic validation and ORM identity tracking, cost no per-instance dict, and can be pickled.  Fields
+    that come from an outer join are None when the related row doesn't exist, e.g. parent_igsn for a sample without a
+    parent, or cur_owner_id when the sample has no current owner.
+    """
+    sample_id: int
+    igsn: str
+    name: str
+    description: Optional[str]
+    sample_type_id: int
+    sample_type_name: Optional[str]
+    parent_sample_type_name: Optional[str]
+    classification_id: Optional[int]
+    classification_name: Optional[str]
+    top_level_classification_id: Optional[int]
+    top_level_classification_name: Optional[str]
+    launch_type_id: Optional[int]
+    launch_type_name: Optional[str]
+    nav_type_id: Optional[int]
+    nav_type_name: Optional[str]
+    parent_igsn: Optional[str]
+    collection_method: Optional[str]
+    field_name: Optional[str]
+    cruise_field_prgrm: Optional[str]
+    launch_platform_name: Optional[str]
+    primary_location_type: Optional[str]
+    primary_location_name: Optional[str]
+    collection_start_date: Optional[datetime]
+    registration_date: Optional[datetime]
+    last_update_date: Optional[datetime]
+    collector: Optional[str]
+    locality: Optional[str]
+    locality_description: Optional[str]
+    location_description: Optional[str]
+    elevation: Optional[float]
+    elevation_unit: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    province: Optional[str]
+    county: Optional[str]
+    city: Optional[str]
+    purpose: Optional[str]
+    current_archive: Optional[str]
+    cur_registrant_id: Optional[int]
+    cur_registrant_fname: Optional[str]
+    cur_registrant_lname: Optional[str]
+    cur_owner_id: Optional[int]
+    cur_owner_fname: Optional[str]
+    cur_owner_lname: Optional[str]
+    cur_owner_email: Optional[str]
@@ -0,0 +1,71 @@
+import typing
+
+from sqlmodel import Field, Session, SQLModel, select
+
+from .thing_sink import upsert_statement
+
+# How many sample ids go into one IN (...) or one multi-row INSERT
+SAMPLE_THING_BATCH_SIZE = 1000
+
+
+class SampleThing(SQLModel, table=True):
+    """Which iSB thing a SESAR sample was loaded as, kept in the iSB database next to the things.
+
+    sample_delete_request only records the sample_id, so once SESAR has dropped the sample row this is the only way
+    left to tell which thing it was.
+    """
+    __tablename__ = "sesar_sample_thing"
+
+    sample_id: int = Field(primary_key=True)
+    thing_id: str
+
+
+class SampleThingStore():
+    """Reads and writes SampleThing rows, so removals can be propagated for samples SESAR no longer has"""
+
+    def __init__(self, session: Session):
+        self.session = session
+        bind = session.get_bind()
+        self._dialect_name = bind.dialect.name
+        SampleThing.__table__.create(bind, checkfirst=True)  # type: ignore
+
+    def get(self, sample_ids: typing.Sequence[int]) -> typing.Dict[int, str]:
+        """The thing ids of whichever of the given samples have been loaded, keyed by sample id"""
+        thing_ids_by_sample_id: typing.Dict[int, str] = {}
+        for index in range(0, len(sample_ids), SAMPLE_THING_BATCH_SIZE):
+            batch_ids = sample_ids[index:index + SAMPLE_THING_BATCH_SIZE]
+            thing_ids_by_sample_id.update(self.session.exec(
+                select(SampleThing.sample_id, SampleThing.thing_id)
+                .where(SampleThing.sample_id.in_(batch_ids))  # type: ignore
+            ).all())
+        return thing_ids_by_sample_id
+
+    def save(self, thing_ids_by_sample_id: typing.Mapping[int, str]):
+        """Record the things samples have just been loaded as, replacing any already there"""
+        rows = [
+            {"sample_id": sample_id, "thing_id": thing_id} for sample_id, thing_id in thing_ids_by_sample_id.items()
+        ]
+        for index in range(0, len(rows), SAMPLE_THING_BATCH_SIZE):
+            self.session.exec(upsert_statement(
+                self._dialect_name,
+                SampleThing,
+                rows[index:index + SAMPLE_THING_BATCH_SIZE],
+                [SampleThing.sample_id],
+                lambda excluded: {"thing_id": excluded.thing_id}
+            ))
+        self.session.commit()
+
+    def save_changed(self, thing_ids_by_sample_id: typing.Mapping[int, str]) -> int:
+        """Like save, but only writing the samples that have no thing recorded yet, or a different one.
+
+        A reload mostly sees samples that are already recorded, so this costs a read per batch rather than a write
+        per sample.  Returns the number saved.
+        """
+        stored = self.get(list(thing_ids_by_sample_id.keys()))
+        changed = {
+            sample_id: thing_id for sample_id, thing_id in thing_ids_by_sample_id.items()
+            if stored.get(sample_id) != thing_id
+        }
+        if changed:
+            self.save(changed)
+        return len(changed)
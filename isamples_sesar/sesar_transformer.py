@@ -1,8 +1,20 @@
+import threading
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.pool
 import typing
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
 import logging
 import h3
+import numpy as np
+from .lookup_cache import LookupCache
 from .sample import Sample
+from .sample_row import SampleRow
+from .sqlmodel_database import get_distinct_category_inputs
+from sqlmodel import Session
 
 from .mapper import (
     AbstractCategoryMapper,
@@ -22,72 +34,219 @@ class Transformer():
 
     DEFAULT_H3_RESOLUTION = 15
 
-    def __init__(self, sample: Sample):
+    # H3 resolutions run from 0, the coarsest, to 15
+    MAX_H3_RESOLUTION = 15
+
+    # The resolutions written out as producedBy_samplingSite_location_h3_* fields.  Deployments that don't index some
+    # of these can narrow the set here (or per instance) to skip computing them.
+    H3_RESOLUTIONS: typing.Sequence[int] = range(0, 15)
+
+    # If True, only the finest cell is projected from the coordinates and coarser ones are derived by parent
+    # traversal.  That's cheaper, but H3 cells don't nest exactly, so near a cell boundary the parent can differ from
+    # the cell the point itself falls in at that resolution.  Off by default so indexed values stay unchanged.
+    H3_DERIVE_FROM_FINEST = False
+
+    # How many samples iter_transform() pulls off its input at a time to work on together
+    TRANSFORM_BATCH_SIZE = 1000
+
+    # The layout of a transformed record: each entry maps a key either to the name of the method that computes its
+    # value, or to the spec of a nested record.  transform() runs a plan compiled from this, so a caller asking for a
+    # subset of the fields only pays for the methods (and lookups) those fields need.  The producedBy_samplingSite_
+    # location_h3_* fields follow, one for each of h3_resolutions.
+    RECORD_SPEC: typing.Tuple = (
+        ("$schema", "schema_name"),
+        ("@id", "id_string"),
+        ("label", "sample_label"),
+        ("sampleidentifier", "sample_identifier_string"),
+        ("description", "sample_description"),
+        ("hasContextCategory", "has_context_categories"),
+        ("hasMaterialCategory", "has_material_categories"),
+        ("hasSpecimenCategory", "has_specimen_categories"),
+        ("informalClassification", "informal_classification"),
+        ("keywords", "keywords"),
+        ("producedBy", (
+            ("@id", "produced_by_id_string"),
+            ("label", "produced_by_label"),
+            ("description", "produced_by_description"),
+            ("hasFeatureOfInterest", "produced_by_feature_of_interest"),
+            ("responsibility", "produced_by_responsibilities"),
+            ("resultTime", "produced_by_result_time"),
+            ("samplingSite", (
+                ("description", "sampling_site_description"),
+                ("label", "sampling_site_label"),
+                ("location", (
+                    ("elevation", "sampling_site_elevation"),
+                    ("latitude", "sampling_site_latitude"),
+                    ("longitude", "sampling_site_longitude"),
+                )),
+                ("placeName", "sampling_site_place_names"),
+            )),
+        )),
+        ("registrant", "sample_registrant"),
+        ("samplingPurpose", "sample_sampling_purpose"),
+        ("curation", (
+            ("label", "curation_label"),
+            ("description", "curation_description"),
+            ("accessConstraints", "curation_access_constraints"),
+            ("curationLocation", "curation_location"),
+            ("responsibility", "curation_responsibility"),
+        )),
+        ("relatedResource", "related_resources"),
+        ("authorizedBy", "authorized_by"),
+        ("compliesWith", "complies_with"),
+    )
+    H3_FIELD_PREFIX = "producedBy_samplingSite_location_h3_"
+
+    def __init__(
+        self,
+        sample: Union[Sample, SampleRow],
+        lookup_cache: Optional[LookupCache] = None,
+        h3_resolutions: Optional[typing.Sequence[int]] = None
+    ):
+        # Either a full Sample, or a SampleRow from get_sample_rows_projected which already carries its lookup names
         self.sample = sample
+        # When present, lookup table names are resolved out of the cache rather than through the sample's relationships
+        self.lookup_cache = lookup_cache
+        self.h3_resolutions = h3_resolutions if h3_resolutions is not None else Transformer.H3_RESOLUTIONS
+        self._h3_cells: Optional[typing.Dict[int, Optional[str]]] = None
         self._material_prediction_results: Optional[list] = None
 
-    def transform(self) -> typing.Dict:
+    def transform(self, fields: Optional[typing.Iterable[str]] = None) -> typing.Dict:
         """Do the actual work of transforming a Sesar record into an iSamples record.
 
         Arguments:
-            sample -- The Sesar record to be transformed
+            fields -- Optionally, just the fields to include, as top level keys or dotted paths into the nested
+                      records (e.g. "producedBy.samplingSite.location"), including any of the H3 fields
         Return value:
-            The Sesar record transformed into an iSamples record
+            The Sesar record transformed into an iSamples record, with its keys in the same order whether or not it's
+            a subset
         """
-        context_categories = self.has_context_categories()
-        material_categories = self.has_material_categories()
-        specimen_categories = self.has_specimen_categories()
-        transformed_record = {
-            "$schema": "iSamplesSchemaCore1.0.json",
-            "@id": self.id_string(),
-            "label": self.sample_label(),
-            "sampleidentifier": self.sample_identifier_string(),
-            "description": self.sample_description(),
-            "hasContextCategory": context_categories,
-            # "hasContextCategoryConfidence": self.has_context_category_confidences(context_categories),
-            "hasMaterialCategory": material_categories,
-            # "hasMaterialCategoryConfidence": self.has_material_category_confidences(material_categories),
-            "hasSpecimenCategory": specimen_categories,
-            # "hasSpecimenCategoryConfidence": self.has_specimen_category_confidences(specimen_categories),
-            "informalClassification": self.informal_classification(),
-            "keywords": self.keywords(),
-            "producedBy": {
-                "@id": self.produced_by_id_string(),
-                "label": self.produced_by_label(),
-                "description": self.produced_by_description(),
-                "hasFeatureOfInterest": self.produced_by_feature_of_interest(),
-                "responsibility": self.produced_by_responsibilities(),
-                "resultTime": self.produced_by_result_time(),
-                "samplingSite": {
-                    "description": self.sampling_site_description(),
-                    "label": self.sampling_site_label(),
-                    "location": {
-                        "elevation": self.sampling_site_elevation(),
-                        "latitude": self.sampling_site_latitude(),
-                        "longitude": self.sampling_site_longitude(),
-                    },
-                    "placeName": self.sampling_site_place_names(),
-                },
-            },
-            "registrant": self.sample_registrant(),
-            "samplingPurpose": self.sample_sampling_purpose(),
-            "curation": {
-                "label": self.curation_label(),
-                "description": self.curation_description(),
-                "accessConstraints": self.curation_access_constraints(),
-                "curationLocation": self.curation_location(),
-                "responsibility": self.curation_responsibility(),
-            },
-            "relatedResource": self.related_resources(),
-            "authorizedBy": self.authorized_by(),
-            "compliesWith": self.complies_with(),
-        }
-        for index in range(0, 15):
-            h3_at_resolution = self.h3_function()(self.sample.latitude, self.sample.longitude, index)
-            field_name = f"producedBy_samplingSite_location_h3_{index}"
-            transformed_record[field_name] = h3_at_resolution
+        return self.transform_with_plan(
+            compile_transform_plan(type(self).RECORD_SPEC, tuple(fields) if fields is not None else None)
+        )
+
+    def transform_with_plan(self, plan: typing.Tuple[typing.Tuple, Optional[typing.FrozenSet[int]]]) -> typing.Dict:
+        """transform() with its fields already compiled by compile_transform_plan, for use across a whole batch"""
+        record_plan, h3_plan = plan
+        transformed_record = self._run_plan(record_plan)
+        h3_indexes = h3_field_resolutions(self.h3_resolutions, h3_plan)
+        if h3_plan is not None and self._h3_cells is None and len(h3_indexes) > 0:
+            # just the resolutions asked for, rather than all of h3_resolutions
+            self._h3_cells = _shared_h3_cell_cache.cells(
+                self.sample.latitude, self.sample.longitude, h3_indexes, Transformer.H3_DERIVE_FROM_FINEST
+            )
+        for index in h3_indexes:
+            transformed_record[f"{Transformer.H3_FIELD_PREFIX}{index}"] = self.h3_cell(index)
         return transformed_record
 
+    def _run_plan(self, plan: typing.Tuple) -> typing.Dict[str, typing.Any]:
+        return {
+            key: self._run_plan(value) if isinstance(value, tuple) else getattr(self, value)()
+            for key, value in plan
+        }
+
+    def schema_name(self) -> str:
+        return "iSamplesSchemaCore1.0.json"
+
+    @classmethod
+    def for_batch(
+        cls,
+        samples: typing.Sequence[Union[Sample, SampleRow]],
+        lookup_cache: Optional[LookupCache] = None,
+        h3_resolutions: Optional[typing.Sequence[int]] = None
+    ) -> typing.List["Transformer"]:
+        """Transformers for a whole batch of samples, with their H3 cells already filled in.
+
+        The cells for every sample are computed in one h3_cells_batch() call over the batch's coordinate arrays,
+        rather than one sample at a time when each record is transformed.  That's every one of H3_RESOLUTIONS plus
+        DEFAULT_H3_RESOLUTION, or if h3_resolutions is specified, just those.
+        """
+        transformers = [cls(sample, lookup_cache, h3_resolutions) for sample in samples]
+        if len(transformers) == 0:
+            return transformers
+        resolutions = set(transformers[0].h3_resolutions)
+        if h3_resolutions is None:
+            resolutions.add(Transformer.DEFAULT_H3_RESOLUTION)
+        cells_by_resolution = h3_cells_batch(
+            [sample.latitude for sample in samples],
+            [sample.longitude for sample in samples],
+            resolutions,
+            Transformer.H3_DERIVE_FROM_FINEST
+        )
+        for index, transformer in enumerate(transformers):
+            transformer._h3_cells = {
+                resolution: cells[index] for resolution, cells in cells_by_resolution.items()
+            }
+        return transformers
+
+    @classmethod
+    def iter_transform(
+        cls,
+        samples: typing.Iterable[Union[Sample, SampleRow]],
+        lookup_cache: Optional[LookupCache] = None,
+        threads: int = 1,
+        batch_size: Optional[int] = None,
+        fields: Optional[typing.Iterable[str]] = None
+    ) -> typing.Iterator[typing.Tuple[Union[Sample, SampleRow], typing.Dict, Optional[str]]]:
+        """Transform a list or stream of samples, yielding (sample, record, h3) for each in input order.
+
+        The input is consumed batch_size samples at a time.  Each batch gets its H3 cells from for_batch() in one
+        pass, and shares the lookup cache and the category caches with every other batch, so only as much of a stream
+        as one batch is held at once.  The records are identical to transform()'s, and h3 is the cell at
+        DEFAULT_H3_RESOLUTION.  With threads > 1 each batch is transformed via transform_threaded().
+
+        If fields is given, only those fields are transformed (see transform()), and only the H3 resolutions among
+        them are computed.  h3 is then None unless they include the one at DEFAULT_H3_RESOLUTION.
+        """
+        field_tuple = tuple(fields) if fields is not None else None
+        plan = compile_transform_plan(cls.RECORD_SPEC, field_tuple)
+        h3_plan = plan[1]
+        h3_resolutions = None if h3_plan is None else h3_field_resolutions(cls.H3_RESOLUTIONS, h3_plan)
+        needs_h3 = h3_resolutions is None or len(h3_resolutions) > 0
+        yields_h3 = h3_plan is None or Transformer.DEFAULT_H3_RESOLUTION in h3_plan
+        iterator = iter(samples)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size or cls.TRANSFORM_BATCH_SIZE))
+            if len(batch) == 0:
+                return
+            if needs_h3:
+                transformers = cls.for_batch(batch, lookup_cache, h3_resolutions)
+            else:
+                transformers = [cls(sample, lookup_cache, h3_resolutions) for sample in batch]
+            if threads > 1:
+                records = transform_threaded(transformers, threads, field_tuple)
+            else:
+                records = [transformer.transform_with_plan(plan) for transformer in transformers]
+            for transformer, record in zip(transformers, records):
+                yield transformer.sample, record, transformer.h3_cell() if yields_h3 else None
+
+    @classmethod
+    def transform_many(
+        cls,
+        samples: typing.Iterable[Union[Sample, SampleRow]],
+        lookup_cache: Optional[LookupCache] = None,
+        threads: int = 1,
+        fields: Optional[typing.Iterable[str]] = None
+    ) -> typing.List[typing.Dict]:
+        """The records for a list or stream of samples, identical to calling transform() on each in turn"""
+        return [record for _, record, _ in cls.iter_transform(samples, lookup_cache, threads, fields=fields)]
+
+    def h3_cell(self, resolution: int = DEFAULT_H3_RESOLUTION) -> Optional[str]:
+        """The sample's H3 cell at the given resolution.
+
+        Every resolution the record needs, plus the default one used for the thing's h3 column, is computed together
+        the first time any of them is asked for, so the record and the loader share a single computation.
+        """
+        if self._h3_cells is None:
+            resolutions = set(self.h3_resolutions)
+            resolutions.add(Transformer.DEFAULT_H3_RESOLUTION)
+            self._h3_cells = _shared_h3_cell_cache.cells(
+                self.sample.latitude, self.sample.longitude, resolutions, Transformer.H3_DERIVE_FROM_FINEST
+            )
+        if resolution not in self._h3_cells:
+            self._h3_cells[resolution] = self.h3_function()(self.sample.latitude, self.sample.longitude, resolution)
+        return self._h3_cells[resolution]
+
     def has_context_categories(self) -> typing.List[str]:
         material_type = self._material_type()
         primary_location_type = self.sample.primary_location_type
@@ -115,20 +274,84 @@ class Transformer():
         return MaterialCategoryMetaMapper.categories(material)
 
     def has_specimen_categories(self) -> typing.List[str]:
-        sample_type = self.sample.sample_type.name
-        return SpecimenCategoryMetaMapper.categories(sample_type)
+        sample_type = self._sample_type_name()
+        return SpecimenCategoryMetaMapper.categories(sample_type)  # type: ignore
 
     def id_string(self) -> str:
         return f"https://data.isamples.org/digitalsample/igsn/{self.sample.igsn}"
 
     def _material_type(self) -> str:
-        if self.sample.classification and self.sample.top_level_classification:
-            return f"{self.sample.classification.name}>{self.sample.top_level_classification.name}"
-        elif self.sample.classification:
-            return self.sample.classification.name
-        elif self.sample.top_level_classification:
-            return self.sample.top_level_classification.name
-        return ""
+        return material_type(self._classification_name(), self._top_level_classification_name())
+
+    def _sample_type_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.sample_type_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.sample_type_name(self.sample.sample_type_id)
+        return self.sample.sample_type.name if self.sample.sample_type else None
+
+    def _parent_sample_type_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.parent_sample_type_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.parent_sample_type_name(self.sample.sample_type_id)
+        sample_type = self.sample.sample_type
+        if sample_type and sample_type.parent_sample_type:
+            return sample_type.parent_sample_type.name
+        return None
+
+    def _classification_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.classification_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.classification_name(self.sample.classification_id)
+        return self.sample.classification.name if self.sample.classification else None
+
+    def _top_level_classification_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.top_level_classification_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.classification_name(self.sample.top_level_classification_id)
+        return self.sample.top_level_classification.name if self.sample.top_level_classification else None
+
+    def _launch_type_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.launch_type_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.launch_type_name(self.sample.launch_type_id)
+        return self.sample.launch_type.name if self.sample.launch_type else None
+
+    def _nav_type_name(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.nav_type_name
+        if self.lookup_cache is not None:
+            return self.lookup_cache.nav_type_name(self.sample.nav_type_id)
+        return self.sample.nav_type.name if self.sample.nav_type else None
+
+    def _parent_igsn(self) -> Optional[str]:
+        if isinstance(self.sample, SampleRow):
+            return self.sample.parent_igsn
+        return self.sample.parent.igsn if self.sample.parent is not None else None
+
+    def _cur_registrant(self) -> Optional[typing.Tuple[str, str]]:
+        """The current registrant's (first name, last name), or None if there isn't one"""
+        if isinstance(self.sample, SampleRow):
+            if self.sample.cur_registrant_id is None:
+                return None
+            return self.sample.cur_registrant_fname, self.sample.cur_registrant_lname  # type: ignore
+        if self.sample.cur_registrant:
+            return self.sample.cur_registrant.fname, self.sample.cur_registrant.lname
+        return None
+
+    def _cur_owner(self) -> Optional[typing.Tuple[str, str, Optional[str]]]:
+        """The current owner's (first name, last name, email), or None if there isn't one"""
+        if isinstance(self.sample, SampleRow):
+            if self.sample.cur_owner_id is None:
+                return None
+            return self.sample.cur_owner_fname, self.sample.cur_owner_lname, self.sample.cur_owner_email  # type: ignore
+        if self.sample.cur_owner:
+            return self.sample.cur_owner.fname, self.sample.cur_owner.lname, self.sample.cur_owner.email
+        return None
 
     @staticmethod
     def _logger():
@@ -165,13 +388,13 @@ class Transformer():
     def keywords(self) -> typing.List:
         # TODO: add more keywords
         keyword_arr = []
-        sample_type = self.sample.sample_type
-        if sample_type:
-            parent_sample_type = self.sample.sample_type.parent_sample_type
-            if parent_sample_type:
-                sample_type_str = f"{parent_sample_type.name}>{sample_type.name}"
+        sample_type = self._sample_type_name()
+        if sample_type is not None:
+            parent_sample_type = self._parent_sample_type_name()
+            if parent_sample_type is not None:
+                sample_type_str = f"{parent_sample_type}>{sample_type}"
             else:
-                sample_type_str = sample_type.name
+                sample_type_str = sample_type
             keyword_arr.append({
                 "keyword": sample_type_str,
                 "scheme_name": "SESAR: Sample Type"
@@ -189,8 +412,9 @@ class Transformer():
         return [Transformer.NOT_PROVIDED]
 
     def produced_by_id_string(self) -> str:
-        if self.sample.parent is not None:
-            return f"igsn:{self.sample.parent.igsn}"
+        parent_igsn = self._parent_igsn()
+        if parent_igsn is not None:
+            return f"igsn:{parent_igsn}"
         return ""
 
     def produced_by_label(self) -> str:
@@ -228,13 +452,15 @@ class Transformer():
             description_components.append(self.sample.description)
 
         launch_type_str = ""
-        if self.sample.launch_type:
+        launch_type = self._launch_type_name()
+        if launch_type is not None:
             launch_type_str += "launch type:{0}, ".format(
-                self.sample.launch_type.name
+                launch_type
             )
-        if self.sample.nav_type:
+        nav_type = self._nav_type_name()
+        if nav_type is not None:
             launch_type_str += "navigation type:{0}".format(
-                self.sample.nav_type.name
+                nav_type
             )
         if len(launch_type_str) > 0:
             description_components.append(launch_type_str)
@@ -321,7 +547,7 @@ class Transformer():
                 elevation_unit_abbreviation = "m"
             else:
                 self._logger().error(
-                    "Received elevation in unexpected unit: ", elevation_unit
+                    "Received elevation in unexpected unit: %s", elevation_unit
                 )
         elevation_str = str(elevation_value)
         if len(elevation_unit_abbreviation) > 0:
@@ -348,11 +574,13 @@ class Transformer():
         return place_names
 
     def sample_registrant(self) -> str:
-        if self.sample.cur_registrant:
-            if self.sample.cur_registrant.fname.lower() == 'curator':
-                return self.sample.cur_registrant.lname
+        cur_registrant = self._cur_registrant()
+        if cur_registrant is not None:
+            fname, lname = cur_registrant
+            if fname.lower() == 'curator':
+                return lname
             else:
-                return f"{self.sample.cur_registrant.fname} {self.sample.cur_registrant.lname}"
+                return f"{fname} {lname}"
         return Transformer.NOT_PROVIDED
 
     def sample_sampling_purpose(self) -> str:
@@ -389,20 +617,22 @@ class Transformer():
 
     def curation_responsibility(self) -> list[dict]:
         responsibility: list[dict] = []
-        if self.sample.cur_owner:
-            if self.sample.cur_owner.fname.lower() == 'curator':
-                sample_owner_name = self.sample.cur_owner.lname
+        cur_owner = self._cur_owner()
+        if cur_owner is not None:
+            fname, lname, email = cur_owner
+            if fname.lower() == 'curator':
+                sample_owner_name = lname
                 sample_curator = {
                     "role": "curator",
                     "name": sample_owner_name
                 }
                 responsibility.append(sample_curator)
             else:
-                sample_owner_name = f"{self.sample.cur_owner.fname} {self.sample.cur_owner.lname}"
+                sample_owner_name = f"{fname} {lname}"
             sample_owner = {
                 "role": "sample owner",
                 "name": sample_owner_name,
-                "contact_information": self.sample.cur_owner.email
+                "contact_information": email
             }
             responsibility.append(sample_owner)
 
@@ -639,12 +869,316 @@ class ContextCategoryMetaMapper(AbstractCategoryMetaMapper):
         ]
 
 
+@functools.lru_cache(maxsize=256)
+def compile_transform_plan(
+    spec: typing.Tuple,
+    fields: Optional[typing.Tuple[str, ...]] = None
+) -> typing.Tuple[typing.Tuple, Optional[typing.FrozenSet[int]]]:
+    """Compile a record spec and a selection of its fields into a (record plan, H3 resolutions) pair.
+
+    The record plan is the spec pruned down to the selected fields, keeping the spec's order.  The H3 resolutions are
+    the ones whose fields were selected, or None when fields is None, meaning the full record at every resolution.
+    Unknown fields, including H3 fields for resolutions outside 0 to MAX_H3_RESOLUTION, raise a ValueError.
+    """
+    if fields is None:
+        return spec, None
+    h3_resolutions = set()
+    paths = []
+    for field in fields:
+        if field.startswith(Transformer.H3_FIELD_PREFIX):
+            resolution = field[len(Transformer.H3_FIELD_PREFIX):]
+            if not resolution.isdigit():
+                raise ValueError(f"Unknown field {field}")
+            if int(resolution) > Transformer.MAX_H3_RESOLUTION:
+                raise ValueError(
+                    f"Unknown field {field}, H3 resolutions only go from 0 to {Transformer.MAX_H3_RESOLUTION}"
+                )
+            h3_resolutions.add(int(resolution))
+        else:
+            paths.append((field, field.split(".")))
+    return _prune_spec(spec, paths), frozenset(h3_resolutions)
+
+
+def h3_field_resolutions(
+    h3_resolutions: typing.Sequence[int],
+    h3_plan: Optional[typing.FrozenSet[int]]
+) -> typing.List[int]:
+    """The resolutions of the H3 fields a record gets, in field order, for the H3 part of a compiled plan.
+
+    That's all of h3_resolutions for a full record, and otherwise the selected ones, those in h3_resolutions first.
+    """
+    if h3_plan is None:
+        return list(h3_resolutions)
+    h3_indexes = [index for index in h3_resolutions if index in h3_plan]
+    h3_indexes.extend(sorted(h3_plan.difference(h3_indexes)))
+    return h3_indexes
+
+
+def _prune_spec(spec: typing.Tuple, paths: typing.List[typing.Tuple[str, typing.List[str]]]) -> typing.Tuple:
+    if any(len(path) == 0 for _, path in paths):
+        # the whole subtree was asked for
+        return spec
+    keys = {key for key, _ in spec}
+    for field, path in paths:
+        if path[0] not in keys:
+            raise ValueError(f"Unknown field {field}")
+    pruned = []
+    for key, value in spec:
+        subpaths = [(field, path[1:]) for field, path in paths if path[0] == key]
+        if len(subpaths) == 0:
+            continue
+        if isinstance(value, tuple):
+            pruned.append((key, _prune_spec(value, subpaths)))
+        else:
+            for field, subpath in subpaths:
+                if len(subpath) > 0:
+                    raise ValueError(f"Unknown field {field}")
+            pruned.append((key, value))
+    return tuple(pruned)
+
+
+def transform_threaded(
+    transformers: typing.Sequence[Transformer],
+    workers: int = 4,
+    fields: Optional[typing.Iterable[str]] = None
+) -> typing.List[typing.Dict]:
+    """Transform each of the transformers on a pool of threads, returning the records in the same order.
+
+    Category matching and the H3 and category caches are safe to share across threads, so the transformers can all
+    use the same MetaMappers and LookupCache.  How much this gains depends on how much of the work releases the GIL.
+    """
+    if len(transformers) == 0:
+        return []
+    plan = compile_transform_plan(type(transformers[0]).RECORD_SPEC, tuple(fields) if fields is not None else None)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda transformer: transformer.transform_with_plan(plan), transformers))
+
+
+def _init_transform_worker(h3_cache_size: int):
+    shared_h3_cell_cache().resize(h3_cache_size)
+
+
+def _transform_sample_rows(
+    sample_rows: typing.List[SampleRow],
+    fields: Optional[typing.Tuple[str, ...]] = None
+) -> typing.List[typing.Tuple[typing.Dict, Optional[str]]]:
+    """Pool worker: the (record, h3) pairs for one chunk of SampleRows"""
+    return [
+        (record, h3_cell)
+        for _, record, h3_cell in Transformer.iter_transform(sample_rows, batch_size=len(sample_rows), fields=fields)
+    ]
+
+
+def transform_pool(workers: int) -> multiprocessing.pool.Pool:
+    """A pool of worker processes for transform_in_processes(), their H3 caches sized like this process's"""
+    return multiprocessing.Pool(workers, _init_transform_worker, (_shared_h3_cell_cache.max_size,))
+
+
+def transform_in_processes(
+    pool: multiprocessing.pool.Pool,
+    sample_rows: typing.Sequence[SampleRow],
+    chunk_size: int = Transformer.TRANSFORM_BATCH_SIZE,
+    fields: Optional[typing.Iterable[str]] = None
+) -> typing.Iterator[typing.Tuple[SampleRow, typing.Dict, Optional[str]]]:
+    """Transform SampleRows across a pool from transform_pool(), yielding (sample, record, h3) in input order.
+
+    The rows are shipped to the workers chunk_size at a time -- SampleRows are plain tuples, so they pickle cheaply,
+    unlike Samples, which would drag their session along.  Each worker keeps its own category and H3 caches, and the
+    records are identical to Transformer.iter_transform()'s.
+    """
+    field_tuple = tuple(fields) if fields is not None else None
+    chunks = [sample_rows[index:index + chunk_size] for index in range(0, len(sample_rows), chunk_size)]
+    results = pool.imap(functools.partial(_transform_sample_rows, fields=field_tuple), [list(chunk) for chunk in chunks])
+    for chunk, chunk_results in zip(chunks, results):
+        for sample_row, (record, h3_cell) in zip(chunk, chunk_results):
+            yield sample_row, record, h3_cell
+
+
+def material_type(classification: Optional[str], top_level_classification: Optional[str]) -> str:
+    """The material string the category mappers match on, built from a sample's classification names"""
+    if classification is not None and top_level_classification is not None:
+        return f"{classification}>{top_level_classification}"
+    elif classification is not None:
+        return classification
+    elif top_level_classification is not None:
+        return top_level_classification
+    return ""
+
+
+def prewarm_category_caches(session: Session, lookup_cache: LookupCache) -> int:
+    """Fill the MetaMappers' category caches from every distinct category input in the SESAR database.
+
+    Returns the number of distinct (classification, top level classification, location type, sample type)
+    combinations read.
+    """
+    category_inputs = get_distinct_category_inputs(session)
+    materials = set()
+    contexts = set()
+    sample_types = set()
+    for classification_id, top_level_classification_id, primary_location_type, sample_type_id in category_inputs:
+        material = material_type(
+            lookup_cache.classification_name(classification_id),
+            lookup_cache.classification_name(top_level_classification_id)
+        )
+        materials.add((material, None))
+        contexts.add((material, primary_location_type))
+        sample_types.add((lookup_cache.sample_type_name(sample_type_id), None))
+    MaterialCategoryMetaMapper.prewarm(materials)
+    ContextCategoryMetaMapper.prewarm(contexts)
+    SpecimenCategoryMetaMapper.prewarm(sample_types)
+    return len(category_inputs)
+
+
 def geo_to_h3(
     latitude: typing.Optional[float],
     longitude: typing.Optional[float],
     resolution: int = Transformer.DEFAULT_H3_RESOLUTION
 ) -> typing.Optional[str]:
     if latitude is not None and longitude is not None:
-        return h3.latlng_to_cell(latitude, longitude, resolution)
+        return _shared_h3_cell_cache.cells(latitude, longitude, [resolution])[resolution]
     else:
         return None
+
+
+def h3_cells(
+    latitude: typing.Optional[float],
+    longitude: typing.Optional[float],
+    resolutions: typing.Iterable[int],
+    derive_from_finest: bool = False
+) -> typing.Dict[int, typing.Optional[str]]:
+    """The H3 cells containing a point at each of the given resolutions, keyed by resolution.
+
+    With derive_from_finest, the point is projected once at the finest resolution and the coarser cells are found by
+    walking up to their parents (see Transformer.H3_DERIVE_FROM_FINEST for the caveat).
+    """
+    resolutions = sorted(set(resolutions), reverse=True)
+    if latitude is None or longitude is None:
+        return {resolution: None for resolution in resolutions}
+    if not derive_from_finest:
+        return {resolution: h3.latlng_to_cell(latitude, longitude, resolution) for resolution in resolutions}
+    finest_cell = h3.latlng_to_cell(latitude, longitude, resolutions[0])
+    return {resolution: h3.cell_to_parent(finest_cell, resolution) for resolution in resolutions}
+
+
+class H3CellCache():
+    """Bounded LRU of H3 cells keyed on a point's coordinates.
+
+    Large parts of SESAR share identical coordinates -- cores from one hole, cruise stations, splits of one parent --
+    so rather than re-indexing the same point at every resolution for each of them, keep the most recently used points'
+    cells around.  Once max_size points are held, the least recently used one is evicted to make room.
+    """
+
+    DEFAULT_MAX_SIZE = 50000
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._cells_by_point: OrderedDict[tuple, typing.Dict[int, typing.Optional[str]]] = OrderedDict()
+        # the recency order is rewritten on every lookup, so even hits have to be serialized across threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cells(
+        self,
+        latitude: typing.Optional[float],
+        longitude: typing.Optional[float],
+        resolutions: typing.Iterable[int],
+        derive_from_finest: bool = False
+    ) -> typing.Dict[int, typing.Optional[str]]:
+        """Same as h3_cells, answered out of the cache when this point has already been indexed at those resolutions"""
+        resolutions = set(resolutions)
+        if latitude is None or longitude is None:
+            return {resolution: None for resolution in resolutions}
+        key = (latitude, longitude, derive_from_finest)
+        with self._lock:
+            point_cells = self._cells_by_point.get(key)
+            if point_cells is not None and resolutions.issubset(point_cells.keys()):
+                self.hits += 1
+                self._cells_by_point.move_to_end(key)
+            else:
+                self.misses += 1
+                if point_cells is None:
+                    point_cells = h3_cells(latitude, longitude, resolutions, derive_from_finest)
+                elif derive_from_finest:
+                    # derived cells depend on which resolution is finest, so recompute the whole set together
+                    point_cells = h3_cells(latitude, longitude, resolutions.union(point_cells.keys()), True)
+                else:
+                    point_cells.update(h3_cells(latitude, longitude, resolutions.difference(point_cells.keys())))
+                self._cells_by_point[key] = point_cells
+                self._cells_by_point.move_to_end(key)
+                self._evict()
+            return {resolution: point_cells[resolution] for resolution in resolutions}
+
+    def _evict(self):
+        # callers hold self._lock
+        while len(self._cells_by_point) > self.max_size:
+            self._cells_by_point.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, max_size: int):
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        """Drop every cached point and reset the counters"""
+        with self._lock:
+            self._cells_by_point.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._cells_by_point),
+            }
+
+
+_shared_h3_cell_cache = H3CellCache()
+
+
+def shared_h3_cell_cache() -> H3CellCache:
+    """The process-wide H3CellCache that geo_to_h3 and the Transformer go through"""
+    return _shared_h3_cell_cache
+
+
+def h3_cells_batch(
+    latitudes: typing.Sequence[typing.Optional[float]],
+    longitudes: typing.Sequence[typing.Optional[float]],
+    resolutions: typing.Iterable[int],
+    derive_from_finest: bool = False
+) -> typing.Dict[int, np.ndarray]:
+    """The batch counterpart of h3_cells: per-resolution object arrays of cells, aligned with the input coordinates.
+
+    Missing coordinates (None or NaN) are masked out up front and come back as None.  The remaining points are
+    deduplicated, so samples that share a location (cores from one hole, splits of one parent) are only indexed once,
+    and each distinct point is looked up in the shared H3CellCache before being indexed.
+    """
+    latitude_array = np.asarray(latitudes, dtype=np.float64)
+    longitude_array = np.asarray(longitudes, dtype=np.float64)
+    resolutions = sorted(set(resolutions), reverse=True)
+    cells_by_resolution = {
+        resolution: np.full(len(latitude_array), None, dtype=object) for resolution in resolutions
+    }
+    valid_indexes = np.flatnonzero(~(np.isnan(latitude_array) | np.isnan(longitude_array)))
+    if len(valid_indexes) == 0 or len(resolutions) == 0:
+        return cells_by_resolution
+    points, inverse = np.unique(
+        np.column_stack((latitude_array[valid_indexes], longitude_array[valid_indexes])),
+        axis=0,
+        return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    cells_by_point = [
+        _shared_h3_cell_cache.cells(latitude, longitude, resolutions, derive_from_finest)
+        for latitude, longitude in points.tolist()
+    ]
+    for resolution in resolutions:
+        point_cells = np.array([cells[resolution] for cells in cells_by_point], dtype=object)
+        cells_by_resolution[resolution][valid_indexes] = point_cells[inverse]
+    return cells_by_resolution
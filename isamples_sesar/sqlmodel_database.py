@@ -1,8 +1,37 @@
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
 from datetime import datetime
 
+from sqlalchemy import func, or_, tuple_, union
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from sqlmodel import create_engine, Session, select
+from isamples_sesar.classification import Classification
+from isamples_sesar.launch_type import Launch_Type
+from isamples_sesar.load_state import Watermark
+from isamples_sesar.nav_type import Nav_Type
 from isamples_sesar.sample import Sample
+from isamples_sesar.sample_delete_request import Sample_Delete_Request
+from isamples_sesar.sample_row import SampleRow
+from isamples_sesar.sample_type import Sample_Type
+from isamples_sesar.sesar_user import Sesar_User
+
+# Loader options that fetch every relationship Transformer.transform() touches along with the samples themselves, so a
+# batch costs a fixed number of queries instead of one lazy load per relationship per sample.  The lookup tables are
+# tiny and shared by many samples, so they're joined onto the sample query directly.  The parent sample is as wide as
+# the sample itself, so it's fetched with a separate SELECT ... WHERE sample_id IN (...) rather than doubling every row.
+LOOKUP_TABLE_OPTIONS = [
+    joinedload(Sample.sample_type).joinedload(Sample_Type.parent_sample_type),  # type: ignore
+    joinedload(Sample.classification),  # type: ignore
+    joinedload(Sample.top_level_classification),  # type: ignore
+    joinedload(Sample.launch_type),  # type: ignore
+    joinedload(Sample.nav_type),  # type: ignore
+]
+# A Transformer with a LookupCache resolves the lookup tables from their ids, so it only needs these
+RELATED_RECORD_OPTIONS = [
+    joinedload(Sample.cur_owner),  # type: ignore
+    joinedload(Sample.cur_registrant),  # type: ignore
+    selectinload(Sample.parent),  # type: ignore
+]
+TRANSFORM_READY_OPTIONS = LOOKUP_TABLE_OPTIONS + RELATED_RECORD_OPTIONS
 
 
 class SQLModelDAO:
@@ -17,6 +46,11 @@ class SQLModelDAO:
         return Session(self.engine)
 
 
+def _published() -> Any:
+    """Matches samples that haven't been archived, or whose archive_date hasn't come round yet"""
+    return or_(Sample.archive_date.is_(None), Sample.archive_date > func.now())  # type: ignore
+
+
 def get_sample_rows(session: Session, offset: int = 0, limit: int = 1000, last_update_date: Optional[datetime] = None) -> Any:
     if last_update_date is not None:
         statement = (
@@ -30,6 +64,190 @@ def get_sample_rows(session: Session, offset: int = 0, limit: int = 1000, last_u
     return results
 
 
+def _sample_row_statement() -> Any:
+    """A SELECT of exactly the SampleRow fields, in order, with the lookup names and related records outer joined"""
+    sample_type = aliased(Sample_Type)
+    parent_sample_type = aliased(Sample_Type)
+    classification = aliased(Classification)
+    top_level_classification = aliased(Classification)
+    launch_type = aliased(Launch_Type)
+    nav_type = aliased(Nav_Type)
+    parent = aliased(Sample)
+    cur_registrant = aliased(Sesar_User)
+    cur_owner = aliased(Sesar_User)
+    joined_columns: dict[str, Any] = {
+        "sample_type_name": sample_type.name,
+        "parent_sample_type_name": parent_sample_type.name,
+        "classification_name": classification.name,
+        "top_level_classification_name": top_level_classification.name,
+        "launch_type_name": launch_type.name,
+        "nav_type_name": nav_type.name,
+        "parent_igsn": parent.igsn,
+        # use the joined primary keys so a dangling foreign key reads as no user, same as the relationship would
+        "cur_registrant_id": cur_registrant.sesar_user_id,
+        "cur_registrant_fname": cur_registrant.fname,
+        "cur_registrant_lname": cur_registrant.lname,
+        "cur_owner_id": cur_owner.sesar_user_id,
+        "cur_owner_fname": cur_owner.fname,
+        "cur_owner_lname": cur_owner.lname,
+        "cur_owner_email": cur_owner.email,
+    }
+    columns = [
+        joined_columns[field].label(field) if field in joined_columns else getattr(Sample, field)
+        for field in SampleRow._fields
+    ]
+    return (
+        select(*columns)
+        .select_from(Sample)
+        .outerjoin(sample_type, Sample.sample_type_id == sample_type.sample_type_id)
+        .outerjoin(parent_sample_type, sample_type.parent_sample_type_id == parent_sample_type.sample_type_id)
+        .outerjoin(classification, Sample.classification_id == classification.classification_id)
+        .outerjoin(
+            top_level_classification,
+            Sample.top_level_classification_id == top_level_classification.classification_id
+        )
+        .outerjoin(launch_type, Sample.launch_type_id == launch_type.launch_type_id)
+        .outerjoin(nav_type, Sample.nav_type_id == nav_type.nav_type_id)
+        .outerjoin(parent, Sample.origin_sample_id == parent.sample_id)
+        .outerjoin(cur_registrant, Sample.cur_registrant_id == cur_registrant.sesar_user_id)
+        .outerjoin(cur_owner, Sample.cur_owner_id == cur_owner.sesar_user_id)
+        .filter(_published())
+    )
+
+
+def get_sample_rows_projected(
+    session: Session,
+    after_sample_id: Optional[int] = None,
+    limit: int = 1000,
+    last_update_date: Optional[datetime] = None,
+    through_sample_id: Optional[int] = None
+) -> tuple[list[SampleRow], Optional[int]]:
+    """Keyset (seek) paging over the sample table in sample_id order, returning compact SampleRows.
+
+    Only the columns the Transformer reads are selected, and the lookup names and related records come back in the
+    same query, so there's no model instantiation or relationship loading per row.  If through_sample_id is specified,
+    paging stops after that sample_id, which is how a worker restricts itself to one of get_sample_id_ranges.
+    """
+    statement = _sample_row_statement()
+    if after_sample_id is not None:
+        statement = statement.filter(Sample.sample_id > after_sample_id)
+    if through_sample_id is not None:
+        statement = statement.filter(Sample.sample_id <= through_sample_id)
+    if last_update_date is not None:
+        statement = statement.filter(Sample.last_update_date >= last_update_date)
+    statement = statement.order_by(Sample.sample_id).limit(limit)
+    results = [SampleRow._make(row) for row in session.exec(statement)]
+    next_sample_id = results[-1].sample_id if len(results) == limit else None
+    return results, next_sample_id
+
+
+def get_sample_rows_after_watermark(
+    session: Session,
+    watermark: Watermark,
+    limit: int = 1000
+) -> tuple[list[SampleRow], Optional[Watermark]]:
+    """Keyset paging over (last_update_date, sample_id) for incremental loads.
+
+    Returns the SampleRows that sort strictly after the watermark, oldest update first, along with the watermark to
+    pass in for the next page, or None if this was the last page.  To start from a date rather than a previous
+    watermark, pass (date, -1).  Each page is a seek on the pair, so it wants an index on
+    sample (last_update_date, sample_id) to stay cheap on the full table.
+    """
+    statement = (
+        _sample_row_statement()
+        .filter(tuple_(Sample.last_update_date, Sample.sample_id) > tuple_(*watermark))  # type: ignore
+        .order_by(Sample.last_update_date, Sample.sample_id)
+        .limit(limit)
+    )
+    results = [SampleRow._make(row) for row in session.exec(statement)]
+    next_watermark = None
+    if len(results) == limit:
+        next_watermark = (results[-1].last_update_date, results[-1].sample_id)
+    return results, next_watermark  # type: ignore
+
+
+def get_sample_id_ranges(
+    session: Session,
+    num_ranges: int,
+    last_update_date: Optional[datetime] = None
+) -> list[tuple[Optional[int], Optional[int]]]:
+    """Split the sample_id key space into at most num_ranges inclusive (first, last) ranges of near-equal row counts.
+
+    Rows are bucketed with ntile() over the sample_id index, so the ranges stay balanced however sparse or clumpy the
+    ids are.  This reads every matching sample_id once (an index-only scan on Postgres), which is cheap next to the
+    load it's partitioning.
+
+    The ranges are contiguous and the first and last are open-ended (None), so they cover every sample_id.  A sample
+    inserted, updated or published after the split still falls into one of them.
+    """
+    sample_ids = select(Sample.sample_id).filter(_published())
+    if last_update_date is not None:
+        sample_ids = sample_ids.filter(Sample.last_update_date >= last_update_date)  # type: ignore
+    bucketed = sample_ids.add_columns(
+        func.ntile(num_ranges).over(order_by=Sample.sample_id).label("bucket")  # type: ignore
+    ).subquery()
+    statement = (
+        select(func.max(bucketed.c.sample_id))
+        .group_by(bucketed.c.bucket)
+        .order_by(bucketed.c.bucket)
+    )
+    bucket_ends: list[Optional[int]] = list(session.exec(statement).all())[:-1]  # type: ignore
+    bucket_starts = [None] + [bucket_end + 1 for bucket_end in bucket_ends]  # type: ignore
+    return list(zip(bucket_starts, bucket_ends + [None]))
+
+
+def count_sample_rows(session: Session, last_update_date: Optional[datetime] = None) -> int:
+    statement = select(func.count(Sample.sample_id)).filter(_published())  # type: ignore
+    if last_update_date is not None:
+        statement = statement.filter(Sample.last_update_date >= last_update_date)  # type: ignore
+    return session.exec(statement).one()
+
+
+def get_distinct_category_inputs(session: Session) -> list[tuple[Optional[int], Optional[int], Optional[str], int]]:
+    """Every distinct (classification_id, top_level_classification_id, primary_location_type, sample_type_id) in use"""
+    statement = select(
+        Sample.classification_id,
+        Sample.top_level_classification_id,
+        Sample.primary_location_type,
+        Sample.sample_type_id
+    ).distinct()
+    return [tuple(row) for row in session.exec(statement).all()]  # type: ignore
+
+
+def iter_samples(
+    session: Session,
+    since: Optional[datetime] = None,
+    chunk_size: int = 1000,
+    transform_ready: bool = False,
+    lookup_cached: bool = False
+) -> Iterator[list[Sample]]:
+    """Stream samples in sample_id order, chunk_size at a time, over a server-side cursor.
+
+    Rather than materialising the whole result set up front, rows are pulled from the database as each chunk is
+    consumed, so memory stays bounded by the chunk size and callers can start working on the first chunk before the
+    rest has arrived.  The session must stay open (and shouldn't be used for anything else) until iteration finishes.
+
+    Arguments:
+        session -- The SESAR database session
+        since -- If specified, only return samples updated on or after this date
+        chunk_size -- The number of samples to fetch from the cursor and yield at a time
+        transform_ready -- If True, eagerly load every relationship the Transformer uses (see TRANSFORM_READY_OPTIONS)
+        lookup_cached -- If True along with transform_ready, leave out the lookup tables, for a Transformer that
+            resolves them with a LookupCache (see RELATED_RECORD_OPTIONS)
+    Return value:
+        An iterator over lists of at most chunk_size samples
+    """
+    statement = select(Sample).filter(_published())
+    if since is not None:
+        statement = statement.filter(Sample.last_update_date >= since)  # type: ignore
+    if transform_ready:
+        statement = statement.options(*(RELATED_RECORD_OPTIONS if lookup_cached else TRANSFORM_READY_OPTIONS))
+    # yield_per turns on stream_results, which is a named (server-side) cursor on psycopg2
+    statement = statement.order_by(Sample.sample_id).execution_options(yield_per=chunk_size)  # type: ignore
+    for chunk in session.exec(statement).partitions():
+        yield list(chunk)
+
+
 def get_sample_with_id(session: Session, sample_id: int) -> Optional[Sample]:
     statement = (
         select(Sample).filter(Sample.sample_id == sample_id)
@@ -44,3 +262,70 @@ def get_sample_with_igsn(session: Session, igsn: str) -> Optional[Sample]:
     )
     result = session.exec(statement).first()
     return result
+
+
+def get_samples_with_igsns(
+    session: Session,
+    igsns: Iterable[str],
+    chunk_size: int = 1000
+) -> Iterator[Sample]:
+    """Look up many samples by IGSN with one IN query per chunk_size IGSNs instead of one query per IGSN.
+
+    Each chunk is answered off sample_igsn_idx with every relationship the Transformer uses eagerly loaded.  Samples
+    are yielded in the order their IGSNs were given; duplicates are only looked up once, and IGSNs with no matching
+    sample are skipped.
+    """
+    chunk: list[str] = []
+    seen: set[str] = set()
+    for igsn in igsns:
+        if igsn in seen:
+            continue
+        seen.add(igsn)
+        chunk.append(igsn)
+        if len(chunk) == chunk_size:
+            yield from _samples_with_igsns_chunk(session, chunk)
+            chunk = []
+    if chunk:
+        yield from _samples_with_igsns_chunk(session, chunk)
+
+
+def _samples_with_igsns_chunk(session: Session, igsns: list[str]) -> Iterator[Sample]:
+    statement = (
+        select(Sample).filter(Sample.igsn.in_(igsns)).options(*TRANSFORM_READY_OPTIONS)  # type: ignore
+    )
+    samples_by_igsn = {sample.igsn: sample for sample in session.exec(statement).all()}
+    for igsn in igsns:
+        sample = samples_by_igsn.get(igsn)
+        if sample is not None:
+            yield sample
+
+
+def get_removed_samples(
+    session: Session,
+    since: datetime,
+    until: Optional[datetime] = None
+) -> list[tuple[int, Optional[str]]]:
+    """The (sample_id, igsn) of samples archived, deleted or deactivated on or after since and no later than until.
+
+    until defaults to the database's now(): an archive_date still to come means the sample is published until then.
+    Archived samples are found off the partial sample_archive_date_idx index and delete requests by their
+    deleted/deactivated dates, so the cost follows the number of changes rather than the size of the catalogue.  A
+    delete request whose sample row has already gone comes back with a None igsn, since sample_delete_request only
+    holds the sample_id.
+    """
+    upper_bound = until if until is not None else func.now()
+    archived = (
+        select(Sample.sample_id, Sample.igsn)
+        .filter(Sample.archive_date >= since, Sample.archive_date <= upper_bound)  # type: ignore
+    )
+    delete_requested = (
+        select(Sample_Delete_Request.sample_id, Sample.igsn)
+        .outerjoin(Sample, Sample_Delete_Request.sample_id == Sample.sample_id)  # type: ignore
+        .filter(Sample_Delete_Request.sample_id.is_not(None))  # type: ignore
+        .filter(or_(
+            Sample_Delete_Request.deleted_date.between(since, upper_bound),  # type: ignore
+            Sample_Delete_Request.deactivated_date.between(since, upper_bound)  # type: ignore
+        ))
+    )
+    statement = union(archived, delete_requested)
+    return [(sample_id, igsn) for sample_id, igsn in session.exec(statement).all()]  # type: ignore
@@ -0,0 +1,157 @@
+import array
+import hashlib
+import os
+import typing
+from typing import Optional
+
+import numpy as np
+
+
+def thing_id_digest(thing_id: str) -> int:
+    """The 64-bit digest a ThingIdIndex keys a thing id on"""
+    return int.from_bytes(hashlib.blake2b(thing_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class ThingIdIndex():
+    """A compact map of thing id to iSB primary key, for the loader's "does this thing exist yet" checks.
+
+    A dict of every SESAR thing id to its primary key costs a couple of hundred bytes per thing, most of it in the id
+    strings.  Here each id is reduced to a 64-bit digest, and the digests and keys are held in a pair of sorted numpy
+    arrays, 16 bytes per thing, with lookups by binary search.  Things added after the arrays are built go into a
+    small overflow dict, which is merged into the arrays whenever it reaches OVERFLOW_COMPACT_SIZE entries, so even
+    a first load that adds every thing only ever holds that many at dict cost.
+
+    It answers the parts of the dict interface that DatabaseBulkUpdater and the loader use: get, in, [], len and
+    update.  Two ids sharing a digest is vanishingly unlikely at SESAR's scale (around one in 10^6 for 10^7 things),
+    but it's detected when the arrays are built and reported by num_collisions, so callers can fall back to a dict.
+    """
+
+    # How many things the overflow dict takes before it's merged into the arrays.  A merge is linear in the size of
+    # the arrays (the two sorted runs are merged rather than sorted afresh), so this keeps them rare while the dict
+    # stays a few megabytes.
+    OVERFLOW_COMPACT_SIZE = 65536
+
+    def __init__(
+        self,
+        digests: Optional[np.ndarray] = None,
+        primary_keys: Optional[np.ndarray] = None
+    ):
+        self._digests = digests if digests is not None else np.empty(0, dtype=np.uint64)
+        self._primary_keys = primary_keys if primary_keys is not None else np.empty(0, dtype=np.int64)
+        self._overflow: dict[int, int] = {}
+        # how many overflow entries replace a digest that's still in the arrays, so len() doesn't count them twice
+        self._num_shadowed = 0
+        self.num_collisions = 0
+        self._sort()
+
+    @classmethod
+    def from_rows(cls, rows: typing.Iterable[typing.Tuple[str, int]]) -> "ThingIdIndex":
+        """Build an index from (thing_id, primary_key) rows, e.g. straight off a query, without holding the ids"""
+        digests = array.array("Q")
+        primary_keys = array.array("q")
+        for thing_id, primary_key in rows:
+            digests.append(thing_id_digest(thing_id))
+            primary_keys.append(primary_key)
+        return cls(
+            np.frombuffer(digests, dtype=np.uint64).copy(), np.frombuffer(primary_keys, dtype=np.int64).copy()
+        )
+
+    def _sort(self):
+        order = np.argsort(self._digests, kind="stable")
+        self._digests = self._digests[order]
+        self._primary_keys = self._primary_keys[order]
+        self.num_collisions = int(np.count_nonzero(self._digests[1:] == self._digests[:-1]))
+
+    def _find_in_arrays(self, digest: int) -> Optional[int]:
+        position = int(np.searchsorted(self._digests, np.uint64(digest)))
+        if position < len(self._digests) and int(self._digests[position]) == digest:
+            return int(self._primary_keys[position])
+        return None
+
+    def _find(self, digest: int) -> Optional[int]:
+        primary_key = self._overflow.get(digest)
+        if primary_key is not None:
+            return primary_key
+        return self._find_in_arrays(digest)
+
+    def get(self, thing_id: str, default: Optional[int] = None) -> Optional[int]:
+        primary_key = self._find(thing_id_digest(thing_id))
+        return primary_key if primary_key is not None else default
+
+    def __contains__(self, thing_id: object) -> bool:
+        return isinstance(thing_id, str) and self._find(thing_id_digest(thing_id)) is not None
+
+    def __getitem__(self, thing_id: str) -> int:
+        primary_key = self._find(thing_id_digest(thing_id))
+        if primary_key is None:
+            raise KeyError(thing_id)
+        return primary_key
+
+    def __setitem__(self, thing_id: str, primary_key: int):
+        digest = thing_id_digest(thing_id)
+        if digest not in self._overflow and self._find_in_arrays(digest) is not None:
+            self._num_shadowed += 1
+        self._overflow[digest] = primary_key
+        if len(self._overflow) >= self.OVERFLOW_COMPACT_SIZE:
+            self.compact()
+
+    def __len__(self) -> int:
+        return len(self._digests) + len(self._overflow) - self._num_shadowed
+
+    def update(self, primary_keys_by_id: typing.Mapping[str, int]):
+        for thing_id, primary_key in primary_keys_by_id.items():
+            self[thing_id] = primary_key
+
+    def add_rows(self, rows: typing.Iterable[typing.Tuple[str, int]]):
+        """Add (thing_id, primary_key) rows, e.g. the things created since a snapshot, and compact"""
+        for thing_id, primary_key in rows:
+            self[thing_id] = primary_key
+        self.compact()
+
+    def compact(self):
+        """Merge the overflow dict into the sorted arrays"""
+        if len(self._overflow) == 0:
+            return
+        overflow_digests = np.fromiter(self._overflow.keys(), dtype=np.uint64, count=len(self._overflow))
+        overflow_keys = np.fromiter(self._overflow.values(), dtype=np.int64, count=len(self._overflow))
+        # an overflow entry for a digest that's already in the arrays replaces it
+        positions = np.searchsorted(self._digests, overflow_digests)
+        in_range = positions < len(self._digests)
+        positions = positions[in_range]
+        shadowed = positions[self._digests[positions] == overflow_digests[in_range]]
+        keep = np.ones(len(self._digests), dtype=bool)
+        keep[shadowed] = False
+        # the arrays are already sorted, so the stable sort in _sort() only has to merge the overflow in
+        self._digests = np.concatenate([self._digests[keep], overflow_digests])
+        self._primary_keys = np.concatenate([self._primary_keys[keep], overflow_keys])
+        self._overflow = {}
+        self._num_shadowed = 0
+        self._sort()
+
+    @property
+    def max_primary_key(self) -> Optional[int]:
+        """The highest primary key held, so a warm start can fetch just the things created since"""
+        # compacted first, so a key an overflow entry has replaced doesn't count
+        self.compact()
+        return int(self._primary_keys.max()) if len(self._primary_keys) > 0 else None
+
+    @property
+    def primary_key_sum(self) -> int:
+        """The sum of the primary keys held, which with len() and max_primary_key fingerprints the things indexed"""
+        self.compact()
+        return int(self._primary_keys.sum())
+
+    def save(self, path: str):
+        """Write a snapshot to path, through a temporary file and an atomic rename like LoadState"""
+        self.compact()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            np.savez(snapshot_file, digests=self._digests, primary_keys=self._primary_keys)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ThingIdIndex":
+        with np.load(path) as snapshot:
+            return cls(snapshot["digests"], snapshot["primary_keys"])
@@ -0,0 +1,119 @@
+import datetime
+import typing
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+from isb_lib.models.thing import Thing  # type: ignore
+
+# The dialects with an INSERT ... ON CONFLICT DO UPDATE, keyed by SQLAlchemy dialect name
+_UPSERT_INSERTS: typing.Dict[str, typing.Callable] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def upsert_statement(
+    dialect_name: str,
+    model: typing.Any,
+    rows: typing.List[typing.Dict[str, typing.Any]],
+    index_elements: typing.List[typing.Any],
+    updates: typing.Callable[[typing.Any], typing.Dict[str, typing.Any]]
+):
+    """A single multi-row INSERT of rows into model's table.
+
+    Rows that conflict on index_elements are updated instead, with the column values updates() returns when it's
+    passed the statement's excluded namespace (the values that would have been inserted).
+    """
+    insert = _UPSERT_INSERTS.get(dialect_name)
+    if insert is None:
+        raise ValueError(f"Upserting isn't supported on {dialect_name}")
+    statement = insert(model).values(rows)
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=updates(statement.excluded))
+
+
+def _thing_updates(excluded) -> typing.Dict[str, typing.Any]:
+    return {
+        "authority_id": excluded.authority_id,
+        "resolved_url": excluded.resolved_url,
+        "resolved_status": excluded.resolved_status,
+        "tresolved": excluded.tresolved,
+        "tstamp": excluded.tstamp,
+        "resolved_content": excluded.resolved_content,
+        "resolved_media_type": excluded.resolved_media_type,
+        "h3": excluded.h3,
+        # keep the original creation time if the sample didn't come with one
+        "tcreated": func.coalesce(excluded.tcreated, Thing.tcreated),
+    }
+
+
+def thing_upsert_statement(dialect_name: str, rows: typing.List[typing.Dict[str, typing.Any]]):
+    """A single multi-row INSERT of the given thing rows that updates any thing whose id already exists"""
+    return upsert_statement(dialect_name, Thing, rows, [Thing.id], _thing_updates)
+
+
+class ThingUpsertSink():
+    """Writes things to iSB write_batch_size at a time, each batch as one INSERT ... ON CONFLICT (id) DO UPDATE.
+
+    A drop-in for DatabaseBulkUpdater's add_thing()/finish(), except that the database sorts out which things are
+    new, so there's no map of existing primary keys to load or keep current, and a batch is a single round trip
+    rather than a bulk insert plus a bulk update.  Works on PostgreSQL and SQLite.
+    """
+
+    DEFAULT_WRITE_BATCH_SIZE = 1000
+
+    def __init__(
+        self,
+        session: Session,
+        authority_id: str,
+        resolved_media_type: str,
+        write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE
+    ):
+        self.session = session
+        self.authority_id = authority_id
+        self.resolved_media_type = resolved_media_type
+        self.write_batch_size = write_batch_size
+        self.num_written = 0
+        # keyed by thing id: PostgreSQL won't let one statement update the same row twice, so the last one wins
+        self._rows_by_id: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._dialect_name = session.get_bind().dialect.name
+
+    def add_thing(
+        self,
+        resolved_content: typing.Dict,
+        thing_id: str,
+        resolved_url: str,
+        resolved_status: int,
+        h3: Optional[str],
+        t_created: Optional[datetime.datetime]
+    ):
+        now = datetime.datetime.now()
+        self._rows_by_id[thing_id] = {
+            "id": thing_id,
+            "authority_id": self.authority_id,
+            "resolved_url": resolved_url,
+            "resolved_status": resolved_status,
+            "tresolved": now,
+            "tstamp": now,
+            "resolved_content": resolved_content,
+            "resolved_media_type": self.resolved_media_type,
+            "h3": h3,
+            "tcreated": t_created,
+        }
+        if len(self._rows_by_id) >= self.write_batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write and commit whatever's been added since the last flush"""
+        if len(self._rows_by_id) == 0:
+            return
+        rows = list(self._rows_by_id.values())
+        self.session.exec(thing_upsert_statement(self._dialect_name, rows))
+        self.session.commit()
+        self.num_written += len(rows)
+        self._rows_by_id = {}
+
+    def finish(self):
+        self.flush()
@@ -1,6 +1,6 @@
 import click
 import click_config_file
-from isamples_sesar.sqlmodel_database import SQLModelDAO, get_sample_with_igsn
+from isamples_sesar.sqlmodel_database import SQLModelDAO, get_samples_with_igsns
 from isamples_sesar.sesar_transformer import Transformer
 import json
 
@@ -21,14 +21,15 @@ def main(sesar_db_url: str):
     dao = SQLModelDAO(sesar_db_url)
     session = dao.get_session()
 
-    sample = get_sample_with_igsn(session, "10.58052/EOI00002H")
-    sample = get_sample_with_igsn(session, "10.58052/IEDUT103B")
-    sample = get_sample_with_igsn(session, "10.58052/IEEJR000M")
-    sample = get_sample_with_igsn(session, "10.58052/IEJEN0040")
-    sample = get_sample_with_igsn(session, "10.58052/IERVTL1I7")
-    sample = get_sample_with_igsn(session, "10.60471/ODP02Q1IZ")
-    if sample:
-        content = Transformer(sample).transform()
+    igsns = [
+        "10.58052/EOI00002H",
+        "10.58052/IEDUT103B",
+        "10.58052/IEEJR000M",
+        "10.58052/IEJEN0040",
+        "10.58052/IERVTL1I7",
+        "10.60471/ODP02Q1IZ",
+    ]
+    for content in Transformer.transform_many(get_samples_with_igsns(session, igsns)):
         print(json.dumps(content, indent=4, sort_keys=True, default=str))
 
     session.close()
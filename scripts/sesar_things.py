@@ -1,48 +1,799 @@
 import click
 import click_config_file
+import contextlib
 import isb_lib.core  # type: ignore
 import logging
 import datetime
 import fileinput
+import itertools
 import json
+import math
+import multiprocessing
+import os
+import resource
+import time
+import uuid
 
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlmodel import delete, func, select, update
+
+from isb_lib.models.thing import Thing  # type: ignore
+from isamples_sesar.columnar_transformer import ColumnarTransformer
+from isamples_sesar.content_hash import ContentHashStore, record_content_hash
+from isamples_sesar.load_state import LoadState
+from isamples_sesar.lookup_cache import shared_lookup_cache
+from isamples_sesar.sample_thing import SampleThingStore
 from isamples_sesar.sesar_adapter import SESARItem
-from isamples_sesar.sqlmodel_database import SQLModelDAO as SESAR_SQLModelDAO, get_sample_rows
-from isamples_sesar.sesar_transformer import Transformer, geo_to_h3
+from isamples_sesar.thing_id_index import ThingIdIndex
+from isamples_sesar.thing_sink import ThingUpsertSink
+from isamples_sesar.sqlmodel_database import (
+    SQLModelDAO as SESAR_SQLModelDAO,
+    count_sample_rows,
+    get_removed_samples,
+    get_sample_id_ranges,
+    get_sample_rows_after_watermark,
+    get_sample_rows_projected,
+    get_samples_with_igsns,
+    iter_samples
+)
+from isamples_sesar.sesar_transformer import (
+    ContextCategoryMetaMapper,
+    H3CellCache,
+    MaterialCategoryMetaMapper,
+    SpecimenCategoryMetaMapper,
+    Transformer,
+    compile_transform_plan,
+    prewarm_category_caches,
+    shared_h3_cell_cache,
+    transform_in_processes,
+    transform_pool
+)
 from isb_web.sqlmodel_database import SQLModelDAO as iSB_SQLModelDAO, all_thing_primary_keys, save_or_update_thing, get_thing_with_id, DatabaseBulkUpdater  # type: ignore
 
 BATCH_SIZE = 10000
+# The resolved_status recorded on things whose samples have been archived or deleted in SESAR
+TOMBSTONE_STATUS = 410
+REMOVALS_SINCE_KEY = "removals_since"
+# How long to wait before the first retry of a batch that hit a transient database error, doubled for each retry
+RETRY_BACKOFF_SECONDS = 1.0
+
+
+def is_transient_error(error):
+    """Whether a database error is worth retrying: a dropped connection, a failover, a deadlock and the like"""
+    return isinstance(error, (OperationalError, InterfaceError)) or error.connection_invalidated
+
+
+def retry_transient_errors(operation, sessions, max_retries=0, backoff_seconds=RETRY_BACKOFF_SECONDS):
+    """Return operation(attempt), retrying it up to max_retries times if it hits a transient database error.
 
+    Before each retry the sessions are rolled back, and there's a wait of backoff_seconds, doubling every time.  Any
+    other error, or a transient one once the retries are used up, is raised.
+    """
+    attempt = 0
+    while True:
+        try:
+            return operation(attempt)
+        except DBAPIError as e:
+            if attempt >= max_retries or not is_transient_error(e):
+                raise
+            for session in sessions:
+                session.rollback()
+            delay = backoff_seconds * 2 ** attempt
+            logging.warning("Transient database error, retrying in %.1f seconds: %s", delay, e)
+            time.sleep(delay)
+            attempt += 1
 
-def load_sesar_entries(sesar_db_session, isb_db_session, start_from=None):
+
+def keyset_sample_batches(
+    sesar_db_session,
+    start_from=None,
+    batch_size=BATCH_SIZE,
+    after_sample_id=None,
+    through_sample_id=None,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
     more_samples = True
-    offset = 0
-    num_newer = 0
     while (more_samples):
-        primary_keys_by_id = all_thing_primary_keys(isb_db_session, SESARItem.AUTHORITY_ID)
-        bulk_updater = DatabaseBulkUpdater(
+        samples, after_sample_id = retry_transient_errors(
+            lambda attempt: get_sample_rows_projected(
+                sesar_db_session, after_sample_id, batch_size, start_from, through_sample_id
+            ),
+            [sesar_db_session],
+            max_retries,
+            retry_backoff_seconds
+        )
+        if (after_sample_id is None):
+            more_samples = False
+        if (len(samples) > 0):
+            yield samples
+
+
+def watermark_sample_batches(
+    sesar_db_session, watermark, batch_size=BATCH_SIZE, max_retries=0, retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    while (watermark is not None):
+        samples, watermark = retry_transient_errors(
+            lambda attempt: get_sample_rows_after_watermark(sesar_db_session, watermark, batch_size),
+            [sesar_db_session],
+            max_retries,
+            retry_backoff_seconds
+        )
+        if (len(samples) > 0):
+            yield samples
+
+
+def peak_rss_mb():
+    """The peak resident set size of this process so far, in megabytes"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def expunge_everything(session):
+    """Expunge every object a session holds, one by one.
+
+    Unlike expunge_all() this keeps the session's identity map, which a result still streaming off a server-side
+    cursor (see iter_samples) goes on loading into.
+    """
+    for instance in list(session.identity_map.values()):
+        if instance in session:
+            session.expunge(instance)
+
+
+def current_rss_mb():
+    """The resident set size of this process right now, in megabytes.
+
+    Read from /proc/self/statm, so it can go down as well as up, unlike the peak.  Where there's no /proc it falls
+    back to the peak.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+
+def thing_primary_keys(isb_db_session, thing_ids):
+    """The primary keys of just the given things, keyed by thing id, read BATCH_SIZE ids at a time"""
+    primary_keys_by_id = {}
+    for index in range(0, len(thing_ids), BATCH_SIZE):
+        batch_ids = thing_ids[index:index + BATCH_SIZE]
+        primary_keys_by_id.update(
+            isb_db_session.exec(select(Thing.id, Thing.primary_key).where(Thing.id.in_(batch_ids))).all()
+        )
+    return primary_keys_by_id
+
+
+def thing_primary_key_rows(isb_db_session, after_primary_key=None):
+    """Stream (thing id, primary key) for the SESAR things in iSB, optionally just those created after a given key"""
+    statement = select(Thing.id, Thing.primary_key).where(Thing.authority_id == SESARItem.AUTHORITY_ID)
+    if after_primary_key is not None:
+        statement = statement.where(Thing.primary_key > after_primary_key)
+    return isb_db_session.exec(statement.execution_options(yield_per=BATCH_SIZE))
+
+
+def load_thing_id_index(isb_db_session, snapshot_path=None):
+    """The ThingIdIndex of the SESAR things in iSB, warm started from snapshot_path when there's one there.
+
+    A warm start reads just the things created since the snapshot was written.  The result is then checked against
+    the count, highest and sum of the SESAR things' primary keys in iSB, and if any of them differ (say some things
+    were deleted, or a thing committed late with a lower key) the snapshot is ignored and the index rebuilt from a
+    full scan.  Should two ids share a digest the loader gets a plain dict instead, as all_thing_primary_keys returns.
+    """
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        thing_id_index = ThingIdIndex.load(snapshot_path)
+        thing_id_index.add_rows(thing_primary_key_rows(isb_db_session, thing_id_index.max_primary_key))
+        num_things, max_primary_key, primary_key_sum = isb_db_session.exec(
+            select(func.count(Thing.primary_key), func.max(Thing.primary_key), func.sum(Thing.primary_key))
+            .where(Thing.authority_id == SESARItem.AUTHORITY_ID)
+        ).one()
+        fingerprint = (num_things, max_primary_key, int(primary_key_sum or 0))
+        index_fingerprint = (len(thing_id_index), thing_id_index.max_primary_key, thing_id_index.primary_key_sum)
+        if fingerprint == index_fingerprint and thing_id_index.num_collisions == 0:
+            logging.info("Warm started the thing id index from %s", snapshot_path)
+            return thing_id_index
+        logging.warning("Thing id index snapshot %s is out of date, rebuilding it", snapshot_path)
+    thing_id_index = ThingIdIndex.from_rows(thing_primary_key_rows(isb_db_session))
+    if thing_id_index.num_collisions > 0:
+        logging.warning("%d thing id digests collide, falling back to a dict", thing_id_index.num_collisions)
+        return all_thing_primary_keys(isb_db_session, SESARItem.AUTHORITY_ID)
+    return thing_id_index
+
+
+def save_thing_id_index(thing_id_index, snapshot_path):
+    if snapshot_path is not None and isinstance(thing_id_index, ThingIdIndex):
+        thing_id_index.save(snapshot_path)
+
+
+def add_things(isb_db_session, bulk_updater, primary_keys_by_id, things):
+    """Write (current_record, thing_id, resolved_url, h3, t_created) tuples through bulk_updater, then add the keys
+    of any things it inserted to primary_keys_by_id, so the map stays current for the next batch.
+
+    Returns the number of things written.
+    """
+    new_thing_ids = []
+    num_things = 0
+    for current_record, thing_id, resolved_url, h3, t_created in things:
+        if thing_id not in primary_keys_by_id:
+            new_thing_ids.append(thing_id)
+        bulk_updater.add_thing(current_record, thing_id, resolved_url, 200, h3, t_created)
+        num_things += 1
+    bulk_updater.finish()
+    # DatabaseBulkUpdater doesn't hand back the keys of the rows it inserts, so read just those
+    primary_keys_by_id.update(thing_primary_keys(isb_db_session, new_thing_ids))
+    return num_things
+
+
+def write_things(isb_db_session, things, primary_keys_by_id=None, write_batch_size=BATCH_SIZE):
+    """Write one batch of (current_record, thing_id, resolved_url, h3, t_created) tuples to iSB.
+
+    With a map of existing primary keys the things go through DatabaseBulkUpdater (see add_things).  Without one they
+    go through a ThingUpsertSink, which leaves working out which things are new to the database.  Either way they're
+    committed write_batch_size at a time, and the number written is returned.
+    """
+    if primary_keys_by_id is None:
+        sink = ThingUpsertSink(isb_db_session, SESARItem.AUTHORITY_ID, SESARItem.MEDIA_TYPE, write_batch_size)
+        for current_record, thing_id, resolved_url, h3, t_created in things:
+            sink.add_thing(current_record, thing_id, resolved_url, 200, h3, t_created)
+        sink.finish()
+        return sink.num_written
+    bulk_updater = DatabaseBulkUpdater(
+        isb_db_session,
+        SESARItem.AUTHORITY_ID,
+        write_batch_size,
+        SESARItem.MEDIA_TYPE,
+        primary_keys_by_id
+    )
+    return add_things(isb_db_session, bulk_updater, primary_keys_by_id, things)
+
+
+def write_changed_things(isb_db_session, content_hashes, things, primary_keys_by_id=None, write_batch_size=BATCH_SIZE):
+    """Like write_things, but skipping the things whose record hashes the same as the last one written for them.
+
+    The hashes of the things written are saved to content_hashes once they're committed, so a crash in between only
+    means they're written again next time.  Returns (number written, number skipped as unchanged).
+    """
+    things = list(things)
+    hashes_by_id = {thing_id: record_content_hash(current_record) for current_record, thing_id, _, _, _ in things}
+    stored_hashes_by_id = content_hashes.get(list(hashes_by_id.keys()))
+    changed_things = [thing for thing in things if stored_hashes_by_id.get(thing[1]) != hashes_by_id[thing[1]]]
+    num_written = write_things(isb_db_session, changed_things, primary_keys_by_id, write_batch_size)
+    content_hashes.save({thing[1]: hashes_by_id[thing[1]] for thing in changed_things})
+    return num_written, len(things) - len(changed_things)
+
+
+def write_batch(isb_db_session, things, primary_keys_by_id, write_batch_size, content_hashes=None, attempt=0):
+    """Write one batch of things with write_things, or write_changed_things if there are content_hashes.
+
+    Returns (number written, number skipped as unchanged).  It's safe to call again for the same batch after a
+    failure: on a retry (attempt > 0) the primary keys of any of the batch's things that did get committed are read
+    back first, so they're updated rather than inserted twice.
+    """
+    if attempt > 0 and primary_keys_by_id is not None:
+        primary_keys_by_id.update(thing_primary_keys(isb_db_session, [thing[1] for thing in things]))
+    if content_hashes is not None:
+        return write_changed_things(isb_db_session, content_hashes, things, primary_keys_by_id, write_batch_size)
+    return write_things(isb_db_session, things, primary_keys_by_id, write_batch_size), 0
+
+
+def new_checkpoint(start_from, params):
+    """The checkpoint a load starts out with, before it's committed any batches"""
+    return {
+        "run_id": uuid.uuid4().hex,
+        "started": datetime.datetime.now().isoformat(),
+        "start_from": start_from.isoformat() if start_from is not None else None,
+        "params": params,
+        "last_sample_id": None,
+        "num_newer": 0,
+        "num_written": 0,
+        "num_skipped": 0,
+        "completed": False
+    }
+
+
+def start_checkpoint(checkpoint_state, start_from, resume, params):
+    """The checkpoint a load carries on from.
+
+    With resume=True that's the unfinished run checkpoint_state records, so long as it was started with the same
+    params; if they differ a ValueError is raised rather than switching settings partway through a run.  Otherwise,
+    or if there's no unfinished run, it's a new one for start_from and params, which is recorded straight away.
+    """
+    checkpoint = checkpoint_state.checkpoint()
+    if resume and checkpoint is not None and not checkpoint["completed"]:
+        recorded_params = checkpoint["params"]
+        changed = sorted(
+            key for key in set(params) | set(recorded_params) if recorded_params.get(key) != params.get(key)
+        )
+        if changed:
+            raise ValueError(
+                f"Run {checkpoint['run_id']} was started with different {', '.join(changed)}, so it can't be resumed "
+                "with these options"
+            )
+        logging.info("Resuming run %s after sample_id %s", checkpoint["run_id"], checkpoint["last_sample_id"])
+        return checkpoint
+    if resume and checkpoint is not None:
+        logging.info("Run %s already completed, starting a new one", checkpoint["run_id"])
+    checkpoint = new_checkpoint(start_from, params)
+    checkpoint_state.set_checkpoint(checkpoint)
+    logging.info("Starting run %s", checkpoint["run_id"])
+    return checkpoint
+
+
+def sample_batches(
+    sesar_db_session,
+    start_from=None,
+    load_state=None,
+    stream=False,
+    after_sample_id=None,
+    batch_size=BATCH_SIZE,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    """The batches of samples a load works through.
+
+    They're paged past the LoadState's watermark if there is one, pulled off a server-side cursor with stream=True,
+    and otherwise keyset paged past after_sample_id.
+    """
+    if load_state is not None:
+        watermark = load_state.watermark()
+        if watermark is None:
+            watermark = (start_from or datetime.datetime.min, -1)
+        logging.info("Resuming from watermark %s", watermark)
+        return watermark_sample_batches(sesar_db_session, watermark, batch_size, max_retries, retry_backoff_seconds)
+    if stream:
+        return iter_samples(sesar_db_session, start_from, batch_size, transform_ready=True, lookup_cached=True)
+    return keyset_sample_batches(
+        sesar_db_session,
+        start_from,
+        batch_size,
+        after_sample_id,
+        max_retries=max_retries,
+        retry_backoff_seconds=retry_backoff_seconds
+    )
+
+
+def transform_batch(samples, lookup_cache, columnar=False, transform_threads=1):
+    """(sample, record, h3) for each of a batch of samples.
+
+    With columnar=True the batch is transformed column-wise by a ColumnarTransformer, and otherwise by iter_transform
+    on transform_threads threads.  Either way, columnar or more than one thread needs SampleRows.
+    """
+    if columnar:
+        columnar_transformer = ColumnarTransformer.from_sample_rows(samples)
+        return zip(samples, columnar_transformer.transform(), columnar_transformer.h3_column())
+    return Transformer.iter_transform(samples, lookup_cache, transform_threads, len(samples))
+
+
+def write_loaded_batch(
+    isb_db_session,
+    things,
+    thing_ids_by_sample_id,
+    primary_keys_by_id,
+    write_batch_size,
+    content_hashes,
+    sample_things,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    """Write a batch of things with write_batch, then record which samples they came from in sample_things.
+
+    Only samples that are new to sample_things, or now map to a different thing, are written there.  Each step is
+    retried on transient database errors.  Returns (number written, number skipped as unchanged).
+    """
+    counts = retry_transient_errors(
+        lambda attempt: write_batch(
+            isb_db_session, things, primary_keys_by_id, write_batch_size, content_hashes, attempt
+        ),
+        [isb_db_session],
+        max_retries,
+        retry_backoff_seconds
+    )
+    retry_transient_errors(
+        lambda attempt: sample_things.save_changed(thing_ids_by_sample_id),
+        [isb_db_session],
+        max_retries,
+        retry_backoff_seconds
+    )
+    return counts
+
+
+def write_transformed(
+    isb_db_session,
+    transformed,
+    group_size,
+    primary_keys_by_id,
+    write_batch_size,
+    content_hashes,
+    sample_things,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    """Write (sample, record, h3) triples with write_loaded_batch group_size at a time, as they're produced.
+
+    transformed is consumed lazily, so when it's being filled by a pool the first groups are written while the pool
+    transforms the rest.  Returns (number transformed, number written, number skipped as unchanged).
+    """
+    num_newer = 0
+    num_written = 0
+    num_skipped = 0
+    iterator = iter(transformed)
+    while True:
+        group = list(itertools.islice(iterator, group_size))
+        if len(group) == 0:
+            return num_newer, num_written, num_skipped
+        things = [
+            (current_record, f"igsn:{sample.igsn}", f"doi.org/{sample.igsn}", h3, sample.registration_date)
+            for sample, current_record, h3 in group
+        ]
+        group_written, group_skipped = write_loaded_batch(
             isb_db_session,
-            SESARItem.AUTHORITY_ID,
-            BATCH_SIZE,
-            SESARItem.MEDIA_TYPE,
-            primary_keys_by_id
+            things,
+            {sample.sample_id: f"igsn:{sample.igsn}" for sample, _, _ in group},
+            primary_keys_by_id,
+            write_batch_size,
+            content_hashes,
+            sample_things,
+            max_retries,
+            retry_backoff_seconds
         )
+        num_newer += len(things)
+        num_written += group_written
+        num_skipped += group_skipped
 
-        samples = get_sample_rows(sesar_db_session, offset, BATCH_SIZE, start_from)
-        if (len(samples) == 0):
-            more_samples = False
+
+def release_batch(sesar_db_session, isb_db_session, num_samples, max_rss_mb=None):
+    """Let go of everything loaded for a batch that's been written, and log the RSS.
+
+    Raises a MemoryError if max_rss_mb is specified and the RSS is still over it.
+    """
+    # the lookup cache lives outside the sessions, so it survives
+    expunge_everything(sesar_db_session)
+    isb_db_session.expunge_all()
+    batch_rss_mb = current_rss_mb()
+    logging.info("Loaded batch of %d samples, RSS %.1f MB (peak %.1f MB)", num_samples, batch_rss_mb, peak_rss_mb())
+    if max_rss_mb is not None and batch_rss_mb > max_rss_mb:
+        raise MemoryError(f"RSS {batch_rss_mb:.1f} MB exceeded the {max_rss_mb} MB ceiling")
+
+
+def load_sesar_entries(
+    sesar_db_session,
+    isb_db_session,
+    start_from=None,
+    stream=False,
+    load_state=None,
+    max_rss_mb=None,
+    transform_threads=1,
+    columnar=False,
+    transform_workers=1,
+    chunk_size=Transformer.TRANSFORM_BATCH_SIZE,
+    id_index_file=None,
+    upsert=False,
+    read_batch_size=BATCH_SIZE,
+    write_batch_size=BATCH_SIZE,
+    skip_unchanged=False,
+    checkpoint_state=None,
+    resume=False,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    """Transform SESAR samples and write them to the iSB database as things.
+
+    By default samples are fetched as compact SampleRows with keyset paging; with stream=True full Sample objects are
+    pulled off a server-side cursor via iter_samples instead.
+
+    If a LoadState is passed, samples are paged in (last_update_date, sample_id) order instead, resuming just past
+    the watermark it holds (or from start_from if it doesn't have one yet), and the watermark is advanced after
+    every batch that's been committed to iSB.
+
+    Everything loaded for a batch is released from both sessions once the batch is written, so memory stays flat
+    from the first batch to the last, and the current and peak RSS are logged per batch.  If max_rss_mb is specified
+    and the current RSS goes over it, the load stops with a MemoryError at the end of that batch rather than being
+    killed mid-write.
+
+    With transform_threads > 1 each batch is transformed on a pool of that many threads.  That's only done for the
+    SampleRow paths: full Sample objects may still lazy load through the session, which threads can't share.
+    Likewise columnar=True, which transforms each batch of SampleRows column-wise with a ColumnarTransformer, and
+    transform_workers > 1, which starts a pool of that many processes for the run and hands each batch to it
+    chunk_size SampleRows at a time.  The records come back in order, and each chunk is written to iSB as soon as it
+    arrives, so the writes overlap the pool transforming the next chunks.  The watermark and checkpoint still only
+    move once the whole batch is written.
+
+    The map of existing thing primary keys is read from iSB once per run, as a compact ThingIdIndex, and then kept
+    up to date with the things each batch inserts, rather than re-read in full for every batch.  If id_index_file is
+    specified the index is warm started from the snapshot there (see load_thing_id_index), and saved back to it at
+    the end of the run.  With upsert=True there's no map at all: each batch is written with multi-row INSERT ... ON
+    CONFLICT DO UPDATE statements by a ThingUpsertSink.
+
+    Samples are read from SESAR read_batch_size at a time, and things committed to iSB write_batch_size at a time.
+
+    With skip_unchanged=True a hash of each record is kept in iSB (see ContentHashStore), and things whose record
+    hashes the same as the last one written are skipped, so samples touched without a real change cost no writes.
+
+    If a LoadState is passed as checkpoint_state, a checkpoint of the run (its id, parameters, counts and the last
+    sample_id committed) is written to it after every batch.  With resume=True an unfinished run recorded there is
+    picked up just past its last sample_id, with its start_from and counts, rather than started over, provided the
+    parameters it was started with match (see start_checkpoint).  If the run recorded there completed, a new one is
+    started from start_from.  Checkpoints need the default keyset paging, so they can't be combined with load_state or
+    stream.
+
+    A read or write that hits a transient database error is retried up to max_retries times, after waiting
+    retry_backoff_seconds and then twice as long each time (see retry_transient_errors).  Only the failed batch is
+    retried, so the batches already committed stay committed.
+    """
+    if checkpoint_state is not None and (load_state is not None or stream):
+        raise ValueError("Checkpoints can't be combined with a watermark LoadState or streaming")
+    counts = {"num_newer": 0, "num_written": 0, "num_skipped": 0}
+    after_sample_id = None
+    checkpoint = None
+    if checkpoint_state is not None:
+        checkpoint = start_checkpoint(checkpoint_state, start_from, resume, {
+            "read_batch_size": read_batch_size,
+            "write_batch_size": write_batch_size,
+            "upsert": upsert,
+            "skip_unchanged": skip_unchanged,
+            "columnar": columnar,
+            "transform_threads": transform_threads,
+            "transform_workers": transform_workers
+        })
+        # a new checkpoint holds start_from, no sample_id and zero counts, so this suits new and resumed runs alike
+        after_sample_id = checkpoint["last_sample_id"]
+        start_from = datetime.datetime.fromisoformat(checkpoint["start_from"]) if checkpoint["start_from"] else None
+        counts = {key: checkpoint[key] for key in counts}
+    content_hashes = ContentHashStore(isb_db_session) if skip_unchanged else None
+    sample_things = SampleThingStore(isb_db_session)
+    lookup_cache = shared_lookup_cache(sesar_db_session)
+    batches = sample_batches(
+        sesar_db_session, start_from, load_state, stream, after_sample_id, read_batch_size, max_retries,
+        retry_backoff_seconds
+    )
+    primary_keys_by_id = load_thing_id_index(isb_db_session, id_index_file) if not upsert else None
+    use_pool = transform_workers > 1 and not stream
+    with transform_pool(transform_workers) if use_pool else contextlib.nullcontext() as pool:
+        for samples in batches:
+            if pool is not None:
+                transformed = transform_in_processes(pool, samples, chunk_size)
+            else:
+                # full Sample objects may still lazy load through the session, so they're only transformed here
+                threads = transform_threads if not stream else 1
+                transformed = transform_batch(samples, lookup_cache, columnar and not stream, threads)
+            batch_newer, batch_written, batch_skipped = write_transformed(
+                isb_db_session,
+                transformed,
+                chunk_size if pool is not None else len(samples),
+                primary_keys_by_id,
+                write_batch_size,
+                content_hashes,
+                sample_things,
+                max_retries,
+                retry_backoff_seconds
+            )
+            counts["num_newer"] += batch_newer
+            counts["num_written"] += batch_written
+            counts["num_skipped"] += batch_skipped
+            if load_state is not None:
+                load_state.set_watermark((samples[-1].last_update_date, samples[-1].sample_id))
+            if checkpoint is not None:
+                checkpoint.update(
+                    counts, last_sample_id=samples[-1].sample_id, updated=datetime.datetime.now().isoformat()
+                )
+                checkpoint_state.set_checkpoint(checkpoint)
+            release_batch(sesar_db_session, isb_db_session, len(samples), max_rss_mb)
+    save_thing_id_index(primary_keys_by_id, id_index_file)
+    if checkpoint is not None:
+        checkpoint["completed"] = True
+        checkpoint_state.set_checkpoint(checkpoint)
+    logging.info("H3 cell cache: %s", shared_h3_cell_cache().stats())
+    for meta_mapper in [ContextCategoryMetaMapper, MaterialCategoryMetaMapper, SpecimenCategoryMetaMapper]:
+        logging.info("%s cache: %s", meta_mapper.__name__, meta_mapper.cache_stats())
+    print("Num newer={num_newer}, written={num_written}, skipped unchanged={num_skipped}\n\n".format(**counts))
+
+
+# Per-process state for parallel load workers, set up once by _init_load_worker
+_worker_sesar_session = None
+_worker_start_from = None
+_worker_read_batch_size = BATCH_SIZE
+_worker_max_retries = 0
+_worker_retry_backoff_seconds = RETRY_BACKOFF_SECONDS
+
+
+def _init_load_worker(
+    sesar_db_url,
+    start_from,
+    h3_cache_size,
+    read_batch_size=BATCH_SIZE,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    global _worker_sesar_session, _worker_start_from, _worker_read_batch_size
+    global _worker_max_retries, _worker_retry_backoff_seconds
+    # each worker gets its own engine -- connections can't be shared across processes
+    _worker_sesar_session = SESAR_SQLModelDAO(sesar_db_url).get_session()
+    _worker_start_from = start_from
+    _worker_read_batch_size = read_batch_size
+    _worker_max_retries = max_retries
+    _worker_retry_backoff_seconds = retry_backoff_seconds
+    shared_h3_cell_cache().resize(h3_cache_size)
+
+
+def _transform_sample_id_range(sample_id_range):
+    """Fetch and transform one (first, last) sample_id range, where either end may be None for open-ended.
+
+    Returns the arguments for add_thing, along with the thing ids keyed by sample_id for the SampleThingStore.
+    """
+    first_sample_id, last_sample_id = sample_id_range
+    after_sample_id = first_sample_id - 1 if first_sample_id is not None else None
+    lookup_cache = shared_lookup_cache(_worker_sesar_session)
+    transformed = []
+    thing_ids_by_sample_id = {}
+    for samples in keyset_sample_batches(
+        _worker_sesar_session,
+        _worker_start_from,
+        _worker_read_batch_size,
+        after_sample_id,
+        last_sample_id,
+        _worker_max_retries,
+        _worker_retry_backoff_seconds
+    ):
+        for sample, current_record, h3 in Transformer.iter_transform(samples, lookup_cache, batch_size=len(samples)):
+            transformed.append((
+                current_record,
+                f"igsn:{sample.igsn}",
+                f"doi.org/{sample.igsn}",
+                h3,
+                sample.registration_date
+            ))
+            thing_ids_by_sample_id[sample.sample_id] = f"igsn:{sample.igsn}"
+    return transformed, thing_ids_by_sample_id
+
+
+def load_sesar_entries_parallel(
+    sesar_db_url,
+    isb_db_session,
+    start_from=None,
+    workers=2,
+    id_index_file=None,
+    upsert=False,
+    read_batch_size=BATCH_SIZE,
+    write_batch_size=BATCH_SIZE,
+    skip_unchanged=False,
+    max_retries=0,
+    retry_backoff_seconds=RETRY_BACKOFF_SECONDS
+):
+    """Like load_sesar_entries, but with extraction and transformation split across worker processes.
+
+    The sample_id key space is cut into balanced ranges of about read_batch_size rows each.  Every worker has its own SESAR
+    engine and fetches and transforms whole ranges, while this process funnels the results into the iSB writer.
+    Reads in the workers and writes here are both retried on transient database errors, as load_sesar_entries does.
+    """
+    num_newer = 0
+    num_written = 0
+    num_skipped = 0
+    content_hashes = ContentHashStore(isb_db_session) if skip_unchanged else None
+    sample_things = SampleThingStore(isb_db_session)
+    with SESAR_SQLModelDAO(sesar_db_url).get_session() as sesar_db_session:
+        num_samples = count_sample_rows(sesar_db_session, start_from)
+        num_ranges = max(workers, math.ceil(num_samples / read_batch_size))
+        sample_id_ranges = get_sample_id_ranges(sesar_db_session, num_ranges, start_from)
+    logging.info("Loading %d samples in %d ranges across %d workers", num_samples, len(sample_id_ranges), workers)
+    h3_cache_size = shared_h3_cell_cache().max_size
+    primary_keys_by_id = load_thing_id_index(isb_db_session, id_index_file) if not upsert else None
+    worker_args = (sesar_db_url, start_from, h3_cache_size, read_batch_size, max_retries, retry_backoff_seconds)
+    with multiprocessing.Pool(workers, _init_load_worker, worker_args) as pool:
+        for transformed, thing_ids_by_sample_id in pool.imap_unordered(_transform_sample_id_range, sample_id_ranges):
+            batch_written, batch_skipped = write_loaded_batch(
+                isb_db_session,
+                transformed,
+                thing_ids_by_sample_id,
+                primary_keys_by_id,
+                write_batch_size,
+                content_hashes,
+                sample_things,
+                max_retries,
+                retry_backoff_seconds
+            )
+            num_newer += len(transformed)
+            num_written += batch_written
+            num_skipped += batch_skipped
+    save_thing_id_index(primary_keys_by_id, id_index_file)
+    print(f"Num newer={num_newer}, written={num_written}, skipped unchanged={num_skipped}\n\n")
+
+
+def export_sesar_entries(sesar_db_session, output, start_from=None, fields=None):
+    """Stream SESAR samples off a server-side cursor and write them to output as iSamples JSON lines.
+
+    If fields is given, only those fields of each record are transformed and written (see Transformer.transform).
+    """
+    num_exported = 0
+    lookup_cache = shared_lookup_cache(sesar_db_session)
+    for samples in iter_samples(sesar_db_session, start_from, BATCH_SIZE, transform_ready=True, lookup_cached=True):
+        for _, current_record, _ in Transformer.iter_transform(samples, lookup_cache, fields=fields):
+            output.write(json.dumps(current_record, default=str))
+            output.write("\n")
+            num_exported += 1
+    return num_exported
+
+
+def removed_thing_ids(sesar_db_session, isb_db_session, since, until=None):
+    """The ids of the things for samples archived or deleted in SESAR between since and until.
+
+    Samples whose rows SESAR no longer has are looked up in the SampleThingStore the loaders keep instead.
+    """
+    thing_ids = {}
+    missing_sample_ids = []
+    for sample_id, igsn in get_removed_samples(sesar_db_session, since, until):
+        if igsn is not None:
+            thing_ids[f"igsn:{igsn}"] = None
         else:
-            for sample in samples:
-                current_record = Transformer(sample).transform()
-                num_newer += 1
-                thing_id = f"igsn:{sample.igsn}"
-                resolved_url = f"doi.org/{sample.igsn}"
-                h3 = geo_to_h3(sample.latitude, sample.longitude)
-                t_created = sample.registration_date
-                bulk_updater.add_thing(current_record, thing_id, resolved_url, 200, h3, t_created)
-            offset += BATCH_SIZE
-            bulk_updater.finish()
-    print(f"Num newer={num_newer}\n\n")
+            missing_sample_ids.append(sample_id)
+    loaded_thing_ids = SampleThingStore(isb_db_session).get(missing_sample_ids)
+    if len(loaded_thing_ids) < len(missing_sample_ids):
+        logging.warning(
+            "%d deleted samples were never loaded, so have no things to remove",
+            len(missing_sample_ids) - len(loaded_thing_ids)
+        )
+    thing_ids.update(dict.fromkeys(loaded_thing_ids.values()))
+    return list(thing_ids)
+
+
+def propagate_removed_samples(sesar_db_session, isb_db_session, since, delete_things=False, until=None):
+    """Tombstone (or, with delete_things, remove) the things for samples archived or deleted in SESAR between since
+    and until, which defaults to now.
+
+    Only the changed samples are read from SESAR, and the matching things are updated with one set-based statement
+    per BATCH_SIZE ids, so the pass costs in proportion to the number of removals.
+    """
+    thing_ids = removed_thing_ids(sesar_db_session, isb_db_session, since, until)
+    for index in range(0, len(thing_ids), BATCH_SIZE):
+        batch_ids = thing_ids[index:index + BATCH_SIZE]
+        if delete_things:
+            statement = delete(Thing).where(Thing.id.in_(batch_ids))
+        else:
+            statement = (
+                update(Thing)
+                .where(Thing.id.in_(batch_ids))
+                .values(resolved_status=TOMBSTONE_STATUS, tstamp=datetime.datetime.now())
+            )
+        isb_db_session.exec(statement)
+        isb_db_session.commit()
+    # so a sample that comes back gets its thing rewritten, even if its record is unchanged
+    ContentHashStore(isb_db_session).delete(thing_ids)
+    return len(thing_ids)
+
+
+def read_igsns(lines):
+    """Yield the IGSNs from an iterable of lines, one per line, tolerating blank lines and an igsn: prefix"""
+    for line in lines:
+        igsn = line.strip()
+        if igsn.startswith("igsn:"):
+            igsn = igsn[len("igsn:"):]
+        if igsn:
+            yield igsn
+
+
+def transform_igsns(sesar_db_session, igsns, output, fields=None):
+    """Look up the given IGSNs in bulk and write the transformed records (or just the given fields) to output"""
+    num_transformed = 0
+    lookup_cache = shared_lookup_cache(sesar_db_session)
+    samples = get_samples_with_igsns(sesar_db_session, igsns)
+    for _, current_record, _ in Transformer.iter_transform(samples, lookup_cache, fields=fields):
+        output.write(json.dumps(current_record, default=str))
+        output.write("\n")
+        num_transformed += 1
+    return num_transformed
+
+
+def parse_fields(ctx, param, value):
+    """click callback turning a comma separated --fields value into a validated tuple of record fields"""
+    if value is None:
+        return None
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    try:
+        compile_transform_plan(Transformer.RECORD_SPEC, fields)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return fields
+
 
 def ingest_precalculated_vocab(isb_db_session, json_file):
     count = 0
@@ -108,6 +859,61 @@ def main(ctx, sesar_db_url, isb_db_url, solr_url, verbosity):
     ctx.obj["isb_db_url"] = isb_db_url
 
 
+def check_load_options(
+    stream,
+    workers,
+    state_file,
+    max_rss_mb,
+    prewarm_categories,
+    transform_threads,
+    columnar,
+    transform_workers,
+    chunk_size,
+    id_index_file,
+    upsert,
+    read_batch_size,
+    write_batch_size,
+    checkpoint_file,
+    resume,
+    max_retries
+):
+    """Raise a click.UsageError for the first of the load command's options that can't be used as given"""
+    parallel = stream or workers > 1
+    problems = [
+        (state_file is not None and parallel, "--state_file can't be combined with --stream or --workers"),
+        (transform_threads > 1 and parallel, "--transform_threads can't be combined with --stream or --workers"),
+        (
+            columnar and (parallel or transform_threads > 1),
+            "--columnar can't be combined with --stream, --workers or --transform_threads"
+        ),
+        (
+            transform_workers > 1 and (parallel or transform_threads > 1 or columnar),
+            "--transform_workers can't be combined with --stream, --workers, --transform_threads or --columnar"
+        ),
+        (
+            chunk_size < 1 or read_batch_size < 1 or write_batch_size < 1,
+            "--chunk_size, --read_batch_size and --write_batch_size must be at least 1"
+        ),
+        (resume and checkpoint_file is None, "--resume needs a --checkpoint_file to resume from"),
+        (
+            checkpoint_file is not None and (state_file is not None or parallel),
+            "--checkpoint_file can't be combined with --state_file, --stream or --workers"
+        ),
+        (
+            workers > 1 and (prewarm_categories or max_rss_mb is not None),
+            "--prewarm_categories and --max_rss_mb can't be combined with --workers"
+        ),
+        (max_retries < 0, "--max_retries can't be negative"),
+        (
+            upsert and id_index_file is not None,
+            "--upsert doesn't use an id index, so it can't be combined with --id_index_file"
+        ),
+    ]
+    for problem, message in problems:
+        if problem:
+            raise click.UsageError(message)
+
+
 @main.command("load")
 @click.option(
     "-m",
@@ -124,16 +930,315 @@ def main(ctx, sesar_db_url, isb_db_url, solr_url, verbosity):
     help="""The modified date to use when considering delta updates.  Records with a last modified before this date
     will be ignored"""
 )
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    help="Stream samples off a server-side cursor instead of paging through them"
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of worker processes to split extraction and transformation across"
+)
+@click.option(
+    "--state_file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="""File to record the (last_update_date, sample_id) high-water mark in.  If it already holds one, the load
+    resumes just past it and --modification_date is ignored"""
+)
+@click.option(
+    "--max_rss_mb",
+    type=int,
+    default=None,
+    help="Stop the load at the end of the first batch that leaves RSS over this many megabytes"
+)
+@click.option(
+    "--h3_cache_size",
+    type=int,
+    default=H3CellCache.DEFAULT_MAX_SIZE,
+    help="Number of distinct sample locations to keep H3 cells cached for, 0 to disable the cache"
+)
+@click.option(
+    "--prewarm_categories/--no-prewarm_categories",
+    default=False,
+    help="Compute the categories for every distinct classification, location type and sample type up front"
+)
+@click.option(
+    "--transform_threads",
+    type=int,
+    default=1,
+    help="Number of threads to transform each batch on"
+)
+@click.option(
+    "--columnar/--no-columnar",
+    default=False,
+    help="Transform each batch column-wise rather than sample by sample"
+)
+@click.option(
+    "--transform_workers",
+    type=int,
+    default=1,
+    help="Number of worker processes to transform each batch across, while this process writes to iSB"
+)
+@click.option(
+    "--chunk_size",
+    type=int,
+    default=Transformer.TRANSFORM_BATCH_SIZE,
+    show_default=True,
+    help="Number of samples handed to a transform worker at a time"
+)
+@click.option(
+    "--id_index_file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="""File to snapshot the index of existing thing ids in at the end of the load.  If it already holds one,
+    the index is warm started from it instead of scanning every thing in iSB"""
+)
+@click.option(
+    "--upsert/--no-upsert",
+    default=False,
+    help="Write things with multi-row INSERT ... ON CONFLICT DO UPDATE statements instead of DatabaseBulkUpdater"
+)
+@click.option(
+    "--read_batch_size",
+    type=int,
+    default=BATCH_SIZE,
+    show_default=True,
+    help="Number of samples to read from SESAR at a time"
+)
+@click.option(
+    "--write_batch_size",
+    type=int,
+    default=BATCH_SIZE,
+    show_default=True,
+    help="Number of things to write to iSB per commit"
+)
+@click.option(
+    "--skip_unchanged/--no-skip_unchanged",
+    default=False,
+    help="Keep a hash of each record written, and skip rewriting things whose record hashes the same"
+)
+@click.option(
+    "--checkpoint_file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to record a checkpoint of the run in after every batch committed to iSB"
+)
+@click.option(
+    "--resume/--no-resume",
+    default=False,
+    help="""Pick up the unfinished run recorded in --checkpoint_file just past its last committed batch, with its
+    --modification_date, instead of starting over.  The run's batch, write and transform options must match.  If it
+    completed, a new run is started"""
+)
+@click.option(
+    "--max_retries",
+    type=int,
+    default=3,
+    show_default=True,
+    help="Number of times to retry a batch that hits a transient database error"
+)
+@click.option(
+    "--retry_backoff",
+    type=float,
+    default=RETRY_BACKOFF_SECONDS,
+    show_default=True,
+    help="Seconds to wait before retrying a failed batch, doubled for each retry after the first"
+)
 @click_config_file.configuration_option(config_file_name="sesar.cfg")
 @click.pass_context
-def load_records(ctx, max_records, modification_date):
+def load_records(
+    ctx,
+    max_records,
+    modification_date,
+    stream,
+    workers,
+    state_file,
+    max_rss_mb,
+    h3_cache_size,
+    prewarm_categories,
+    transform_threads,
+    columnar,
+    transform_workers,
+    chunk_size,
+    id_index_file,
+    upsert,
+    read_batch_size,
+    write_batch_size,
+    skip_unchanged,
+    checkpoint_file,
+    resume,
+    max_retries,
+    retry_backoff
+):
+    check_load_options(
+        stream=stream,
+        workers=workers,
+        state_file=state_file,
+        max_rss_mb=max_rss_mb,
+        prewarm_categories=prewarm_categories,
+        transform_threads=transform_threads,
+        columnar=columnar,
+        transform_workers=transform_workers,
+        chunk_size=chunk_size,
+        id_index_file=id_index_file,
+        upsert=upsert,
+        read_batch_size=read_batch_size,
+        write_batch_size=write_batch_size,
+        checkpoint_file=checkpoint_file,
+        resume=resume,
+        max_retries=max_retries
+    )
+    shared_h3_cell_cache().resize(h3_cache_size)
     click.echo(modification_date)
-    sesar_session = SESAR_SQLModelDAO(ctx.obj["sesar_db_url"]).get_session()
     isb_session = iSB_SQLModelDAO(ctx.obj["isb_db_url"]).get_session()
     logging.info("loadRecords: %s", str(isb_session))
-    load_sesar_entries(sesar_session, isb_session, modification_date)
+    if workers > 1:
+        load_sesar_entries_parallel(
+            ctx.obj["sesar_db_url"],
+            isb_session,
+            modification_date,
+            workers,
+            id_index_file,
+            upsert,
+            read_batch_size,
+            write_batch_size,
+            skip_unchanged,
+            max_retries,
+            retry_backoff
+        )
+    else:
+        sesar_session = SESAR_SQLModelDAO(ctx.obj["sesar_db_url"]).get_session()
+        if prewarm_categories:
+            num_inputs = prewarm_category_caches(sesar_session, shared_lookup_cache(sesar_session))
+            logging.info("Prewarmed category caches from %d distinct inputs", num_inputs)
+        load_state = LoadState(state_file) if state_file is not None else None
+        checkpoint_state = LoadState(checkpoint_file) if checkpoint_file is not None else None
+        load_sesar_entries(
+            sesar_session,
+            isb_session,
+            modification_date,
+            stream,
+            load_state,
+            max_rss_mb,
+            transform_threads,
+            columnar,
+            transform_workers,
+            chunk_size,
+            id_index_file,
+            upsert,
+            read_batch_size,
+            write_batch_size,
+            skip_unchanged,
+            checkpoint_state,
+            resume,
+            max_retries,
+            retry_backoff
+        )
+        sesar_session.close()
+    isb_session.close()
+
+
+@main.command("remove")
+@click.option(
+    "-d",
+    "--since",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=(datetime.datetime.now()-datetime.timedelta(days=1)).date().strftime("%Y-%m-%d"),
+    help="Propagate samples archived or deleted on or after this date, unless --state_file records a later pass"
+)
+@click.option(
+    "--state_file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to record when the last removal pass ran, so the next one picks up exactly where it left off"
+)
+@click.option(
+    "--delete/--tombstone",
+    default=False,
+    help="Delete the matching things outright instead of marking them with a tombstone resolved_status"
+)
+@click_config_file.configuration_option(config_file_name="sesar.cfg")
+@click.pass_context
+def remove_records(ctx, since, state_file, delete):
+    load_state = LoadState(state_file) if state_file is not None else None
+    if load_state is not None and load_state.get(REMOVALS_SINCE_KEY) is not None:
+        since = datetime.datetime.fromisoformat(load_state.get(REMOVALS_SINCE_KEY))
+    # note the start time before querying, so anything removed while this pass runs is caught by the next one
+    pass_started = datetime.datetime.now()
+    sesar_session = SESAR_SQLModelDAO(ctx.obj["sesar_db_url"]).get_session()
+    isb_session = iSB_SQLModelDAO(ctx.obj["isb_db_url"]).get_session()
+    num_removed = propagate_removed_samples(sesar_session, isb_session, since, delete, pass_started)
+    if load_state is not None:
+        load_state.set(REMOVALS_SINCE_KEY, pass_started.isoformat())
     sesar_session.close()
     isb_session.close()
+    logging.info("Propagated %d removed samples since %s", num_removed, since)
+
+
+@main.command("export")
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write the transformed records to as JSON lines, defaults to stdout"
+)
+@click.option(
+    "-d",
+    "--modification_date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help="If specified, only export records modified on or after this date"
+)
+@click.option(
+    "--fields",
+    default=None,
+    callback=parse_fields,
+    help="""Comma separated fields to include in each record, as top level keys or dotted paths such as
+    producedBy.samplingSite.location; defaults to the whole record"""
+)
+@click_config_file.configuration_option(config_file_name="sesar.cfg")
+@click.pass_context
+def export_records(ctx, output, modification_date, fields):
+    sesar_session = SESAR_SQLModelDAO(ctx.obj["sesar_db_url"]).get_session()
+    num_exported = export_sesar_entries(sesar_session, output, modification_date, fields)
+    sesar_session.close()
+    logging.info("Exported %d records", num_exported)
+
+
+@main.command("transform")
+@click.option(
+    "-f",
+    "--igsn_file",
+    type=click.File("r"),
+    default="-",
+    help="File of IGSNs to transform, one per line, defaults to stdin"
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write the transformed records to as JSON lines, defaults to stdout"
+)
+@click.option(
+    "--fields",
+    default=None,
+    callback=parse_fields,
+    help="""Comma separated fields to include in each record, as top level keys or dotted paths such as
+    producedBy.samplingSite.location; defaults to the whole record"""
+)
+@click_config_file.configuration_option(config_file_name="sesar.cfg")
+@click.pass_context
+def transform_records(ctx, igsn_file, output, fields):
+    sesar_session = SESAR_SQLModelDAO(ctx.obj["sesar_db_url"]).get_session()
+    num_transformed = transform_igsns(sesar_session, read_igsns(igsn_file), output, fields)
+    sesar_session.close()
+    logging.info("Transformed %d records", num_transformed)
 
 
 @main.command("populate_isb_core_solr")
@@ -0,0 +1,81 @@
+import gc
+
+import numpy as np
+from sqlmodel import Session
+
+from isamples_sesar.columnar_transformer import ColumnarTransformer
+from isamples_sesar.sample_row import SampleRow
+from isamples_sesar.sesar_transformer import Transformer, geo_to_h3
+from isamples_sesar.sqlmodel_database import get_sample_rows_projected
+
+
+class _Table:
+    """Stands in for an Arrow table, which is only read through to_pydict()"""
+
+    def __init__(self, columns: dict):
+        self._columns = columns
+
+    def to_pydict(self) -> dict:
+        return self._columns
+
+
+def test_columnar_transform_matches_transform(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    assert len(sample_rows) == 8
+    columnar_transformer = ColumnarTransformer.from_sample_rows(sample_rows)
+    assert columnar_transformer.transform() == [Transformer(sample_row).transform() for sample_row in sample_rows]
+    assert columnar_transformer.h3_column() == [
+        geo_to_h3(sample_row.latitude, sample_row.longitude) for sample_row in sample_rows
+    ]
+
+
+def test_columnar_transform_from_columns(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    columns = {field: [getattr(sample_row, field) for sample_row in sample_rows] for field in SampleRow._fields}
+    # missing coordinates arrive as NaN in float arrays
+    latitudes = np.array([np.nan] + columns["latitude"][1:], dtype=np.float64)
+    longitudes = np.array(columns["longitude"], dtype=np.float64)
+    expected_rows = [sample_rows[0]._replace(latitude=None)] + sample_rows[1:]
+    records = ColumnarTransformer.from_arrow(
+        _Table({**columns, "latitude": latitudes, "longitude": longitudes})
+    ).transform()
+    assert records == [Transformer(sample_row).transform() for sample_row in expected_rows]
+    assert records[0]["producedBy_samplingSite_location_h3_0"] is None
+
+
+def test_columnar_transform_elevations_and_empty():
+    sample_row = SampleRow(*([None] * len(SampleRow._fields)))._replace(
+        sample_id=1, igsn="10.58052/TEST00001", name="test", sample_type_id=1, elevation=100.0,
+        elevation_unit=" Feet "
+    )
+    rows = [sample_row, sample_row._replace(elevation_unit="fathoms"), sample_row._replace(elevation=0)]
+    assert ColumnarTransformer.from_sample_rows(rows).transform() == [Transformer(row).transform() for row in rows]
+    assert ColumnarTransformer.from_sample_rows([]).transform() == []
+    assert ColumnarTransformer.from_sample_rows(rows, h3_resolutions=[]).transform() == [
+        Transformer(row, h3_resolutions=[]).transform() for row in rows
+    ]
+
+
+def test_columnar_transform_fields(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    columnar_transformer = ColumnarTransformer.from_sample_rows(sample_rows)
+    for fields in [
+        ["label"],
+        ["producedBy.samplingSite.location", "hasMaterialCategory", "producedBy_samplingSite_location_h3_3"],
+        ["curation", "producedBy_samplingSite_location_h3_15"],
+    ]:
+        assert columnar_transformer.transform(fields) == [
+            Transformer(sample_row).transform(fields) for sample_row in sample_rows
+        ]
+    ColumnarTransformer.PAUSE_GC = True
+    try:
+        assert columnar_transformer.transform() == [Transformer(sample_row).transform() for sample_row in sample_rows]
+        assert gc.isenabled()
+    finally:
+        ColumnarTransformer.PAUSE_GC = False
+    # only the H3 resolutions selected are computed
+    columnar_transformer = ColumnarTransformer.from_sample_rows(sample_rows)
+    columnar_transformer.transform(["producedBy_samplingSite_location_h3_3"])
+    assert columnar_transformer._h3_cells is not None and set(columnar_transformer._h3_cells.keys()) == {3}
+    # a record of a single field has just that field
+    assert columnar_transformer.transform(["@id"])[0] == {"@id": "https://data.isamples.org/digitalsample/igsn/" + sample_rows[0].igsn}
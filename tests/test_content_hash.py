@@ -0,0 +1,27 @@
+from isb_web.sqlmodel_database import SQLModelDAO as iSB_SQLModelDAO  # type: ignore
+from isamples_sesar.content_hash import ContentHashStore, record_content_hash
+
+
+def test_record_content_hash():
+    record = {"@id": "igsn:10.58052/IEEJR000M", "producedBy": {"label": "Dive 1", "resultTime": "2014-02-18"}}
+    reordered_record = {"producedBy": {"resultTime": "2014-02-18", "label": "Dive 1"}, "@id": "igsn:10.58052/IEEJR000M"}
+    assert record_content_hash(record) == record_content_hash(reordered_record)
+    assert len(record_content_hash(record)) == 64
+    changed_record = {"@id": "igsn:10.58052/IEEJR000M", "producedBy": {"label": "Dive 2", "resultTime": "2014-02-18"}}
+    assert record_content_hash(record) != record_content_hash(changed_record)
+
+
+def test_content_hash_store():
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    content_hashes = ContentHashStore(isb_session)
+    assert content_hashes.get(["igsn:10.58052/IEEJR000M"]) == {}
+    content_hashes.save({"igsn:10.58052/IEEJR000M": "a", "igsn:10.58052/IERVTL1I7": "b"})
+    content_hashes.save({"igsn:10.58052/IEEJR000M": "c"})
+    assert content_hashes.get(["igsn:10.58052/IEEJR000M", "igsn:10.58052/IERVTL1I7", "igsn:10.58052/EOI00002H"]) == {
+        "igsn:10.58052/IEEJR000M": "c",
+        "igsn:10.58052/IERVTL1I7": "b",
+    }
+    content_hashes.delete(["igsn:10.58052/IEEJR000M"])
+    assert content_hashes.get(["igsn:10.58052/IEEJR000M", "igsn:10.58052/IERVTL1I7"]) == {"igsn:10.58052/IERVTL1I7": "b"}
+    # a second store on the same database finds the table already there
+    assert ContentHashStore(isb_session).get(["igsn:10.58052/IERVTL1I7"]) == {"igsn:10.58052/IERVTL1I7": "b"}
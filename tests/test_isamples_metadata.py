@@ -1,8 +1,25 @@
 import pytest
 import json
 from sqlmodel import Session
-from isamples_sesar.sesar_transformer import Transformer
+from isamples_sesar import sesar_transformer
+from isamples_sesar.lookup_cache import LookupCache
+from isamples_sesar.sesar_transformer import (
+    ContextCategoryMetaMapper,
+    H3CellCache,
+    MaterialCategoryMetaMapper,
+    SpecimenCategoryMetaMapper,
+    Transformer,
+    compile_transform_plan,
+    geo_to_h3,
+    h3_cells,
+    h3_cells_batch,
+    prewarm_category_caches,
+    transform_in_processes,
+    transform_pool,
+    transform_threaded,
+)
 from isamples_sesar.sqlmodel_database import (
+    get_sample_rows_projected,
     get_sample_with_igsn
 )
 
@@ -58,6 +75,228 @@ def test_example(sesar_session: Session, igsn):
     check_geo_to_h3(transformed_test_data, expected_data)
 
 
+@pytest.mark.parametrize("igsn", ["10.58052/EOI00002H",
+                                  "10.58052/IEDUT103B",
+                                  "10.58052/IEEJR000M",
+                                  "10.58052/IEJEN0040",
+                                  "10.58052/IERVTL1I7",
+                                  "10.60471/ODP02Q1IZ"])
+def test_example_with_lookup_cache(sesar_session: Session, igsn):
+    sample = get_sample_with_igsn(sesar_session, igsn)
+    assert sample is not None
+    lookup_cache = LookupCache().load(sesar_session)
+    assert Transformer(sample, lookup_cache).transform() == Transformer(sample).transform()
+
+
+def test_examples_from_sample_rows(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    assert len(sample_rows) == 8
+    for sample_row in sample_rows:
+        sample = get_sample_with_igsn(sesar_session, sample_row.igsn)
+        assert sample is not None
+        assert Transformer(sample_row).transform() == Transformer(sample).transform()
+
+
+def test_lookup_cache_chains(sesar_session: Session):
+    lookup_cache = LookupCache().load(sesar_session)
+    assert lookup_cache.sample_type_chain(21) == ("Cylinder", "Individual Sample")
+    assert lookup_cache.parent_sample_type_name(21) == "Individual Sample"
+    assert lookup_cache.parent_sample_type_name(15) is None
+    assert lookup_cache.classification_chain(4262) == ("Macrobiology>Coral", "Biology")
+    assert lookup_cache.parent_classification_name(62) == "Rock"
+    assert lookup_cache.launch_type_name(2) == "ROV"
+    assert lookup_cache.nav_type_name(None) is None
+    assert lookup_cache.country_name(107) == "Jamaica"
+    lookup_cache.invalidate()
+    assert not lookup_cache.loaded
+    assert lookup_cache.sample_type_name(21) is None
+
+
+def test_prewarm_category_caches(sesar_session: Session):
+    meta_mappers = [ContextCategoryMetaMapper, MaterialCategoryMetaMapper, SpecimenCategoryMetaMapper]
+    for meta_mapper in meta_mappers:
+        meta_mapper.clear_cache()
+    assert prewarm_category_caches(sesar_session, LookupCache().load(sesar_session)) == 7
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    for sample_row in sample_rows:
+        Transformer(sample_row).transform()
+    for meta_mapper in meta_mappers:
+        stats = meta_mapper.cache_stats()
+        assert stats["hits"] == len(sample_rows)
+        assert stats["misses"] == stats["size"]
+
+
+def test_transform_threaded(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    lookup_cache = LookupCache().load(sesar_session)
+    records = transform_threaded(Transformer.for_batch(sample_rows, lookup_cache), workers=4)
+    assert records == [Transformer(sample_row).transform() for sample_row in sample_rows]
+
+
+def test_transform_many(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    expected_records = [Transformer(sample_row).transform() for sample_row in sample_rows]
+    lookup_cache = LookupCache().load(sesar_session)
+    assert Transformer.transform_many(sample_rows, lookup_cache) == expected_records
+    # a stream is consumed a batch at a time
+    transformed = list(Transformer.iter_transform(iter(sample_rows), lookup_cache, batch_size=3))
+    assert [sample for sample, _, _ in transformed] == sample_rows
+    assert [record for _, record, _ in transformed] == expected_records
+    assert [h3 for _, _, h3 in transformed] == [
+        geo_to_h3(sample_row.latitude, sample_row.longitude) for sample_row in sample_rows
+    ]
+    assert Transformer.transform_many([]) == []
+
+
+def test_transform_in_processes(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    expected = list(Transformer.iter_transform(sample_rows))
+    with transform_pool(2) as pool:
+        assert list(transform_in_processes(pool, sample_rows, chunk_size=3)) == expected
+        assert list(transform_in_processes(pool, sample_rows, fields=["@id"])) == [
+            (sample_row, {"@id": record["@id"]}, None) for sample_row, record, _ in expected
+        ]
+        assert list(transform_in_processes(pool, [])) == []
+
+
+def test_h3_cells():
+    resolutions = range(0, 16)
+    direct = h3_cells(18.0345, -76.7812, resolutions)
+    assert direct == {resolution: geo_to_h3(18.0345, -76.7812, resolution) for resolution in resolutions}
+    derived = h3_cells(18.0345, -76.7812, resolutions, derive_from_finest=True)
+    assert derived[15] == direct[15]
+    assert set(derived.keys()) == set(resolutions)
+    assert h3_cells(None, -76.7812, [0, 15]) == {0: None, 15: None}
+
+
+def test_h3_cells_batch():
+    latitudes = [18.0345, None, 18.0345, -45.5, float("nan")]
+    longitudes = [-76.7812, 10.0, -76.7812, 170.25, 3.0]
+    cells_by_resolution = h3_cells_batch(latitudes, longitudes, range(0, 16))
+    for resolution, cells in cells_by_resolution.items():
+        assert list(cells) == [
+            geo_to_h3(18.0345, -76.7812, resolution), None, geo_to_h3(18.0345, -76.7812, resolution),
+            geo_to_h3(-45.5, 170.25, resolution), None
+        ]
+    assert h3_cells_batch([], [], [15])[15].size == 0
+
+
+def test_transformers_for_batch(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 100)
+    transformers = Transformer.for_batch(sample_rows)
+    assert [transformer.sample for transformer in transformers] == sample_rows
+    for transformer, sample_row in zip(transformers, sample_rows):
+        assert transformer.transform() == Transformer(sample_row).transform()
+        assert transformer.h3_cell() == geo_to_h3(sample_row.latitude, sample_row.longitude)
+
+
+def test_h3_cell_cache():
+    cache = H3CellCache(max_size=2)
+    assert cache.cells(18.0345, -76.7812, [0, 15]) == h3_cells(18.0345, -76.7812, [0, 15])
+    assert cache.cells(18.0345, -76.7812, [15]) == h3_cells(18.0345, -76.7812, [15])
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+    # a resolution not cached yet for a known point is a miss, but doesn't add another entry
+    assert cache.cells(18.0345, -76.7812, [8]) == h3_cells(18.0345, -76.7812, [8])
+    cache.cells(-45.5, 170.25, [15])
+    cache.cells(18.0345, -76.7812, [0])
+    cache.cells(10.0, 20.0, [15])
+    # (-45.5, 170.25) was the least recently used point
+    assert cache.stats() == {"hits": 2, "misses": 4, "evictions": 1, "size": 2}
+    assert cache.cells(None, -76.7812, [15]) == {15: None}
+    cache.clear()
+    assert cache.stats() == {"hits": 0, "misses": 0, "evictions": 0, "size": 0}
+
+
+def test_h3_resolutions(sesar_session: Session):
+    sample = get_sample_with_igsn(sesar_session, "10.58052/IEEJR000M")
+    assert sample is not None
+    full_record = Transformer(sample).transform()
+    transformer = Transformer(sample, h3_resolutions=[0, 8])
+    record = transformer.transform()
+    assert record["producedBy_samplingSite_location_h3_0"] == full_record["producedBy_samplingSite_location_h3_0"]
+    assert record["producedBy_samplingSite_location_h3_8"] == full_record["producedBy_samplingSite_location_h3_8"]
+    assert "producedBy_samplingSite_location_h3_1" not in record
+    assert transformer.h3_cell() == geo_to_h3(sample.latitude, sample.longitude)
+
+
+def test_partial_transform(sesar_session: Session):
+    sample = get_sample_with_igsn(sesar_session, "10.58052/IEEJR000M")
+    assert sample is not None
+    full_record = Transformer(sample).transform()
+    assert Transformer(sample).transform(fields=None) == full_record
+    record = Transformer(sample).transform(["producedBy.samplingSite.location", "label", "@id"])
+    # keys come out in record order, not in the order they were asked for
+    assert list(record.keys()) == ["@id", "label", "producedBy"]
+    assert record["@id"] == full_record["@id"]
+    assert record["label"] == full_record["label"]
+    assert record["producedBy"] == {
+        "samplingSite": {"location": full_record["producedBy"]["samplingSite"]["location"]}
+    }
+    assert Transformer(sample).transform(["curation"])["curation"] == full_record["curation"]
+    record = Transformer(sample).transform(["producedBy_samplingSite_location_h3_8", "producedBy_samplingSite_location_h3_0"])
+    assert record == {
+        "producedBy_samplingSite_location_h3_0": full_record["producedBy_samplingSite_location_h3_0"],
+        "producedBy_samplingSite_location_h3_8": full_record["producedBy_samplingSite_location_h3_8"],
+    }
+
+
+def test_partial_transform_unknown_fields():
+    for fields in (
+        ["nope"],
+        ["label.nope"],
+        ["producedBy.nope"],
+        ["producedBy_samplingSite_location_h3_x"],
+        ["producedBy_samplingSite_location_h3_16"],
+    ):
+        with pytest.raises(ValueError):
+            compile_transform_plan(Transformer.RECORD_SPEC, tuple(fields))
+    assert compile_transform_plan(Transformer.RECORD_SPEC, None) == (Transformer.RECORD_SPEC, None)
+
+
+def test_transform_many_fields(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 20)
+    fields = ["@id", "hasMaterialCategory"]
+    expected_records = [Transformer(sample_row).transform(fields) for sample_row in sample_rows]
+    assert Transformer.transform_many(sample_rows, fields=fields) == expected_records
+    assert transform_threaded(Transformer.for_batch(sample_rows), fields=fields) == expected_records
+    # no H3 fields were asked for, so none are computed
+    assert all(h3 is None for _, _, h3 in Transformer.iter_transform(sample_rows, fields=fields))
+
+
+def test_transform_many_compiles_fields_once(sesar_session: Session):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 20)
+    fields = ["@id", "producedBy_samplingSite_location_h3_8"]
+    expected_records = [Transformer(sample_row).transform(fields) for sample_row in sample_rows]
+    cache_info = compile_transform_plan.cache_info()
+    assert Transformer.transform_many(sample_rows, fields=fields) == expected_records
+    after = compile_transform_plan.cache_info()
+    assert (after.hits + after.misses) - (cache_info.hits + cache_info.misses) == 1
+
+
+def test_only_selected_h3_resolutions_computed(sesar_session: Session, monkeypatch):
+    sample_rows, _ = get_sample_rows_projected(sesar_session, None, 20)
+    computed_resolutions = []
+
+    def recording_h3_cells_batch(latitudes, longitudes, resolutions, derive_from_finest=False):
+        computed_resolutions.append(set(resolutions))
+        return h3_cells_batch(latitudes, longitudes, resolutions, derive_from_finest)
+
+    monkeypatch.setattr(sesar_transformer, "h3_cells_batch", recording_h3_cells_batch)
+    fields = ["producedBy_samplingSite_location_h3_8"]
+    results = list(Transformer.iter_transform(sample_rows, fields=fields))
+    assert computed_resolutions == [{8}]
+    assert [record for _, record, _ in results] == [Transformer(sample_row).transform(fields) for sample_row in sample_rows]
+    # the thing's h3 cell wasn't asked for, so it isn't computed either
+    assert all(h3 is None for _, _, h3 in results)
+    fields = ["producedBy_samplingSite_location_h3_15", "producedBy_samplingSite_location_h3_8"]
+    results = list(Transformer.iter_transform(sample_rows, fields=fields))
+    assert computed_resolutions[1:] == [{8, 15}]
+    assert [h3 for _, _, h3 in results] == [geo_to_h3(sample_row.latitude, sample_row.longitude) for sample_row in sample_rows]
+    transformer = Transformer(sample_rows[0])
+    transformer.transform(["producedBy_samplingSite_location_h3_3"])
+    assert transformer._h3_cells is not None and set(transformer._h3_cells.keys()) == {3}
+
+
 def check_id(test_data, expected_data):
     assert test_data["@id"] == expected_data["@id"]
 
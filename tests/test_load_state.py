@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from isamples_sesar.load_state import LoadState
+
+
+def test_watermark_round_trip(tmp_path):
+    state_path = str(tmp_path / "sesar_state.json")
+    load_state = LoadState(state_path)
+    assert load_state.watermark() is None
+
+    load_state.set_watermark((datetime(2023, 10, 1, 12, 30), 4580055))
+    reloaded_state = LoadState(state_path)
+    assert reloaded_state.watermark() == (datetime(2023, 10, 1, 12, 30), 4580055)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    state_path = str(tmp_path / "sesar_checkpoint.json")
+    load_state = LoadState(state_path)
+    assert load_state.checkpoint() is None
+
+    load_state.set_checkpoint({"run_id": "abc123", "last_sample_id": 4580055, "completed": False})
+    reloaded_state = LoadState(state_path)
+    assert reloaded_state.checkpoint() == {"run_id": "abc123", "last_sample_id": 4580055, "completed": False}
+    # the checkpoint and the watermark don't get in each other's way
+    reloaded_state.set_watermark((datetime(2023, 10, 1, 12, 30), 4580055))
+    assert LoadState(state_path).checkpoint()["run_id"] == "abc123"
@@ -0,0 +1,143 @@
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from isamples_sesar.mapper import (
+    NOT_PROVIDED,
+    AbstractCategoryMetaMapper,
+    StringConstantCategoryMapper,
+    StringEndsWithCategoryMapper,
+    StringEqualityCategoryMapper,
+    StringOrderedCategoryMapper,
+    StringPairedCategoryMapper,
+)
+from isamples_sesar.sesar_transformer import (
+    ContextCategoryMetaMapper,
+    MaterialCategoryMetaMapper,
+    SpecimenCategoryMetaMapper,
+)
+
+SOURCE_CATEGORIES = [
+    "",
+    "Rock",
+    "  Igneous>Plutonic>Rock ",
+    "Sedimentary>GlacialAndOrPaleosol>Rock",
+    "Mineral",
+    "Liquid>aqueous",
+    "Liquid>organic",
+    "Ice",
+    "ICE",
+    "Gas",
+    "Sediment",
+    "Microbiology>Soil",
+    "Soil",
+    "Biology",
+    "Macrobiology>Coral>Biology",
+    "Aragonite>Biology",
+    "Synthetic",
+    "Particulate",
+    "Tephra",
+    "Core",
+    "Core Half Round",
+    "individual sample>thin section",
+    "Trawl",
+    "Dredge",
+    "CTD",
+    "Not a category",
+    "ock",
+]
+AUXILIARY_CATEGORIES = [None, "", "sea", "lake", "Lake", "floodplain", "Vent", "Creek bank", "Mountain", "Outcrop"]
+
+
+def _walk_mappers(
+    meta_mapper: typing.Type[AbstractCategoryMetaMapper],
+    source_category: str,
+    auxiliary_source_category: typing.Optional[str],
+) -> list[str]:
+    """Categories the slow way, asking each mapper in turn"""
+    categories: list[str] = []
+    for mapper in meta_mapper._categoriesMappers:
+        mapper.append_if_matched(source_category, auxiliary_source_category, categories)
+    if len(categories) == 0:
+        categories.append(NOT_PROVIDED)
+    return categories
+
+
+@pytest.mark.parametrize(
+    "meta_mapper", [ContextCategoryMetaMapper, MaterialCategoryMetaMapper, SpecimenCategoryMetaMapper]
+)
+def test_compiled_categories_match_mappers(meta_mapper):
+    for source_category in SOURCE_CATEGORIES:
+        for auxiliary_source_category in AUXILIARY_CATEGORIES:
+            assert meta_mapper.categories(source_category, auxiliary_source_category) == _walk_mappers(
+                meta_mapper, source_category, auxiliary_source_category
+            )
+    assert meta_mapper.categories(None) == [NOT_PROVIDED]
+
+
+def test_compiled_categories_keep_duplicates():
+    assert MaterialCategoryMetaMapper.categories("Ice") == ["Ice", "Ice"]
+    assert MaterialCategoryMetaMapper.categories("Macrobiology>Other") == ["Organic material"]
+
+
+def test_compiled_categories_ordered_and_constant():
+    class ExampleMetaMapper(AbstractCategoryMetaMapper):
+        @classmethod
+        def categories_mappers(cls):
+            return [
+                StringOrderedCategoryMapper([
+                    StringPairedCategoryMapper("Soil", "floodplain", "Floodplain soil"),
+                    StringEndsWithCategoryMapper("Soil", "Soil"),
+                    StringEqualityCategoryMapper(["Topsoil"], "Topsoil"),
+                ]),
+                StringEndsWithCategoryMapper("oil", "Oily"),
+                StringConstantCategoryMapper("Anything"),
+            ]
+
+    assert ExampleMetaMapper.categories("Soil", "floodplain") == ["Floodplain soil", "Oily", "Anything"]
+    assert ExampleMetaMapper.categories("Topsoil") == ["Soil", "Oily", "Anything"]
+    assert ExampleMetaMapper.categories("Water") == ["Anything"]
+
+
+def test_categories_cache():
+    MaterialCategoryMetaMapper.clear_cache()
+    assert MaterialCategoryMetaMapper.categories("Ice") == ["Ice", "Ice"]
+    categories = MaterialCategoryMetaMapper.categories(" ICE ")
+    assert categories == ["Ice", "Ice"]
+    # callers get their own copy of a cached result
+    categories.append("Rock")
+    assert MaterialCategoryMetaMapper.categories("ice") == ["Ice", "Ice"]
+    assert MaterialCategoryMetaMapper.cache_stats() == {"hits": 2, "misses": 1, "size": 1}
+    assert MaterialCategoryMetaMapper.prewarm([("Tephra", None), (None, None)]) == 2
+    assert MaterialCategoryMetaMapper.cache_stats() == {"hits": 2, "misses": 3, "size": 3}
+    MaterialCategoryMetaMapper.clear_cache()
+    assert MaterialCategoryMetaMapper.cache_stats() == {"hits": 0, "misses": 0, "size": 0}
+
+
+def test_match_is_stateless():
+    ordered_mapper = ContextCategoryMetaMapper._sedimentMapper
+    assert ordered_mapper.match("Sediment", "lake") == "Lake, river or stream bottom"
+    assert ordered_mapper.match("Sediment", "sea") == "Marine water body bottom"
+    assert ordered_mapper.match("Sediment", "river") is None
+    assert ordered_mapper.matches("Sediment", "sea")
+    assert not hasattr(ordered_mapper, "_destination")
+    assert ContextCategoryMetaMapper._equalsGasMapper.match("gas") == "Subsurface fluid reservoir"
+    # each call without a list gets a fresh one
+    assert ContextCategoryMetaMapper._equalsGasMapper.append_if_matched("Gas") == ["Subsurface fluid reservoir"]
+    assert ContextCategoryMetaMapper._equalsGasMapper.append_if_matched("Gas") == ["Subsurface fluid reservoir"]
+
+
+def test_categories_across_threads():
+    inputs = [
+        (source_category, auxiliary_source_category)
+        for source_category in SOURCE_CATEGORIES
+        for auxiliary_source_category in AUXILIARY_CATEGORIES
+    ] * 20
+    expected = [_walk_mappers(ContextCategoryMetaMapper, *category_input) for category_input in inputs]
+    ContextCategoryMetaMapper.clear_cache()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda category_input: ContextCategoryMetaMapper.categories(*category_input), inputs))
+    assert results == expected
+    stats = ContextCategoryMetaMapper.cache_stats()
+    assert stats["hits"] + stats["misses"] == len(inputs)
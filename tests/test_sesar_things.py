@@ -1,7 +1,40 @@
-from sqlmodel import Session
+import contextlib
+import datetime
+import sqlite3
+
+import click
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import make_transient
+from sqlmodel import Session, delete, select, update
+from isb_lib.models.thing import Thing  # type: ignore
+from isamples_sesar.content_hash import ContentHashStore
+from isamples_sesar.load_state import LoadState
+from isamples_sesar.lookup_cache import shared_lookup_cache
+from isamples_sesar.sample import Sample
+from isamples_sesar.sample_delete_request import Sample_Delete_Request
+from isamples_sesar.sample_thing import SampleThingStore
 from isamples_sesar.sesar_adapter import SESARItem
-from scripts.sesar_things import load_sesar_entries
-from isb_web.sqlmodel_database import all_thing_primary_keys  # type: ignore
+from isamples_sesar.sesar_transformer import Transformer
+from scripts import sesar_things
+from scripts.sesar_things import (
+    add_things,
+    load_sesar_entries,
+    load_sesar_entries_parallel,
+    check_load_options,
+    load_thing_id_index,
+    parse_fields,
+    propagate_removed_samples,
+    retry_transient_errors,
+    thing_primary_key_rows,
+    thing_primary_keys
+)
+from isb_web.sqlmodel_database import (  # type: ignore
+    DatabaseBulkUpdater,
+    SQLModelDAO as iSB_SQLModelDAO,
+    all_thing_primary_keys
+)
 
 
 def test_sesar_things_saved(sesar_session: Session, isb_session: Session):
@@ -24,3 +57,425 @@ def test_sesar_things_saved(sesar_session: Session, isb_session: Session):
     # check things exist
     test_keys = all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID)
     assert test_keys == expected_keys
+
+
+def test_sesar_things_reloaded(sesar_session: Session, isb_session: Session, monkeypatch):
+    primary_keys_by_id = all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID)
+    assert thing_primary_keys(isb_session, list(primary_keys_by_id.keys())) == primary_keys_by_id
+    assert thing_primary_keys(isb_session, ["igsn:10.58052/NOTATHING"]) == {}
+    scans = []
+
+    def counting_thing_primary_key_rows(session, after_primary_key=None):
+        scans.append(after_primary_key)
+        return thing_primary_key_rows(session, after_primary_key)
+
+    monkeypatch.setattr(sesar_things, "thing_primary_key_rows", counting_thing_primary_key_rows)
+    # a second load updates the existing things in place, reading the key map just once
+    load_sesar_entries(sesar_session, isb_session)
+    assert scans == [None]
+    assert all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID) == primary_keys_by_id
+
+
+def test_add_things_updates_primary_keys(isb_session: Session):
+    primary_keys_by_id = all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID)
+    bulk_updater = DatabaseBulkUpdater(
+        isb_session, SESARItem.AUTHORITY_ID, 100, SESARItem.MEDIA_TYPE, primary_keys_by_id
+    )
+    things = [({"@id": "igsn:10.58052/TEST00001"}, "igsn:10.58052/TEST00001", "doi.org/10.58052/TEST00001", None, None)]
+    assert add_things(isb_session, bulk_updater, primary_keys_by_id, things) == 1
+    assert primary_keys_by_id == all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID)
+    assert "igsn:10.58052/TEST00001" in primary_keys_by_id
+
+
+def test_thing_id_index_snapshot(sesar_session: Session, isb_session: Session, monkeypatch, tmp_path):
+    snapshot_path = str(tmp_path / "thing_ids.npz")
+    load_sesar_entries(sesar_session, isb_session, id_index_file=snapshot_path)
+    primary_keys_by_id = all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID)
+    thing_id_index = load_thing_id_index(isb_session, snapshot_path)
+    assert len(thing_id_index) == len(primary_keys_by_id)
+    for thing_id, primary_key in primary_keys_by_id.items():
+        assert thing_id_index.get(thing_id) == primary_key
+    scans = []
+
+    def counting_thing_primary_key_rows(session, after_primary_key=None):
+        scans.append(after_primary_key)
+        return thing_primary_key_rows(session, after_primary_key)
+
+    monkeypatch.setattr(sesar_things, "thing_primary_key_rows", counting_thing_primary_key_rows)
+    # a warm start only asks for the things created since the snapshot
+    load_sesar_entries(sesar_session, isb_session, id_index_file=snapshot_path)
+    assert scans == [max(primary_keys_by_id.values())]
+    assert all_thing_primary_keys(isb_session, SESARItem.AUTHORITY_ID) == primary_keys_by_id
+
+
+def test_thing_id_index_snapshot_out_of_date(sesar_session: Session, tmp_path):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    snapshot_path = str(tmp_path / "thing_ids.npz")
+    load_sesar_entries(sesar_session, isb_session, id_index_file=snapshot_path)
+    # one thing goes, and another lands with a key below the snapshot's highest, so the count still matches
+    deleted_thing = isb_session.exec(select(Thing).where(Thing.primary_key == 2)).one()
+    isb_session.delete(deleted_thing)
+    isb_session.add(Thing(
+        primary_key=0,
+        id="igsn:10.58052/LATE00001",
+        authority_id=SESARItem.AUTHORITY_ID,
+        resolved_url="doi.org/10.58052/LATE00001",
+        resolved_status=200
+    ))
+    isb_session.commit()
+    thing_id_index = load_thing_id_index(isb_session, snapshot_path)
+    assert thing_id_index.get("igsn:10.58052/LATE00001") == 0
+    assert deleted_thing.id not in thing_id_index
+    assert len(thing_id_index) == 8
+
+
+def test_sesar_things_upserted(sesar_session: Session):
+    bulk_updated_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, bulk_updated_session)
+    upserted_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, upserted_session, upsert=True, read_batch_size=3, write_batch_size=2)
+    # and again, which only updates
+    load_sesar_entries(sesar_session, upserted_session, upsert=True, read_batch_size=3, write_batch_size=2)
+    bulk_updated = {thing.id: (thing.resolved_content, thing.h3) for thing in bulk_updated_session.exec(select(Thing)).all()}
+    upserted = {thing.id: (thing.resolved_content, thing.h3) for thing in upserted_session.exec(select(Thing)).all()}
+    assert upserted == bulk_updated
+    assert len(upserted) == 8
+
+
+def test_sesar_things_skip_unchanged(sesar_session: Session, capsys):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert "Num newer=8, written=8, skipped unchanged=0" in capsys.readouterr().out
+    things = {thing.id: thing.tstamp for thing in isb_session.exec(select(Thing)).all()}
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True, upsert=True)
+    assert "Num newer=8, written=0, skipped unchanged=8" in capsys.readouterr().out
+    isb_session.expire_all()
+    assert {thing.id: thing.tstamp for thing in isb_session.exec(select(Thing)).all()} == things
+    # once a thing's hash is gone, it's written again
+    ContentHashStore(isb_session).delete(["igsn:10.58052/IEEJR000M"])
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert "Num newer=8, written=1, skipped unchanged=7" in capsys.readouterr().out
+
+
+def _things_by_id(isb_session):
+    return {thing.id: (thing.resolved_content, thing.h3) for thing in isb_session.exec(select(Thing)).all()}
+
+
+def test_retry_transient_errors():
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    attempts = []
+
+    def flaky_operation(attempt):
+        attempts.append(attempt)
+        if attempt < 2:
+            raise OperationalError("INSERT INTO thing", {}, Exception("server closed the connection unexpectedly"))
+        return "done"
+
+    assert retry_transient_errors(flaky_operation, [isb_session], 2, 0) == "done"
+    assert attempts == [0, 1, 2]
+    attempts.clear()
+    with pytest.raises(OperationalError):
+        retry_transient_errors(flaky_operation, [isb_session], 1, 0)
+    assert attempts == [0, 1]
+
+    def broken_operation(attempt):
+        attempts.append(attempt)
+        raise IntegrityError("INSERT INTO thing", {}, Exception("duplicate key"))
+
+    attempts.clear()
+    # not transient, so not retried
+    with pytest.raises(IntegrityError):
+        retry_transient_errors(broken_operation, [isb_session], 3, 0)
+    assert attempts == [0]
+
+
+def test_sesar_things_resumed(sesar_session: Session, monkeypatch, tmp_path):
+    expected_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, expected_session)
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    checkpoint_state = LoadState(str(tmp_path / "checkpoint.json"))
+    write_batch = sesar_things.write_batch
+    batches_written: list[list[tuple]] = []
+
+    def crashing_write_batch(*args, **kwargs):
+        if len(batches_written) == 1:
+            raise RuntimeError("killed")
+        batches_written.append(args[1])
+        return write_batch(*args, **kwargs)
+
+    monkeypatch.setattr(sesar_things, "write_batch", crashing_write_batch)
+    with pytest.raises(RuntimeError):
+        load_sesar_entries(sesar_session, isb_session, read_batch_size=3, checkpoint_state=checkpoint_state)
+    checkpoint = checkpoint_state.checkpoint()
+    assert checkpoint is not None
+    assert checkpoint["num_newer"] == 3
+    assert not checkpoint["completed"]
+    assert len(_things_by_id(isb_session)) == 3
+    monkeypatch.setattr(sesar_things, "write_batch", write_batch)
+
+    load_sesar_entries(sesar_session, isb_session, read_batch_size=3, checkpoint_state=checkpoint_state, resume=True)
+    resumed_checkpoint = checkpoint_state.checkpoint()
+    assert resumed_checkpoint is not None
+    assert resumed_checkpoint["run_id"] == checkpoint["run_id"]
+    assert resumed_checkpoint["num_newer"] == 8
+    assert resumed_checkpoint["completed"]
+    assert _things_by_id(isb_session) == _things_by_id(expected_session)
+    # the run completed, so the next one starts afresh rather than loading nothing
+    load_sesar_entries(sesar_session, isb_session, read_batch_size=3, checkpoint_state=checkpoint_state, resume=True)
+    next_checkpoint = checkpoint_state.checkpoint()
+    assert next_checkpoint is not None
+    assert next_checkpoint["run_id"] != checkpoint["run_id"]
+    assert next_checkpoint["num_newer"] == 8
+    assert next_checkpoint["completed"]
+
+
+def test_sesar_things_resume_with_other_options(sesar_session: Session, monkeypatch, tmp_path):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    checkpoint_state = LoadState(str(tmp_path / "checkpoint.json"))
+    write_batch = sesar_things.write_batch
+    batches_written: list[list[tuple]] = []
+
+    def crashing_write_batch(*args, **kwargs):
+        if len(batches_written) == 1:
+            raise RuntimeError("killed")
+        batches_written.append(args[1])
+        return write_batch(*args, **kwargs)
+
+    monkeypatch.setattr(sesar_things, "write_batch", crashing_write_batch)
+    with pytest.raises(RuntimeError):
+        load_sesar_entries(sesar_session, isb_session, read_batch_size=3, checkpoint_state=checkpoint_state)
+    monkeypatch.setattr(sesar_things, "write_batch", write_batch)
+    checkpoint = checkpoint_state.checkpoint()
+    with pytest.raises(ValueError, match="upsert"):
+        load_sesar_entries(
+            sesar_session, isb_session, read_batch_size=3, upsert=True, checkpoint_state=checkpoint_state, resume=True
+        )
+    # the unfinished run is left as it was, to be resumed with its own options
+    assert checkpoint_state.checkpoint() == checkpoint
+
+
+def test_sesar_things_retried(sesar_session: Session, monkeypatch):
+    expected_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, expected_session)
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    write_batch = sesar_things.write_batch
+    attempts = []
+
+    def flaky_write_batch(*args, **kwargs):
+        attempts.append(args[-1])
+        if len(attempts) == 2:
+            # the first half of the batch made it in before the connection dropped
+            write_batch(args[0], args[1][:2], *args[2:])
+            raise OperationalError("INSERT INTO thing", {}, Exception("server closed the connection unexpectedly"))
+        return write_batch(*args, **kwargs)
+
+    monkeypatch.setattr(sesar_things, "write_batch", flaky_write_batch)
+    load_sesar_entries(sesar_session, isb_session, read_batch_size=3, max_retries=1, retry_backoff_seconds=0)
+    assert attempts == [0, 0, 1, 0]
+    assert _things_by_id(isb_session) == _things_by_id(expected_session)
+    assert len(isb_session.exec(select(Thing)).all()) == 8
+
+
+def test_sesar_things_written_as_chunks_arrive(sesar_session: Session, monkeypatch):
+    expected_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, expected_session)
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    write_batch = sesar_things.write_batch
+    events = []
+
+    def recording_transform_in_processes(pool, samples, chunk_size):
+        lookup_cache = shared_lookup_cache(sesar_session)
+        for sample, current_record, h3 in Transformer.iter_transform(samples, lookup_cache):
+            events.append("transformed")
+            yield sample, current_record, h3
+
+    def recording_write_batch(*args, **kwargs):
+        events.append(f"wrote {len(args[1])}")
+        return write_batch(*args, **kwargs)
+
+    monkeypatch.setattr(sesar_things, "transform_pool", lambda workers: contextlib.nullcontext("pool"))
+    monkeypatch.setattr(sesar_things, "transform_in_processes", recording_transform_in_processes)
+    monkeypatch.setattr(sesar_things, "write_batch", recording_write_batch)
+    load_sesar_entries(sesar_session, isb_session, read_batch_size=5, transform_workers=2, chunk_size=2)
+    # each chunk is written before the next one is pulled from the pool
+    first_batch = ["transformed", "transformed", "wrote 2"] * 2 + ["transformed", "wrote 1"]
+    second_batch = ["transformed", "transformed", "wrote 2", "transformed", "wrote 1"]
+    assert events == first_batch + second_batch
+    assert _things_by_id(isb_session) == _things_by_id(expected_session)
+
+
+def test_sesar_things_memory_released(sesar_session: Session, monkeypatch):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    assert sesar_things.current_rss_mb() > 0
+    write_batch = sesar_things.write_batch
+    identity_map_sizes: list[tuple[int, int]] = []
+
+    def recording_write_batch(*args, **kwargs):
+        identity_map_sizes.append((len(sesar_session.identity_map), len(isb_session.identity_map)))
+        return write_batch(*args, **kwargs)
+
+    def recording_current_rss_mb():
+        identity_map_sizes.append((len(sesar_session.identity_map), len(isb_session.identity_map)))
+        return 100.0
+
+    monkeypatch.setattr(sesar_things, "write_batch", recording_write_batch)
+    monkeypatch.setattr(sesar_things, "current_rss_mb", recording_current_rss_mb)
+    load_sesar_entries(sesar_session, isb_session, stream=True, read_batch_size=3, max_rss_mb=200)
+    # each batch's samples are held while it's written, and released once it's done
+    assert len(identity_map_sizes) == 6
+    assert all(sesar_size > 0 for sesar_size, _ in identity_map_sizes[0::2])
+    assert identity_map_sizes[1::2] == [(0, 0)] * 3
+
+    with pytest.raises(MemoryError):
+        load_sesar_entries(sesar_session, isb_session, stream=True, read_batch_size=3, max_rss_mb=50)
+
+
+def test_sample_things_only_written_when_changed(sesar_session: Session, capsys):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    sample_thing_writes = []
+
+    def record_sample_thing_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO sesar_sample_thing"):
+            sample_thing_writes.append(statement)
+
+    event.listen(isb_session.get_bind(), "before_cursor_execute", record_sample_thing_writes)
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert len(sample_thing_writes) == 1
+    sample_thing_writes.clear()
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert "written=0, skipped unchanged=8" in capsys.readouterr().out
+    assert sample_thing_writes == []
+    # a sample recorded against some other thing is put right
+    SampleThingStore(isb_session).save({3661220: "igsn:10.58052/SOMETHINGELSE"})
+    sample_thing_writes.clear()
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert len(sample_thing_writes) == 1
+    assert SampleThingStore(isb_session).get([3661220]) == {3661220: "igsn:10.58052/EOI00002H"}
+
+
+def test_propagate_removed_samples(sesar_session: Session, capsys):
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+    assert SampleThingStore(isb_session).get([4312677]) == {4312677: "igsn:10.58052/IEJEN0040"}
+    since = datetime.datetime.now() - datetime.timedelta(days=1)
+    archived_sample = sesar_session.get(Sample, 3661220)
+    deleted_sample = sesar_session.get(Sample, 4312677)
+    assert archived_sample is not None and deleted_sample is not None
+    delete_request = Sample_Delete_Request(id=1, sample_id=4312677, deleted_date=datetime.datetime.now())
+    archived_sample.archive_date = datetime.datetime.now() - datetime.timedelta(hours=1)
+    sesar_session.add(delete_request)
+    # the request is left behind when the sample row itself is deleted
+    sesar_session.delete(deleted_sample)
+    sesar_session.commit()
+    try:
+        # archived samples aren't loaded
+        load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+        assert "Num newer=6," in capsys.readouterr().out
+
+        assert propagate_removed_samples(sesar_session, isb_session, since, until=datetime.datetime.now()) == 2
+        isb_session.expire_all()
+        statuses = {thing.id: thing.resolved_status for thing in isb_session.exec(select(Thing)).all()}
+        assert statuses["igsn:10.58052/EOI00002H"] == sesar_things.TOMBSTONE_STATUS
+        assert statuses["igsn:10.58052/IEJEN0040"] == sesar_things.TOMBSTONE_STATUS
+        assert list(statuses.values()).count(200) == 6
+        # nor do they come back to life on the next load, though their hashes were forgotten
+        load_sesar_entries(sesar_session, isb_session, skip_unchanged=True)
+        isb_session.expire_all()
+        assert isb_session.exec(
+            select(Thing).where(Thing.id == "igsn:10.58052/EOI00002H")
+        ).one().resolved_status == sesar_things.TOMBSTONE_STATUS
+
+        until = datetime.datetime.now()
+        assert propagate_removed_samples(sesar_session, isb_session, since, delete_things=True, until=until) == 2
+        thing_ids = {thing.id for thing in isb_session.exec(select(Thing)).all()}
+        assert len(thing_ids) == 6
+        assert "igsn:10.58052/EOI00002H" not in thing_ids and "igsn:10.58052/IEJEN0040" not in thing_ids
+    finally:
+        # loading expunges everything from the session, so put the fixture back with statements
+        sesar_session.exec(update(Sample).where(Sample.sample_id == 3661220).values(archive_date=None))  # type: ignore
+        sesar_session.exec(delete(Sample_Delete_Request))  # type: ignore
+        make_transient(deleted_sample)
+        sesar_session.add(deleted_sample)
+        sesar_session.commit()
+
+
+def _sesar_database_file(sesar_session: Session, path) -> str:
+    """Copy the in-memory SESAR fixture to a file, so other processes can open it"""
+    with sqlite3.connect(path) as target:
+        sesar_session.connection().connection.driver_connection.backup(target)  # type: ignore
+    return f"sqlite:///{path}"
+
+
+def test_sesar_things_parallel(sesar_session: Session, tmp_path, capsys):
+    expected_session = iSB_SQLModelDAO("sqlite://").get_session()
+    load_sesar_entries(sesar_session, expected_session)
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    sesar_db_url = _sesar_database_file(sesar_session, tmp_path / "sesar.db")
+    load_sesar_entries_parallel(sesar_db_url, isb_session, workers=2, read_batch_size=3, write_batch_size=2)
+    assert "Num newer=8, written=8" in capsys.readouterr().out
+    assert _things_by_id(isb_session) == _things_by_id(expected_session)
+    assert len(SampleThingStore(isb_session).get([3661220, 4312677])) == 2
+
+
+def test_transform_sample_id_range_retried(sesar_session: Session, tmp_path, monkeypatch):
+    sesar_db_url = _sesar_database_file(sesar_session, tmp_path / "sesar.db")
+    sesar_things._init_load_worker(sesar_db_url, None, 1000, 3, max_retries=1, retry_backoff_seconds=0)
+    get_sample_rows_projected = sesar_things.get_sample_rows_projected
+    attempts = []
+
+    def flaky_get_sample_rows_projected(*args, **kwargs):
+        attempts.append(args[1])
+        if len(attempts) == 2:
+            raise OperationalError("SELECT sample", {}, Exception("server closed the connection unexpectedly"))
+        return get_sample_rows_projected(*args, **kwargs)
+
+    monkeypatch.setattr(sesar_things, "get_sample_rows_projected", flaky_get_sample_rows_projected)
+    transformed, thing_ids_by_sample_id = sesar_things._transform_sample_id_range((1, 5000000))
+    # the failed page is read again from the same cursor
+    assert attempts[1] == attempts[2]
+    assert len(transformed) == 8
+    assert sorted(thing_ids_by_sample_id.values()) == sorted(thing[1] for thing in transformed)
+
+
+def test_parse_fields():
+    assert parse_fields(None, None, None) is None
+    assert parse_fields(None, None, "label, producedBy_samplingSite_location_h3_15,") == (
+        "label", "producedBy_samplingSite_location_h3_15"
+    )
+    for value in ["nope", "producedBy_samplingSite_location_h3_16", "producedBy_samplingSite_location_h3_-1"]:
+        with pytest.raises(click.BadParameter):
+            parse_fields(None, None, value)
+
+
+def test_check_load_options():
+    options = {
+        "stream": False,
+        "workers": 1,
+        "state_file": None,
+        "max_rss_mb": None,
+        "prewarm_categories": False,
+        "transform_threads": 1,
+        "columnar": False,
+        "transform_workers": 1,
+        "chunk_size": 1000,
+        "id_index_file": None,
+        "upsert": False,
+        "read_batch_size": 10000,
+        "write_batch_size": 10000,
+        "checkpoint_file": None,
+        "resume": False,
+        "max_retries": 3,
+    }
+    check_load_options(**options)
+    check_load_options(**{**options, "workers": 2, "upsert": True})
+    for conflict in [
+        {"workers": 2, "max_rss_mb": 1024},
+        {"workers": 2, "prewarm_categories": True},
+        {"stream": True, "checkpoint_file": "checkpoint.json"},
+        {"resume": True},
+        {"columnar": True, "transform_threads": 2},
+        {"upsert": True, "id_index_file": "thing_ids.npz"},
+        {"read_batch_size": 0},
+    ]:
+        with pytest.raises(click.UsageError):
+            check_load_options(**{**options, **conflict})
@@ -1,4 +1,7 @@
 import pytest
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import event
 from sqlmodel import Session, create_engine
 from sqlmodel.pool import StaticPool
 
@@ -7,13 +10,23 @@ from isamples_sesar.sample import Sample
 from isamples_sesar.classification import Classification
 from isamples_sesar.country import Country
 from isamples_sesar.launch_type import Launch_Type
+from isamples_sesar.lookup_cache import LookupCache
 from isamples_sesar.nav_type import Nav_Type
 from isamples_sesar.sample_additional_name import Sample_Additional_Name
+from isamples_sesar.sample_delete_request import Sample_Delete_Request
 from isamples_sesar.sample_type import Sample_Type
 from isamples_sesar.sesar_user import Sesar_User
+from isamples_sesar.sesar_transformer import Transformer
 from isamples_sesar.sqlmodel_database import (
+    count_sample_rows,
+    get_removed_samples,
+    get_sample_id_ranges,
+    get_sample_rows_after_watermark,
+    get_sample_rows_projected,
     get_sample_with_id,
-    get_sample_with_igsn
+    get_sample_with_igsn,
+    get_samples_with_igsns,
+    iter_samples
 )
 
 
@@ -145,3 +158,144 @@ def test_sample_relationships(session: Session):
     assert sample.nav_type is not None and sample.nav_type.name == "Test Nav Type"
     assert sample.launch_type is not None and sample.launch_type.name == "Test Launch Type"
     assert sample.additional_names is not None and sample.additional_names[0].name == "Another name"
+
+
+def _statements_to_transform_batch(
+    session: Session, batch_size: int, lookup_cache: Optional[LookupCache] = None
+) -> list[str]:
+    session.expunge_all()
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        samples = next(iter_samples(
+            session, chunk_size=batch_size, transform_ready=True, lookup_cached=lookup_cache is not None
+        ))
+        assert len(samples) == batch_size
+        for sample in samples:
+            Transformer(sample, lookup_cache).transform()
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+    return statements
+
+
+def test_transform_ready_query_count_is_constant(sesar_session: Session):
+    # one query for the samples and their lookup tables, one for the parent samples
+    assert len(_statements_to_transform_batch(sesar_session, 2)) == 2
+    assert len(_statements_to_transform_batch(sesar_session, 8)) == 2
+
+
+def test_transform_ready_lookup_cached(sesar_session: Session):
+    lookup_cache = LookupCache().load(sesar_session)
+    expected = [Transformer(sample, lookup_cache).transform() for sample in next(iter_samples(sesar_session))]
+    statements = _statements_to_transform_batch(sesar_session, 8, lookup_cache)
+    assert len(statements) == 2
+    # the lookup tables come from the cache, so they aren't joined on
+    for table in ["sample_type", "classification", "launch_type", "nav_type"]:
+        assert f"JOIN {table}" not in statements[0]
+    assert "JOIN sesar_user" in statements[0]
+    records = [Transformer(sample, lookup_cache).transform() for sample in next(iter_samples(
+        sesar_session, transform_ready=True, lookup_cached=True
+    ))]
+    assert records == expected
+
+
+def test_iter_samples(sesar_session: Session):
+    chunks = list(iter_samples(sesar_session, chunk_size=3, transform_ready=True))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 2]
+    sample_ids = [sample.sample_id for chunk in chunks for sample in chunk]
+    assert sample_ids == sorted(sample_ids)
+
+
+def test_get_sample_id_ranges(sesar_session: Session):
+    assert count_sample_rows(sesar_session) == 8
+    sample_id_ranges = get_sample_id_ranges(sesar_session, 3)
+    assert sample_id_ranges == [(None, 3661220), (3661221, 4359908), (4359909, None)]
+    assert _sample_ids_in_ranges(sesar_session, sample_id_ranges) == [
+        1088023, 2989112, 3661220, 4280974, 4312677, 4359908, 4369455, 4580055
+    ]
+
+
+def test_get_sample_id_ranges_cover_samples_added_later(session: Session):
+    session.add(Sample(sample_id=10, sample_type_id=1, igsn="10.58052/IE123TEN", igsn_prefix="IE123", name="Ten"))
+    session.commit()
+    sample_id_ranges = get_sample_id_ranges(session, 3)
+    assert sample_id_ranges == [(None, 1), (2, 2), (3, None)]
+    # one in a gap between the partitioned ids, one past the highest
+    session.add(Sample(sample_id=5, sample_type_id=1, igsn="10.58052/IE123FIVE", igsn_prefix="IE123", name="Five"))
+    session.add(Sample(sample_id=20, sample_type_id=1, igsn="10.58052/IE123TWENTY", igsn_prefix="IE123", name="Twenty"))
+    session.commit()
+    assert _sample_ids_in_ranges(session, sample_id_ranges) == [1, 2, 5, 10, 20]
+
+
+def test_get_sample_id_ranges_empty(session: Session):
+    assert get_sample_id_ranges(session, 3, datetime(2100, 1, 1)) == [(None, None)]
+
+
+def _sample_ids_in_ranges(session: Session, sample_id_ranges) -> list[int]:
+    sample_ids: list[int] = []
+    for first, last in sample_id_ranges:
+        after_sample_id = first - 1 if first is not None else None
+        sample_rows, _ = get_sample_rows_projected(session, after_sample_id, 100, through_sample_id=last)
+        sample_ids.extend(sample_row.sample_id for sample_row in sample_rows)
+    return sample_ids
+
+
+def test_get_samples_with_igsns(sesar_session: Session):
+    igsns = ["10.58052/IEJEN0040", "10.58052/NOTASAMPLE", "10.58052/EOI00002H", "10.58052/IEJEN0040", "10.60471/ODP02Q1IZ"]
+    samples = list(get_samples_with_igsns(sesar_session, igsns, chunk_size=2))
+    assert [sample.igsn for sample in samples] == ["10.58052/IEJEN0040", "10.58052/EOI00002H", "10.60471/ODP02Q1IZ"]
+
+
+def test_get_sample_rows_after_watermark(session: Session):
+    sample = get_sample_with_id(session, 1)
+    parent_sample = get_sample_with_id(session, 2)
+    assert sample is not None and parent_sample is not None
+    # the parent was updated first, so it sorts first despite the higher sample_id
+    parent_sample.last_update_date = datetime(2023, 1, 1)
+    sample.last_update_date = datetime(2023, 1, 2)
+    session.commit()
+
+    first_page, watermark = get_sample_rows_after_watermark(session, (datetime(2023, 1, 1), -1), 1)
+    assert [sample_row.sample_id for sample_row in first_page] == [2]
+    assert watermark == (datetime(2023, 1, 1), 2)
+
+    second_page, watermark = get_sample_rows_after_watermark(session, watermark, 1)
+    assert [sample_row.sample_id for sample_row in second_page] == [1]
+    assert watermark == (datetime(2023, 1, 2), 1)
+
+    last_page, watermark = get_sample_rows_after_watermark(session, watermark, 1)
+    assert last_page == []
+    assert watermark is None
+
+
+def test_get_removed_samples(session: Session):
+    assert get_removed_samples(session, datetime(2023, 1, 1)) == []
+
+    parent_sample = get_sample_with_id(session, 2)
+    sample = get_sample_with_id(session, 1)
+    assert parent_sample is not None and sample is not None
+    parent_sample.archive_date = datetime(2023, 6, 1)
+    session.add(Sample_Delete_Request(id=1, sample_id=1, deactivated_date=datetime(2022, 6, 1)))
+    # the sample's row is already gone
+    session.add(Sample_Delete_Request(id=2, sample_id=99, deleted_date=datetime(2023, 2, 1)))
+    session.commit()
+
+    assert sorted(get_removed_samples(session, datetime(2023, 1, 1))) == [(2, "10.58052/IE123PARENT"), (99, None)]
+    assert sorted(get_removed_samples(session, datetime(2022, 1, 1))) == [
+        (1, "10.58052/IE123TEST"), (2, "10.58052/IE123PARENT"), (99, None)
+    ]
+    assert get_removed_samples(session, datetime(2022, 1, 1), datetime(2022, 12, 31)) == [(1, "10.58052/IE123TEST")]
+    # archived samples aren't loaded
+    assert count_sample_rows(session) == 1
+    assert [sample.sample_id for chunk in iter_samples(session) for sample in chunk] == [1]
+
+    # an archive date still to come means the sample is published until then
+    parent_sample.archive_date = datetime(2999, 1, 1)
+    session.commit()
+    assert sorted(get_removed_samples(session, datetime(2023, 1, 1))) == [(99, None)]
+    assert count_sample_rows(session) == 2
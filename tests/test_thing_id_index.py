@@ -0,0 +1,87 @@
+import pytest
+
+from isamples_sesar.thing_id_index import ThingIdIndex, thing_id_digest
+
+ROWS = [
+    ("igsn:10.58052/IEDUT103B", 4),
+    ("igsn:10.60471/ODP01LAMY", 1),
+    ("igsn:10.58052/EOI00002H", 3),
+    ("igsn:10.60471/ODP02Q1IZ", 2),
+]
+
+
+def test_thing_id_index_lookups():
+    thing_id_index = ThingIdIndex.from_rows(iter(ROWS))
+    assert len(thing_id_index) == 4
+    assert thing_id_index.num_collisions == 0
+    for thing_id, primary_key in ROWS:
+        assert thing_id in thing_id_index
+        assert thing_id_index.get(thing_id) == primary_key
+        assert thing_id_index[thing_id] == primary_key
+    assert "igsn:10.58052/IEEJR000M" not in thing_id_index
+    assert thing_id_index.get("igsn:10.58052/IEEJR000M") is None
+    assert thing_id_index.get("igsn:10.58052/IEEJR000M", -1) == -1
+    with pytest.raises(KeyError):
+        thing_id_index["igsn:10.58052/IEEJR000M"]
+    assert thing_id_index.max_primary_key == 4
+
+
+def test_thing_id_index_update_and_compact():
+    thing_id_index = ThingIdIndex.from_rows(ROWS)
+    thing_id_index.update({"igsn:10.58052/IEEJR000M": 8, "igsn:10.58052/IEDUT103B": 9})
+    # IEDUT103B is already in the arrays, so it isn't counted twice before the compact, or after
+    assert len(thing_id_index) == 5
+    thing_id_index["igsn:10.58052/IEDUT103B"] = 10
+    assert len(thing_id_index) == 5
+    thing_id_index["igsn:10.58052/IEDUT103B"] = 9
+    assert thing_id_index.get("igsn:10.58052/IEEJR000M") == 8
+    assert thing_id_index.get("igsn:10.58052/IEDUT103B") == 9
+    thing_id_index.compact()
+    # the overflow entry for an id already in the arrays replaced it
+    assert len(thing_id_index) == 5
+    assert thing_id_index.get("igsn:10.58052/IEEJR000M") == 8
+    assert thing_id_index.get("igsn:10.58052/IEDUT103B") == 9
+    assert thing_id_index.max_primary_key == 9
+    assert thing_id_index.primary_key_sum == 1 + 3 + 2 + 8 + 9
+
+
+def test_thing_id_index_snapshot(tmp_path):
+    snapshot_path = str(tmp_path / "thing_ids.npz")
+    thing_id_index = ThingIdIndex.from_rows(ROWS)
+    thing_id_index["igsn:10.58052/IEEJR000M"] = 8
+    thing_id_index.save(snapshot_path)
+    reloaded_index = ThingIdIndex.load(snapshot_path)
+    assert len(reloaded_index) == 5
+    for thing_id, primary_key in ROWS + [("igsn:10.58052/IEEJR000M", 8)]:
+        assert reloaded_index.get(thing_id) == primary_key
+    reloaded_index.add_rows([("igsn:10.58052/IERVTL1I7", 10)])
+    assert reloaded_index.get("igsn:10.58052/IERVTL1I7") == 10
+    assert reloaded_index.max_primary_key == 10
+
+
+def test_empty_thing_id_index():
+    thing_id_index = ThingIdIndex.from_rows([])
+    assert len(thing_id_index) == 0
+    assert thing_id_index.get("igsn:10.58052/IEEJR000M") is None
+    assert thing_id_index.max_primary_key is None
+
+
+def test_thing_id_index_collisions():
+    digest = thing_id_digest("igsn:10.58052/IEEJR000M")
+    assert digest == thing_id_digest("igsn:10.58052/IEEJR000M")
+    assert 0 <= digest < 2 ** 64
+    thing_id_index = ThingIdIndex.from_rows(ROWS + [ROWS[0]])
+    assert thing_id_index.num_collisions == 1
+
+
+def test_thing_id_index_compacts_as_it_grows(monkeypatch):
+    monkeypatch.setattr(ThingIdIndex, "OVERFLOW_COMPACT_SIZE", 3)
+    thing_id_index = ThingIdIndex.from_rows(ROWS)
+    new_rows = {f"igsn:10.58052/NEW{number:06d}": 100 + number for number in range(10)}
+    thing_id_index.update(new_rows)
+    # never more than a couple left waiting in the dict
+    assert len(thing_id_index._overflow) < 3
+    assert len(thing_id_index) == len(ROWS) + len(new_rows)
+    for thing_id, primary_key in [*ROWS, *new_rows.items()]:
+        assert thing_id_index[thing_id] == primary_key
+    assert thing_id_index.max_primary_key == 109
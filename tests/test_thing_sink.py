@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+from sqlmodel import select
+
+from isb_lib.models.thing import Thing  # type: ignore
+from isb_web.sqlmodel_database import SQLModelDAO as iSB_SQLModelDAO  # type: ignore
+from isamples_sesar.sesar_adapter import SESARItem
+from isamples_sesar.thing_sink import ThingUpsertSink, thing_upsert_statement
+
+
+def _things(isb_session):
+    isb_session.expire_all()
+    return {thing.id: thing for thing in isb_session.exec(select(Thing)).all()}
+
+
+def test_upsert_sink():
+    isb_session = iSB_SQLModelDAO("sqlite://").get_session()
+    created = datetime.datetime(2014, 2, 18, 9, 32)
+    sink = ThingUpsertSink(isb_session, SESARItem.AUTHORITY_ID, SESARItem.MEDIA_TYPE, write_batch_size=2)
+    for igsn in ["10.58052/EOI00002H", "10.58052/IEDUT103B", "10.58052/IEEJR000M"]:
+        sink.add_thing({"label": igsn}, f"igsn:{igsn}", f"doi.org/{igsn}", 200, "8f2a", created)
+    # the first two were written as soon as the batch filled up
+    assert sink.num_written == 2
+    sink.finish()
+    assert sink.num_written == 3
+    things = _things(isb_session)
+    assert len(things) == 3
+    primary_keys_by_id = {thing_id: thing.primary_key for thing_id, thing in things.items()}
+    thing = things["igsn:10.58052/IEEJR000M"]
+    assert thing.resolved_content == {"label": "10.58052/IEEJR000M"}
+    assert thing.authority_id == SESARItem.AUTHORITY_ID
+    assert thing.resolved_media_type == SESARItem.MEDIA_TYPE
+    assert thing.tcreated == created
+
+    sink = ThingUpsertSink(isb_session, SESARItem.AUTHORITY_ID, SESARItem.MEDIA_TYPE)
+    sink.add_thing({"label": "old"}, "igsn:10.58052/IEEJR000M", "doi.org/10.58052/IEEJR000M", 200, None, None)
+    sink.add_thing({"label": "new"}, "igsn:10.58052/IEEJR000M", "doi.org/10.58052/IEEJR000M", 200, None, None)
+    sink.add_thing({"label": "new thing"}, "igsn:10.58052/IERVTL1I7", "doi.org/10.58052/IERVTL1I7", 200, None, None)
+    sink.finish()
+    # repeats of an id within a batch collapse to the last one
+    assert sink.num_written == 2
+    things = _things(isb_session)
+    assert len(things) == 4
+    thing = things["igsn:10.58052/IEEJR000M"]
+    assert thing.primary_key == primary_keys_by_id["igsn:10.58052/IEEJR000M"]
+    assert thing.resolved_content == {"label": "new"}
+    assert thing.h3 is None
+    # an update without a creation time keeps the one already there
+    assert thing.tcreated == created
+
+
+def test_upsert_statement_dialects():
+    rows = [{"id": "igsn:10.58052/IEEJR000M", "resolved_status": 200}]
+    assert "ON CONFLICT (id) DO UPDATE" in str(thing_upsert_statement("postgresql", rows))
+    with pytest.raises(ValueError):
+        thing_upsert_statement("mysql", rows)